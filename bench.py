@@ -0,0 +1,426 @@
+"""
+Benchmark the build pipeline on synthetic question banks.
+
+Each size runs in a fresh process: a Q1-style and a Q2-style bank (half of the
+questions each) are generated into a temp dir, then streamed through the same
+stages as convert.main() -- parse, TeX fix, JSON encode, shard write.
+
+    python bench.py                    # 1k / 10k / 100k / 1M, compared with the baseline
+    python bench.py --sizes 1000 10000 # selected sizes only
+    python bench.py --save             # store these results as the new baseline
+    python bench.py --tex [Q2.md]      # fix_question_tex (TeX + Markdown/MathML) micro-benchmark on a real bank
+    python bench.py --decode [10000]   # page-side decode: JSON shards vs binary shards (needs node)
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import struct
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+try:
+    import resource # peak RSS (Unix only)
+except ImportError:
+    resource = None
+
+import convert
+
+BENCH_SIZES = [1000, 10000, 100000, 1000000]
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+CHAPTER_SIZE = 200 # 每章题目数
+SEED = 20240601
+STAGES = ('parse', 'tex', 'encode', 'write')
+
+# --- Synthetic corpus ---
+
+WORDS = ["患儿", "男", "女", "岁", "发热", "咳嗽", "腹泻", "呕吐", "惊厥", "皮疹", "贫血", "黄疸",
+         "查体", "心率", "呼吸", "肝肋下", "血常规", "白细胞", "最可能的诊断是", "首选治疗是",
+         "以下哪项正确", "不正确的是", "新生儿", "婴儿期", "营养不良", "维生素D", "肺炎", "心力衰竭"]
+TEX = ["体温  $39.2°C$  ", "血红蛋白  $102g / L$  ", "血白细胞  $10× 10^{9} / L$  ", "肝肋下  $3.5cm$  ",
+       "10^{9}/L", "身高 \\mathrm{cm} ", "38.5^{\\circ} C", "呼吸 \\sim 40 次", "Ⅲ度 III^{\\circ}"]
+LETTERS = "ABCDE"
+
+def sentence(rng, words=12):
+    text = "".join(rng.choice(WORDS) for _ in range(words))
+    if rng.random() < 0.3:
+        text += "，" + rng.choice(TEX)
+    return text
+
+def write_q1(path, n, rng):
+    """Q1 dialect: "1.[选择题] ..." with inline A:…B:… options and 您的答案是/正确答案是 tails."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# 儿科学教学题库汇总\n\n")
+        for i in range(n):
+            if i % CHAPTER_SIZE == 0:
+                f.write(f"# 第{i // CHAPTER_SIZE + 1}章 选择题\n\n")
+            seq = i % CHAPTER_SIZE + 1
+            ans = rng.choice(LETTERS)
+            opts = "".join(f"{l}:{sentence(rng, 3)}" for l in LETTERS)
+            tail = f"您的答案是：{rng.choice(LETTERS)} 正确答案是：{ans}"
+            f.write(f"{seq}.[选择题] {sentence(rng)}\n\n")
+            if rng.random() < 0.5:
+                f.write(f"{opts}{tail}\n\n")
+            else:
+                f.write(f"{opts}\n\n{tail}\n\n")
+
+def write_q2_options(f, rng):
+    for l in LETTERS:
+        f.write(f"{l}. {sentence(rng, 4)}  \n")
+    f.write("\n")
+
+def write_q2(path, n, rng):
+    """Q2 dialect: 教学要求 / 复习题 / 参考答案 sections with A1, A3/A4 (shared stem) and B1 (shared options) blocks."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# 儿科学学习指导与习题集\n\n")
+        written = 0
+        chapter = 0
+        while written < n:
+            chapter += 1
+            size = min(CHAPTER_SIZE, n - written)
+            f.write(f"# 第{chapter}章\n\n# {sentence(rng, 2)}\n\n# 一、教学要求\n\n# 【教学目的】\n\n")
+            for i in range(3):
+                f.write(f"{i + 1}. 掌握{sentence(rng, 4)}。  \n")
+            f.write("\n# 二、复习题\n\n")
+            answers = []
+            seq = 1
+            while seq <= size:
+                block = rng.random()
+                count = min(rng.randint(2, 4), size - seq + 1)
+                if block < 0.6 or count < 2:
+                    # A1/A2: one stem, own options
+                    f.write(f"【A1型题】\n\n{seq}. {sentence(rng)}\n\n")
+                    write_q2_options(f, rng)
+                    answers.append((seq, rng.choice(LETTERS)))
+                    seq += 1
+                elif block < 0.8:
+                    # A3/A4: shared stem
+                    f.write(f"【A3、A4型题】\n\n{seq}～{seq + count - 1}题干：{sentence(rng)}\n\n")
+                    for k in range(count):
+                        f.write(f"{seq + k}. {sentence(rng, 6)}\n\n")
+                        write_q2_options(f, rng)
+                        answers.append((seq + k, rng.choice(LETTERS)))
+                    seq += count
+                else:
+                    # B1: shared options
+                    f.write(f"【B1型题】\n\n{seq}~{seq + count - 1}题共用备选答案：\n\n")
+                    write_q2_options(f, rng)
+                    for k in range(count):
+                        f.write(f"{seq + k}. {sentence(rng, 6)}  \n")
+                        answers.append((seq + k, rng.choice(LETTERS)))
+                    f.write("\n")
+                    seq += count
+            f.write("# 三、参考答案\n\n")
+            for s, a in answers:
+                f.write(f"{s}. {a}\n\n")
+            written += size
+
+def generate_corpus(root, n, seed=SEED):
+    """Write a Q1 and a Q2 bank with n questions in total; returns BOOK_SOURCES-style entries."""
+    rng = random.Random(seed)
+    q1, q2 = os.path.join(root, 'Q1.md'), os.path.join(root, 'Q2.md')
+    write_q1(q1, n // 2, rng)
+    write_q2(q2, n - n // 2, rng)
+    return [{"id": "q1", "title": "Q1", "files": [q1]}, {"id": "q2", "title": "Q2", "files": [q2]}]
+
+# --- Measurement ---
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_size(n):
+    """
+    Build one synthetic corpus of n questions stage by stage, chapter at a time
+    like convert.write_shards(): one self-contained, content-hashed shard per chapter.
+    """
+    root = tempfile.mkdtemp(prefix='qbank-bench-')
+    try:
+        sources = generate_corpus(root, n)
+        corpus_mb = sum(os.path.getsize(f) for s in sources for f in s['files']) / 1e6
+        shard_dir = os.path.join(root, convert.SHARD_DIR)
+        os.makedirs(shard_dir)
+        times = dict.fromkeys(STAGES, 0.0)
+        questions = 0
+        started = time.perf_counter()
+        store = convert.QuestionStore()
+        for source in sources:
+            chapters = convert.iter_chapters(source['files'])
+            count = 0
+            while True:
+                t0 = time.perf_counter()
+                chap = next(chapters, None)
+                t1 = time.perf_counter()
+                times['parse'] += t1 - t0
+                if chap is None:
+                    break
+                questions += len(chap['questions'])
+                count += 1
+                fixed = convert.fix_chapter_tex(chap)
+                t2 = time.perf_counter()
+                packed = convert.pack_chapter(chap, fixed)
+                if convert.BANK_FORMAT == 'binary':
+                    payload, ext = store.chapter_bin(packed), 'bin'
+                else:
+                    payload, ext = store.chapter_js(packed, emitted=set()).encode('utf-8'), 'json'
+                t3 = time.perf_counter()
+                convert.write_fingerprinted(shard_dir, f"{source['id']}-{count}", ext, payload)
+                t4 = time.perf_counter()
+                times['tex'] += t2 - t1
+                times['encode'] += t3 - t2
+                times['write'] += t4 - t3
+        total = time.perf_counter() - started
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return {
+        "questions": questions,
+        "corpus_mb": round(corpus_mb, 1),
+        "total_s": round(total, 3),
+        "qps": round(questions / total) if total else None,
+        "stages_s": {k: round(v, 3) for k, v in times.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_isolated(n):
+    """Run one size in a fresh interpreter so peak RSS belongs to that size alone."""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(n)],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        raise RuntimeError(f"bench size {n} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def run_tex(path, repeat=10):
+    """
+    fix_question_tex throughput (fix_tex, Markdown and MathML rendering) over every
+    text field of a real bank, with all three memo caches cleared before each run.
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        chapters = convert.convert_to_json([path])
+    questions = [q for c in chapters for q in c['questions']]
+    texts = sum(3 + len(q.options) for q in questions)
+    with open(path, encoding='utf-8') as f:
+        dollars = f.read().count('$')
+    best = None
+    for _ in range(repeat):
+        for memo in (convert.fix_tex, convert.markdown_html, convert.tex_html):
+            clear = getattr(memo, 'cache_clear', None)
+            if clear: clear()
+        started = time.perf_counter()
+        for q in questions:
+            convert.fix_question_tex(q)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "file": os.path.basename(path),
+        "dollars": dollars,
+        "texts": texts,
+        "best_s": round(best, 4),
+        "texts_per_s": round(texts / best),
+    }
+
+# Runs the page's decodeChapter (convert.BIN_DECODER_JS) against JSON.parse under node --expose-gc.
+# Heap is measured after a forced GC with the decoded chapters still referenced; "read all"
+# then touches every field of every question, which the lazy binary decoder defers.
+DECODE_BENCH_JS = r"""
+const fs = require('fs');
+const [jsonPath, binPath, repeat] = process.argv.slice(2);
+const text = fs.readFileSync(jsonPath, 'utf8');
+const raw = fs.readFileSync(binPath);
+const buffers = []; // one ArrayBuffer per chapter, as fetched
+for (let off = 0; off < raw.length;) {
+    const len = raw.readUInt32LE(off);
+    buffers.push(raw.buffer.slice(raw.byteOffset + off + 4, raw.byteOffset + off + 4 + len));
+    off += 4 + len + (-len & 3);
+}
+function readAll(chapters) {
+    let n = 0;
+    for (const c of chapters) for (const q of c.questions) {
+        n += q.id.length + q.title.length + (q.analysis || '').length + q.type.length + (q.seq || '').length;
+        for (const o of q.options || []) n += o.label.length + o.text.length;
+    }
+    return n;
+}
+function heapMB() {
+    global.gc();
+    return process.memoryUsage().heapUsed / 1048576;
+}
+let retained = null; // keeps decoded chapters reachable across the forced GCs
+function measure(decode) {
+    const r = { decode_ms: Infinity, read_all_ms: Infinity };
+    for (let i = 0; i < +repeat; i++) {
+        const t0 = performance.now();
+        const chapters = decode();
+        const t1 = performance.now();
+        readAll(chapters);
+        const t2 = performance.now();
+        r.decode_ms = Math.min(r.decode_ms, t1 - t0);
+        r.read_all_ms = Math.min(r.read_all_ms, t2 - t0);
+    }
+    const h0 = heapMB();
+    retained = decode();
+    r.heap_mb = heapMB() - h0;
+    readAll(retained);
+    r.heap_read_mb = heapMB() - h0;
+    retained = null;
+    for (const k in r) r[k] = Math.round(r[k] * 100) / 100;
+    return r;
+}
+console.log(JSON.stringify({
+    json: measure(() => JSON.parse(text)),
+    binary: measure(() => buffers.map(decodeChapter)),
+}));
+"""
+
+def run_decode(n, repeat=5):
+    """Encode a synthetic bank both ways (one self-contained shard per chapter) and time the page decoders."""
+    node = shutil.which('node')
+    if not node:
+        raise RuntimeError("node not found: --decode runs the page decoder under Node.js")
+    root = tempfile.mkdtemp(prefix='qbank-decode-')
+    try:
+        sources = generate_corpus(root, n)
+        store = convert.QuestionStore()
+        json_parts, bin_parts = [], []
+        with contextlib.redirect_stdout(sys.stderr):
+            for source in sources:
+                for chap in convert.iter_chapters(source['files']):
+                    packed = convert.encode_chapter(chap)
+                    json_parts.append(store.chapter_js(packed, emitted=set()))
+                    bin_parts.append(store.chapter_bin(packed))
+        json_path, bin_path, js_path = (os.path.join(root, name) for name in ('bank.json', 'bank.bin', 'decode.js'))
+        with open(json_path, 'w', encoding='utf-8') as f:
+            f.write('[' + ', '.join(json_parts) + ']')
+        with open(bin_path, 'wb') as f:
+            for part in bin_parts:
+                f.write(struct.pack('<I', len(part)) + part + b'\0' * (-len(part) % 4))
+        with open(js_path, 'w', encoding='utf-8') as f:
+            f.write(convert.BIN_DECODER_JS + DECODE_BENCH_JS)
+        proc = subprocess.run([node, '--expose-gc', js_path, json_path, bin_path, str(repeat)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"decode benchmark failed:\n{proc.stderr}")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result.update({
+            "questions": n,
+            "json_mb": round(os.path.getsize(json_path) / 1e6, 2),
+            "binary_mb": round(sum(map(len, bin_parts)) / 1e6, 2),
+        })
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return result
+
+# --- Reporting ---
+
+def delta(now, base):
+    if not base or now is None:
+        return ""
+    return f" ({(now - base) / base * 100:+.0f}%)"
+
+def report(results, baseline):
+    base = baseline.get('results', {}) if baseline else {}
+    print(f"{'questions':>10} {'qps':>16} {'total s':>14} " + " ".join(f"{s:>8}" for s in STAGES) + f" {'peak MB':>14}")
+    for size, r in results.items():
+        b = base.get(size, {})
+        stages = " ".join(f"{r['stages_s'][s]:>8.3f}" for s in STAGES)
+        print(f"{r['questions']:>10} {r['qps']:>9}{delta(r['qps'], b.get('qps')):>7} "
+              f"{r['total_s']:>7.3f}{delta(r['total_s'], b.get('total_s')):>7} {stages} "
+              f"{r['peak_rss_mb']!s:>7}{delta(r['peak_rss_mb'], b.get('peak_rss_mb')):>7}")
+
+def report_tex(r, baseline):
+    b = (baseline or {}).get('tex', {})
+    print(f"fix_question_tex on {r['file']} ({r['dollars']} '$', {r['texts']} text fields): "
+          f"{r['best_s'] * 1000:.1f} ms{delta(r['best_s'], b.get('best_s'))}, "
+          f"{r['texts_per_s']} texts/s{delta(r['texts_per_s'], b.get('texts_per_s'))}")
+
+def report_decode(r, baseline):
+    b = (baseline or {}).get('decode', {})
+    b = b if b.get('questions') == r['questions'] else {}
+    print(f"Decode {r['questions']} questions (JSON {r['json_mb']} MB, binary {r['binary_mb']} MB):")
+    print(f"{'':>8} {'decode ms':>16} {'heap MB':>16} {'read all ms':>16} {'heap MB':>16}")
+    for fmt in ('json', 'binary'):
+        m, mb = r[fmt], b.get(fmt, {})
+        print(f"{fmt:>8} " + " ".join(f"{m[k]:>9.2f}{delta(m[k], mb.get(k)):>7}"
+                                      for k in ('decode_ms', 'heap_mb', 'read_all_ms', 'heap_read_mb')))
+
+def save_baseline(baseline, key, value):
+    baseline = dict(baseline or {})
+    baseline.update({"python": platform.python_version(), "machine": platform.machine(), key: value})
+    with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+    print(f"Baseline saved to {BASELINE_FILE}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark convert.py on synthetic question banks.")
+    ap.add_argument('--sizes', type=int, nargs='+', default=BENCH_SIZES)
+    ap.add_argument('--save', action='store_true', help=f"write results to {os.path.basename(BASELINE_FILE)}")
+    ap.add_argument('--max-slowdown', type=float, metavar='PCT',
+                    help="exit 1 if any size is more than PCT%% slower than the baseline")
+    ap.add_argument('--tex', nargs='?', const='Q2.md', metavar='FILE',
+                    help="run the fix_question_tex micro-benchmark on FILE (default Q2.md) instead")
+    ap.add_argument('--decode', nargs='?', type=int, const=10000, metavar='N',
+                    help="compare page-side decoding of JSON and binary shards for N questions (default 10000)")
+    ap.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        # Child process: convert.py's own progress output goes to stderr, the result is the last stdout line
+        real_stdout, sys.stdout = sys.stdout, sys.stderr
+        result = run_size(args.child)
+        sys.stdout = real_stdout
+        print(json.dumps(result))
+        return 0
+
+    baseline = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if args.tex:
+        result = run_tex(args.tex)
+        report_tex(result, baseline)
+        if args.save:
+            save_baseline(baseline, 'tex', result)
+        return 0
+
+    if args.decode:
+        result = run_decode(args.decode)
+        report_decode(result, baseline)
+        if args.save:
+            save_baseline(baseline, 'decode', result)
+        return 0
+
+    base = (baseline or {}).get('results', {})
+    if args.max_slowdown is not None and not any(str(n) in base for n in args.sizes):
+        print(f"Error: --max-slowdown needs baseline results for {', '.join(map(str, args.sizes))} "
+              f"in {os.path.basename(BASELINE_FILE)}; run with --save first")
+        return 2
+
+    results = {}
+    for n in args.sizes:
+        print(f"Benchmarking {n} questions...", flush=True)
+        results[str(n)] = run_isolated(n)
+    report(results, baseline)
+
+    if args.save:
+        saved = dict(baseline.get('results', {})) if baseline else {}
+        saved.update(results)
+        save_baseline(baseline, 'results', saved)
+
+    if args.max_slowdown is not None:
+        slow = [n for n, r in results.items() if n in base
+                and r['total_s'] > base[n]['total_s'] * (1 + args.max_slowdown / 100)]
+        if slow:
+            print(f"Warning: slower than baseline by more than {args.max_slowdown}% at: {', '.join(slow)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
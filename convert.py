@@ -1,20 +1,75 @@
 import re
+import sys
 import json
 import hashlib
 import os
+import time
+import gzip
+import html
+import heapq
+import itertools
+import functools
+import struct
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import brotli # 可选: pip install brotli (生成 .br 预压缩文件)
+except ImportError:
+    brotli = None
+
+try:
+    import latex2mathml.converter # 可选: pip install latex2mathml (构建时 TeX -> MathML)
+except ImportError:
+    latex2mathml = None
 
 # =================配置区域=================
-# 输入文件列表 (按顺序合并)
-INPUT_FILES = ['Q1.md', 'Q2.md'] 
+# 题库列表：每本书的源文件按顺序合并
+BOOK_SOURCES = [
+    {"id": "q1", "title": "儿科学（题库1）", "files": ['Q1.md']},
+    {"id": "q2", "title": "儿科学习题集（题库2）", "files": ['Q2.md']},
+]
 OUTPUT_DIR = 'dist'
 OUTPUT_HTML = 'index.html'
 DOMAIN = "https://PediatricsQBank.heihaheihaha.com"
 # DOMAIN = "" # Use relative path for API calls
+CACHE_DIR = '.build_cache' # 增量构建缓存目录 (设为 None 关闭缓存)
+PARALLEL_WORKERS = os.cpu_count() or 1 # 并行解析进程数 (<= 1 为串行解析)
+SHARDED_OUTPUT = True # 按章节分片输出到 dist/data/ 并按需加载 (False 则全部内联到 index.html)
+SHARD_DIR = 'data'
+BANK_FORMAT = 'json' # 分片格式: 'json'，或 'binary' (列式二进制，低端手机上解析更快，仅分片模式)
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates') # 页面模板: index.html, app.css, app.js
+ASSET_DIR = 'assets' # 构建出的 JS/CSS (压缩，文件名含内容哈希)
+MANIFEST_FILE = 'manifest.json'
+SERVICE_WORKER = 'sw.js' # 离线缓存: 预缓存页面外壳，题库数据缓存优先
+ASSET_MANIFEST = 'asset-manifest.json' # 本次构建产物及其内容哈希
+CHANGELOG_FILE = 'changelog.json' # 与上次构建相比各章节新增/删除/修改的题目 ID
+CHANGELOG_KEEP = 20 # changelog 保留的最近构建次数
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable" # 带内容哈希的文件: 缓存一年
+REVALIDATE_CACHE = "no-cache" # 入口 HTML / 清单: 每次回源校验
+PRECOMPRESS = True # 为文本产物生成最高压缩级别的 .gz / .br 文件
+# 体积预算 (gzip 字节)，超出则构建失败；某项设为 None 则不检查
+SIZE_BUDGET = {
+    "entry": 64 * 1024,     # index.html + JS/CSS (仅分片模式检查，内联模式下入口包含全部题目)
+    "chapter": 128 * 1024,  # 单个章节
+    "book": 1024 * 1024,    # 每本书合计
+}
+HEAVIEST_QUESTIONS = 5 # 体积报告中列出解析最长的题目数
+SEARCH_FIELD_WEIGHTS = (3, 1, 1) # 搜索索引中 题干 / 选项 / 解析 每次出现的权重
+SEARCH_SNIPPET_CHARS = 48 # 搜索索引中每题附带的题干摘要长度 (结果列表直接显示，不必下载章节)
+MARKED_CDN = "https://cdn.jsdelivr.net/npm/marked/marked.min.js" # 仅评论使用，按需加载
+MATHJAX_CDN = "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js" # 仅评论及未能转换的公式使用，按需加载
 # =========================================
 
+# 构建指纹：convert.py 任何改动都会使缓存整体失效
+with open(__file__, 'rb') as _f:
+    BUILD_FINGERPRINT = hashlib.sha1(_f.read()).hexdigest()
+
+re_whitespace = re.compile(r'\s+')
+
 def generate_hash_id(text):
     """生成的ID仅依赖题目文本内容，确保题目顺序调整不影响历史记录"""
-    clean_text = re.sub(r'\s+', '', text)
+    clean_text = re_whitespace.sub('', text)
     return hashlib.md5(clean_text.encode('utf-8')).hexdigest()[:12]
 
 def finalize_question(q):
@@ -44,463 +99,845 @@ def finalize_question(q):
 # based on the provided code edit.
 
 # 正则预编译
-re_chapter = re.compile(r'^#\s+(.*)')
-re_question_start = re.compile(r'^(\d+)[\.．]\s*(.*)')
 re_option = re.compile(r'^\s*([A-F])[:\.\、]\s*(.*)')
 re_answer = re.compile(r'^\s*(?:参考)?答案[:：]\s*([A-Z, ]+)')
 re_analysis = re.compile(r'^\s*解析[:：]\s*(.*)')
-re_case_q_start = re.compile(r'^(\d+)[\.．]\s*(.*)')
-# New: Group Header for Type B (Shared Options) or Type A3/A4 (Shared Stem)
-# Matches: "5~6题共用备选答案" or "30～31题干" or "$50\sim 54$题..."
-re_group_header = re.compile(r'^\s*\$?(\d+)\s*(?:[~～-]|\\sim)\s*\$?(\d+)\s*.*(?:题)?(?:共用)?(备选答案|题干).*')
-
 
-def convert_to_json(md_files):
-    # Local Regex Definitions to avoid scope issues
-    re_inline_opt = re.compile(r'([A-G])[:\.\、]\s*(.*?)(?=\s*[A-G][:\.\、]|\s*您的答案|\s*正确答案|$)', re.DOTALL)
-    re_ans_tail = re.compile(r'\s*(?:您的答案.*)?(?:正确)?答案(?:是)?[:：]\s*([A-Z]+)', re.IGNORECASE)
-    re_full_ans_line = re.compile(r'^\s*(?:您的答案.*)?(?:正确)?(?:参考)?答案(?:是)?[:：]\s*([A-Z, ]+)', re.IGNORECASE)
-
-    all_chapters = []
-    
-    for f_path in md_files:
-        print(f"Processing {f_path}...")
-        if not os.path.exists(f_path):
-            print(f"Warning: {f_path} not found.")
-            continue
-
-        with open(f_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            
-        current_chapter = None
-        current_q = None
-        in_noun_exp = False
-        in_case_analysis = False
-        in_requirements = False # New state for Teaching Objectives
-        in_ref_answers = False # New state for Reference Answers
+# Inline options / answer tails (Q1: "A:xxx B:xxx 您的答案是：A 正确答案是：A")
+re_inline_opt = re.compile(r'([A-G])[:\.\、]\s*(.*?)(?=\s*[A-G][:\.\、]|\s*您的答案|\s*正确答案|$)', re.DOTALL)
+re_inline_opt_ae = re.compile(r'([A-E])[:\.\、]\s*(.*?)(?=\s*[A-E][:\.\、]|\s*您的答案|\s*正确答案|$)', re.DOTALL)
+re_ans_tail = re.compile(r'\s*(?:您的答案.*)?(?:正确)?答案(?:是)?[:：]\s*([A-Z]+)', re.IGNORECASE)
+re_your_ans_tail = re.compile(r'\s*(您的答案.*)$')
+re_real_ans = re.compile(r'正确答案(?:是)?[:：]\s*([A-Z]+)')
+re_opt_prefix = re.compile(r'^[A-G][:.]')
+re_option_run = re.compile(r'[A-G][:\.\、]')
+# Reference answers (Q2): "1. C 2. D" or "1.C"
+re_ref_answer = re.compile(r'(\d+)[\.．]\s*([A-Za-z]+)')
+# Headers that never open a new chapter
+re_ignored_header = re.compile(r'^(目录|儿科学|学习指导|第.版|副?主编|编者|学术秘书|[一二三四五六七八九十]+、|【|（)')
+re_chapter_no = re.compile(r'^第[一二三四五六七八九十0-9]+章')
+re_section_no = re.compile(r'^[一二三四五六七八九十]+、')
+re_seq_prefix = re.compile(r'^(\d+)')
+re_short_answer = re.compile(r'^(.*?[。？!])\s+(.*[\u4e00-\u9fa5].*)$')
+
+# 行分类器：每行只匹配一次，lastgroup 即行类别。
+# 分支顺序即优先级（与原先 if 级联的判断顺序一致）。
+# group 匹配 B 型题共用备选答案或 A3/A4 型共用题干: "5~6题共用备选答案"、"30～31题干"、"$50\sim 54$题..."
+re_line_kind = re.compile(
+    r'^(?:'
+    r'(?P<group>\s*\$?(?P<group_start>\d+)\s*(?:[~～-]|\\sim)\s*\$?(?P<group_end>\d+)\s*.*(?:题)?(?:共用)?(?P<group_kind>备选答案|题干))'
+    r'|(?P<chapter>#\s+(?P<chapter_title>.*))'
+    r'|(?P<question>(?P<question_seq>\d+)[\.．]\s*(?P<question_text>.*))'
+    r'|(?P<answer>(?i:\s*(?:您的答案.*)?(?:正确)?(?:参考)?答案(?:是)?[:：]\s*(?P<answer_keys>[A-Z, ]+)))'
+    r'|(?P<text>)'
+    r')'
+)
+
+NOUN_EXIT_KEYWORDS = ("简答题", "病例分析", "问答题", "选择题", "复习题")
+
+
+class Question:
+    """
+    Finalized question record. Options are a tuple of (label, text) pairs;
+    members of a shared-option group reference one table instead of copies.
+    to_dict() gives the emitted JSON shape (same keys, same order).
+    """
+    __slots__ = ('id', 'seq', 'title', 'options', 'answer', 'analysis', 'type', 'group_id')
+
+    def __init__(self, id, seq, title, options, answer, analysis, type, group_id=None):
+        self.id = id
+        self.seq = seq
+        self.title = title
+        self.options = options
+        self.answer = answer
+        self.analysis = analysis
+        self.type = type
+        self.group_id = group_id
+
+    def to_dict(self):
+        d = {
+            "id": self.id,
+            "seq": self.seq,
+            "title": self.title,
+            "options": [{"label": label, "text": text} for label, text in self.options],
+            "answer": self.answer,
+            "analysis": self.analysis,
+            "type": self.type
+        }
+        if self.group_id is not None: d["group_id"] = self.group_id
+        return d
+
+    @classmethod
+    def from_dict(cls, d, tables=None):
+        """Rebuild from to_dict() output; `tables` interns identical option tables."""
+        options = tuple((o['label'], o['text']) for o in d['options'])
+        if tables is not None:
+            options = tables.setdefault(options, options)
+        return cls(d['id'], d['seq'], d['title'], options, d['answer'], d['analysis'], d['type'], d.get('group_id'))
+
+def option_table(opts):
+    """Option dicts -> compact (label, text) table; texts are interned so repeats share storage."""
+    return tuple((o['label'], sys.intern(o['text'])) for o in opts)
+
+
+class BankParser:
+    """
+    Line-driven state machine behind convert_to_json.
+    Each stripped line is classified once by re_line_kind, then routed by the
+    active mode (教学要求 / 名词解释 / 病例分析 / 参考答案) and its line kind.
+    """
+
+    def __init__(self):
+        self.chapters = []
+        # 历史行为：第一行自由文本之后，行内选项解析改用 "您的答案..." 尾部与 A-E 选项。
+        # 题目 ID 由题干+选项生成（答题记录以 ID 为键），因此保留该切换以保证输出不变。
+        self.legacy_inline = False
+        # 参考答案索引: seq -> 本章第一道该序号的题目 (随题目追加增量更新)
+        self.index_chapter = None
+        self.seq_index = {}
+        self.indexed = 0
+        self.answered = set()
+        self.answer_issues = [] # (chapter title, 'unresolved' | 'duplicate', seq)
+        self.start_file(None)
+
+    def start_file(self, f_path, first_line=None):
+        """Reset per-file state; chapters and legacy_inline carry over between files."""
+        self.current_chapter = None
+        self.current_q = None
+        self.in_noun_exp = False
+        self.in_case_analysis = False
+        self.in_requirements = False # Teaching Objectives
+        self.in_ref_answers = False # Reference Answers
 
         # Group Context State
-        group_info = {
+        self.group_info = {
             'active': False,
             'start': 0,
             'end': 0,
             'type': '', # 'options' or 'stem'
             'data': [], # list of opts for 'options', string for 'stem'
-            'stem_text': '' 
+            'stem_text': '',
+            'table': None, # interned option table (+ group_id) shared by members
         }
 
-        def finalize_question(q):
-            if not q: return None
-
-            # --- Short Answer Split Logic ---
-            match_sa = re.match(r'^(.*?[。？!])\s+(.*[\u4e00-\u9fa5].*)$', q["title"])
-            # Only apply if it looks like a Short Answer (no options yet) and has long trailing text
-            if match_sa and not q['options']:
-                title_part = match_sa.group(1)
-                ans_part = match_sa.group(2)
-                # Heuristic to ensure we don't split titles that just have punctuation
-                if "意识：" in ans_part or "分）" in ans_part or "分)" in ans_part or len(ans_part) > 10:
-                    q["title"] = title_part
-                    q["analysis"] = ans_part + "\n" + q["analysis"]
-                    q["type"] = "mix"
-            # --------------------------------
-
-            # If Q is within active group range, apply group data
-            if group_info['active'] and q.get('seq'):
-                try:
-                    # Seq might be "5" or "5." or "119"
-                    seq = int(q['seq'])
-                    if group_info['start'] <= seq <= group_info['end']:
-                        # Apply Shared Options
-                        if group_info['type'] == 'options' and not q['options']:
-                            # Copied list of options
-                            q['options'] = [o.copy() for o in group_info['data']]
-                            # Assign Group ID for frontend rendering
-                            # Generate deterministic hash based on options content
-                            opt_str = json.dumps(group_info['data'], sort_keys=True)
-                            q['group_id'] = hashlib.md5(opt_str.encode('utf-8')).hexdigest()[:8]
-                            
-                            if q['type'] == 'essay': q['type'] = 'single' # Assume single/multi if options exist
-                        
-                        # Apply Shared Stem
-                        elif group_info['type'] == 'stem':
-                            q['title'] =  f"(题干) {group_info['stem_text']}\n\n{q['title']}"
-                except ValueError: 
-                    pass
-            
-            # Post-process Type
-            if q['options']:
-                q['type'] = 'single'
-                if q['answer'] and len(q['answer']) > 1: q['type'] = 'multi'
-            elif q['type'] == 'single':
-                q['type'] = 'mix' # Default to mix if no options
-
-            # Generate ID
-            full_content = q['title'] + "".join([o['text'] for o in q['options']])
-            q['id'] = generate_hash_id(full_content)
-
-            return q
-
+        if f_path is None: return
         # Ensure default chapter exists if needed
-        if not all_chapters and (not lines or not lines[0].strip().startswith('#')):
-            current_chapter = {"title": f"文档 {f_path}", "questions": [], "desc": ""}
-            all_chapters.append(current_chapter)
-        elif all_chapters and (not lines or not lines[0].strip().startswith('#')):
-            current_chapter = all_chapters[-1]
-
-        for line in lines:
-            line = line.strip()
-            if not line: continue
-            
-            # --- Teaching Requirements Mode ---
-            if in_requirements:
-                 if line.startswith('# '):
-                      if "复习题" in line or any(k in line for k in ["选择题", "简答题"]):
-                           in_requirements = False
-                           # Fall through to normal processing to handle the new section header
-                      elif "教学要求" in line or "【" in line or "（" in line:
-                           # Ignore inner headers like # 【教学目的】 or # （一）
-                           continue
-                      else:
-                           # Weird header found? Exit mode just in case
-                           in_requirements = False
-                 
-                 # If still in requirements, append text to Desc
-                 if in_requirements:
-                      if "desc" not in current_chapter: current_chapter["desc"] = ""
-                      current_chapter["desc"] += line + "<br>"
-                      continue
-            # ----------------------------------
-
-            # --- Noun Explanation Mode ---
-            if in_noun_exp:
-                if line.startswith('# '):
-                   if any(k in line for k in ["简答题", "病例分析", "问答题", "选择题", "复习题"]):
-                       in_noun_exp = False
-                   else:
-                        if current_q:
-                            finalize_question(current_q)
-                            current_chapter["questions"].append(current_q)
-                        
-                        term = line.replace('#', '').strip()
-                        current_q = {
-                            "id": "",
-                            "seq": "",
-                            "title": term,
-                            "options": [],
-                            "answer": "见解析",
-                            "analysis": "",
-                            "type": "essay"
-                        }
-                        continue
-                else:
-                    if current_q: current_q["analysis"] += line + "\n"
-                    continue
-            # -----------------------------
-            
-            # --- Case Analysis Mode ---
-            if in_case_analysis:
-                 if line.startswith('# '):
-                      if any(k in line for k in ["选择题", "复习题"]):
-                           in_case_analysis = False
-                 else:
-                      match_cq = re_case_q_start.match(line)
-                      # Check if it looks like a new question (and not validation text)
-                      if match_cq and not line.startswith('答') and "答案" not in line[:5]: 
-                          # FIX: Check if it's a valid next question (must be sequential)
-                          # If we have a current question, ensure the new one is greater.
-                          is_valid_new_q = True
-                          if current_q and current_q.get('seq'):
-                              try:
-                                  curr_seq = int(current_q['seq'])
-                                  new_seq = int(match_cq.group(1))
-                                  # If new sequence is not greater, it's likely a list item in the answer/analysis
-                                  if new_seq <= curr_seq:
-                                      is_valid_new_q = False
-                              except ValueError:
-                                  pass # If seq is not int, safely ignore and assume valid
-                          
-                          if is_valid_new_q:
-                               if current_q:
-                                  finalize_question(current_q)
-                                  current_chapter["questions"].append(current_q)
-                               
-                               current_q = {
-                                   "id": "",
-                                   "seq": match_cq.group(1),
-                                   "title": match_cq.group(2),
-                                   "options": [],
-                                   "answer": "",
-                                   "analysis": "",
-                                   "type": "case" 
-                               }
-                               continue
-
-                      
-                      # Append to Analysis or Title
-                      if current_q:
-                           if current_q["analysis"] or line.startswith("答") or "答案" in line[:8]:
-                               current_q["analysis"] += "\n" + line
-                           else:
-                               current_q["title"] += "\n" + line
-                      continue
-            # -----------------------------
-
-            # 0. Check for Group Header (Shared Options/Stem)
-            match_group = re_group_header.match(line)
-            if match_group:
-                if current_q:
-                    current_q['seq'] = current_q.get('seq') or (re.match(r'^(\d+)', current_q['title']).group(1) if re.match(r'^(\d+)', current_q['title']) else None)
-                    finalize_question(current_q)
-                    current_chapter["questions"].append(current_q)
-                    current_q = None
-                
-                group_info = {
-                    'active': True,
-                    'start': int(match_group.group(1)),
-                    'end': int(match_group.group(2)),
-                    'type': 'options' if '备选答案' in match_group.group(3) else 'stem',
-                    'data': [],
-                    'stem_text': line.split('：')[-1] if '：' in line else ''
-                }
-                continue
-
-
-            # 1. 章节
-            match_chap = re_chapter.match(line)
-            if match_chap:
-                title = match_chap.group(1).strip()
-                
-                # Check for headers to ignore as new chapters
-                if re.match(r'^(目录|儿科学|学习指导|第.版|副?主编|编者|学术秘书|[一二三四五六七八九十]+、|【|（)', title):
-                    # Check for Teaching Requirements Section start
-                    if "教学要求" in title:
-                        in_requirements = True
-                        if "desc" not in current_chapter: current_chapter["desc"] = ""
-                    
-                    # Check for Reference Answers (Q2 format)
-                    if "参考答案" in title:
-                        # CRITICAL FIX: Finalize pending question (e.g. Q6) BEFORE resetting group_info
-                        if current_q:
-                             # Ensure we use the current group_info before it gets killed
-                             current_q['seq'] = current_q.get('seq') or (re.match(r'^(\d+)', current_q['title']).group(1) if re.match(r'^(\d+)', current_q['title']) else None)
-                             finalize_question(current_q)
-                             current_chapter["questions"].append(current_q)
-                             current_q = None
-                        
-                        in_ref_answers = True
-                        in_case_analysis = False
-                        in_noun_exp = False
-                        in_requirements = False
-                        # We don't continue here because we want to reset group_info below
-                        
-                    if title.startswith('【') or re.match(r'^[一二三四五六七八九十]+、', title):
-                        group_info['active'] = False
-                        group_info['data'] = []
-                        group_info['stem_text'] = ''
-                    continue
+        if first_line is None or not first_line.strip().startswith('#'):
+            if not self.chapters:
+                self.current_chapter = {"title": f"文档 {f_path}", "questions": [], "desc": ""}
+                self.chapters.append(self.current_chapter)
+            else:
+                self.current_chapter = self.chapters[-1]
+
+    # ---------------- Question lifecycle ----------------
+
+    def finalize_question(self, q):
+        """Apply group context and type rules to the pending question dict; returns a Question."""
+        if not q: return None
+        group_info = self.group_info
+        options = None
+        group_id = None
+
+        # --- Short Answer Split Logic ---
+        match_sa = re_short_answer.match(q["title"])
+        # Only apply if it looks like a Short Answer (no options yet) and has long trailing text
+        if match_sa and not q['options']:
+            title_part = match_sa.group(1)
+            ans_part = match_sa.group(2)
+            # Heuristic to ensure we don't split titles that just have punctuation
+            if "意识：" in ans_part or "分）" in ans_part or "分)" in ans_part or len(ans_part) > 10:
+                q["title"] = title_part
+                q["analysis"] = ans_part + "\n" + q["analysis"]
+                q["type"] = "mix"
+        # --------------------------------
+
+        # If Q is within active group range, apply group data
+        if group_info['active'] and q.get('seq'):
+            try:
+                # Seq might be "5" or "5." or "119"
+                seq = int(q['seq'])
+                if group_info['start'] <= seq <= group_info['end']:
+                    # Apply Shared Options
+                    if group_info['type'] == 'options' and not q['options']:
+                        # Shared table (snapshot of the group's options as of now)
+                        options, group_id = self.group_table()
+
+                        if q['type'] == 'essay': q['type'] = 'single' # Assume single/multi if options exist
+
+                    # Apply Shared Stem
+                    elif group_info['type'] == 'stem':
+                        q['title'] =  f"(题干) {group_info['stem_text']}\n\n{q['title']}"
+            except ValueError:
+                pass
+
+        if options is None:
+            options = option_table(q['options'])
+
+        # Post-process Type
+        if options:
+            q['type'] = 'single'
+            if q['answer'] and len(q['answer']) > 1: q['type'] = 'multi'
+        elif q['type'] == 'single':
+            q['type'] = 'mix' # Default to mix if no options
+
+        # Generate ID
+        full_content = q['title'] + "".join([text for _, text in options])
+        seq = q['seq']
+        return Question(
+            generate_hash_id(full_content),
+            sys.intern(seq) if seq else seq,
+            q['title'],
+            options,
+            q['answer'],
+            q['analysis'],
+            q['type'],
+            group_id,
+        )
+
+    def group_table(self):
+        """Interned (options, group_id) for the active shared-option group."""
+        group_info = self.group_info
+        options = option_table(group_info['data'])
+        cached = group_info['table']
+        if cached and cached[0] == options:
+            return cached
+        # Assign Group ID for frontend rendering
+        # Generate deterministic hash based on options content
+        opt_str = json.dumps(group_info['data'], sort_keys=True)
+        group_info['table'] = (options, hashlib.md5(opt_str.encode('utf-8')).hexdigest()[:8])
+        return group_info['table']
+
+    def commit_question(self, fill_seq=False):
+        """Finalize the pending question into the current chapter."""
+        q = self.current_q
+        if fill_seq:
+            m = re_seq_prefix.match(q['title'])
+            q['seq'] = q.get('seq') or (m.group(1) if m else None)
+        self.current_chapter["questions"].append(self.finalize_question(q))
+        self.current_q = None
+
+    def end_segment(self):
+        """Close a cached segment the way the following "# 第X章" header would."""
+        self.reset_group()
+        if self.current_q and self.current_chapter:
+            self.commit_question(fill_seq=True)
+
+    def snapshot(self):
+        """Mode flags that decide whether the next chapter header is taken as a real chapter."""
+        return {
+            'in_requirements': self.in_requirements,
+            'in_noun_exp': self.in_noun_exp,
+            'legacy_inline': self.legacy_inline,
+        }
 
-                # Reset Group Info on REAL Chapter Change
-                group_info['active'] = False
-                group_info['data'] = []
-                group_info['stem_text'] = ''
-                
-                # Turn off Answer Mode on new chapter
-                in_ref_answers = False
-                
-                # Logic to Merge Subtitle
-                if current_chapter and not current_chapter['questions']:
-                     if re.match(r'^第[一二三四五六七八九十0-9]+章', current_chapter['title']):
-                          if not re.match(r'^第[一二三四五六七八九十0-9]+章', title):
-                               current_chapter['title'] += " " + title
-                               continue
-
-                # Modes Check
-                if "名词解释" in title:
-                    in_noun_exp = True
-                    in_case_analysis = False
-                    in_requirements = False
-                elif "病例分析" in title or "问答题" in title:
-                    in_case_analysis = True
-                    in_noun_exp = False
-                    in_requirements = False
-                else:
-                    in_noun_exp = False
-                    in_case_analysis = False
-                    in_requirements = False
+    def reset_group(self):
+        self.group_info['active'] = False
+        self.group_info['data'] = []
+        self.group_info['stem_text'] = ''
+        self.group_info['table'] = None
 
-                # If we have a pending question, finalize it before starting new chapter
-                if current_q and current_chapter:
-                    current_q['seq'] = current_q.get('seq') or (re.match(r'^(\d+)', current_q['title']).group(1) if re.match(r'^(\d+)', current_q['title']) else None)
-                    finalize_question(current_q)
-                    current_chapter["questions"].append(current_q)
-                    current_q = None
-                
-                current_chapter = {"title": title, "questions": [], "desc": ""}
-                all_chapters.append(current_chapter)
-                continue
+    # ---------------- Line dispatch ----------------
 
-            # --- Reference Answers Mode ---
-            if in_ref_answers:
-                 if line.startswith('# '):
-                       # If we hit another header that isn't answers
-                       pass # Let normal header logic handle it (and unset in_ref_answers)
-                 else:
-                       # Parse Answer Lines: "1. C 2. D" or "1.C"
-                       # Use findall to catch multiple answers per line
-                       # Regex: (\d+)[\.．]\s*([A-Za-z]+)
-                       ans_matches = re.findall(r'(\d+)[\.．]\s*([A-Za-z]+)', line)
-                       if ans_matches:
-                           for seq, ans in ans_matches:
-                                # Find question in current chapter with this seq
-                                found_q = False
-                                for q in current_chapter['questions']:
-                                     if str(q['seq']) == str(seq): # Ensure string comparison
-                                          q['answer'] = ans
-                                          if len(ans) > 1: q['type'] = 'multi'
-                                          found_q = True
-                                          break
-                       continue
-            # ------------------------------
-
-            # 2. 题目
-            match_q = re_question_start.match(line)
-            if match_q:
-                # New Question Found
-                if current_q:
-                    current_q['seq'] = current_q.get('seq') or (re.match(r'^(\d+)', current_q['title']).group(1) if re.match(r'^(\d+)', current_q['title']) else None)
-                    finalize_question(current_q)
-                    current_chapter["questions"].append(current_q)
-                
-                current_q = {
+    def feed(self, line):
+        line = line.strip()
+        if not line: return
+
+        m = re_line_kind.match(line)
+        kind = m.lastgroup
+
+        if self.in_requirements and self.on_requirements_line(line): return
+        if self.in_noun_exp and self.on_noun_line(line): return
+        if self.in_case_analysis and self.on_case_line(line, kind, m): return
+
+        if kind == 'group':
+            self.on_group_header(line, m)
+        elif kind == 'chapter':
+            self.on_chapter_header(m.group('chapter_title').strip())
+        elif self.in_ref_answers:
+            self.on_ref_answers(line)
+        elif kind == 'question':
+            self.on_question(m)
+        elif kind == 'answer' and self.current_q:
+            # Standalone Answer Line (e.g. Q1 "您的答案...")
+            q_ans = m.group('answer_keys').strip().replace(' ', '')
+            if q_ans:
+                self.current_q["answer"] = q_ans
+        else:
+            # Option run vs free text: option regexes only matter when a marker exists
+            self.on_text(line, kind != 'text' or re_option_run.search(line) is not None)
+
+    def close(self):
+        # 文件结束，保存最后一道题
+        if self.current_q and self.current_chapter:
+            self.commit_question()
+
+    # ---------------- Mode handlers (return True when the line is consumed) ----------------
+
+    def on_requirements_line(self, line):
+        if line.startswith('# '):
+            if "复习题" in line or "选择题" in line or "简答题" in line:
+                # Fall through to normal processing to handle the new section header
+                self.in_requirements = False
+                return False
+            if "教学要求" in line or "【" in line or "（" in line:
+                # Ignore inner headers like # 【教学目的】 or # （一）
+                return True
+            # Weird header found? Exit mode just in case
+            self.in_requirements = False
+            return False
+
+        chapter = self.current_chapter
+        if "desc" not in chapter: chapter["desc"] = ""
+        chapter["desc"] += line + "<br>"
+        return True
+
+    def on_noun_line(self, line):
+        if line.startswith('# '):
+            if any(k in line for k in NOUN_EXIT_KEYWORDS):
+                self.in_noun_exp = False
+                return False
+            if self.current_q:
+                self.commit_question()
+            self.current_q = {
+                "id": "",
+                "seq": "",
+                "title": line.replace('#', '').strip(),
+                "options": [],
+                "answer": "见解析",
+                "analysis": "",
+                "type": "essay"
+            }
+            return True
+
+        if self.current_q: self.current_q["analysis"] += line + "\n"
+        return True
+
+    def on_case_line(self, line, kind, m):
+        if line.startswith('# '):
+            if "选择题" in line or "复习题" in line:
+                self.in_case_analysis = False
+            return False
+
+        q = self.current_q
+        # Check if it looks like a new question (and not validation text)
+        if kind == 'question' and not line.startswith('答') and "答案" not in line[:5]:
+            new_seq = m.group('question_seq')
+            # If new sequence is not greater, it's likely a list item in the answer/analysis
+            is_valid_new_q = True
+            if q and q.get('seq'):
+                try:
+                    is_valid_new_q = int(new_seq) > int(q['seq'])
+                except ValueError:
+                    pass # If seq is not int, safely ignore and assume valid
+
+            if is_valid_new_q:
+                if q:
+                    self.commit_question()
+                self.current_q = {
                     "id": "",
-                    "seq": match_q.group(1),
-                    "title": match_q.group(2).strip(),
+                    "seq": new_seq,
+                    "title": m.group('question_text'),
                     "options": [],
                     "answer": "",
                     "analysis": "",
-                    "type": "single"
+                    "type": "case"
                 }
+                return True
+
+        # Append to Analysis or Title
+        if q:
+            if q["analysis"] or line.startswith("答") or "答案" in line[:8]:
+                q["analysis"] += "\n" + line
+            else:
+                q["title"] += "\n" + line
+        return True
+
+    # ---------------- Line kind handlers ----------------
+
+    def on_group_header(self, line, m):
+        if self.current_q:
+            self.commit_question(fill_seq=True)
+
+        self.group_info = {
+            'active': True,
+            'start': int(m.group('group_start')),
+            'end': int(m.group('group_end')),
+            'type': 'options' if '备选答案' in m.group('group_kind') else 'stem',
+            'data': [],
+            'stem_text': line.split('：')[-1] if '：' in line else '',
+            'table': None,
+        }
+
+    def on_chapter_header(self, title):
+        # Check for headers to ignore as new chapters
+        if re_ignored_header.match(title):
+            # Check for Teaching Requirements Section start
+            if "教学要求" in title:
+                self.in_requirements = True
+                if "desc" not in self.current_chapter: self.current_chapter["desc"] = ""
+
+            # Check for Reference Answers (Q2 format)
+            if "参考答案" in title:
+                # Finalize pending question (e.g. Q6) BEFORE resetting group_info
+                if self.current_q:
+                    self.commit_question(fill_seq=True)
+                self.in_ref_answers = True
+                self.in_case_analysis = False
+                self.in_noun_exp = False
+                self.in_requirements = False
+
+            if title.startswith('【') or re_section_no.match(title):
+                self.reset_group()
+            return
+
+        # Reset Group Info on REAL Chapter Change
+        self.reset_group()
+        # Turn off Answer Mode on new chapter
+        self.in_ref_answers = False
+
+        # Logic to Merge Subtitle
+        chapter = self.current_chapter
+        if chapter and not chapter['questions'] and re_chapter_no.match(chapter['title']) and not re_chapter_no.match(title):
+            chapter['title'] += " " + title
+            return
+
+        # Modes Check
+        self.in_noun_exp = "名词解释" in title
+        self.in_case_analysis = not self.in_noun_exp and ("病例分析" in title or "问答题" in title)
+        self.in_requirements = False
+
+        # If we have a pending question, finalize it before starting new chapter
+        if self.current_q and chapter:
+            self.commit_question(fill_seq=True)
+
+        self.current_chapter = {"title": title, "questions": [], "desc": ""}
+        self.chapters.append(self.current_chapter)
+
+    def answer_index(self):
+        """seq -> first question with that seq in the current chapter (legacy lookup semantics)."""
+        chapter = self.current_chapter
+        if self.index_chapter is not chapter:
+            self.index_chapter = chapter
+            self.seq_index = {}
+            self.indexed = 0
+            self.answered = set()
+        questions = chapter['questions']
+        for q in questions[self.indexed:]:
+            self.seq_index.setdefault(str(q.seq), q)
+        self.indexed = len(questions)
+        return self.seq_index
+
+    def on_ref_answers(self, line):
+        # Use findall to catch multiple answers per line
+        matches = re_ref_answer.findall(line)
+        if not matches: return
+        index = self.answer_index()
+        for seq, ans in matches:
+            q = index.get(seq)
+            if q is None:
+                self.answer_issues.append((self.current_chapter['title'], 'unresolved', seq))
                 continue
+            if seq in self.answered:
+                self.answer_issues.append((self.current_chapter['title'], 'duplicate', seq))
+            self.answered.add(seq)
+            q.answer = ans
+            if len(ans) > 1: q.type = 'multi'
+
+    def on_question(self, m):
+        if self.current_q:
+            self.commit_question(fill_seq=True)
+        self.current_q = {
+            "id": "",
+            "seq": m.group('question_seq'),
+            "title": m.group('question_text').strip(),
+            "options": [],
+            "answer": "",
+            "analysis": "",
+            "type": "single"
+        }
 
-            # 3. Handle Standalone Answer Line (e.g. Q1 "您的答案...")
-            match_full_ans = re_full_ans_line.match(line)
-            if current_q and match_full_ans:
-                 q_ans = match_full_ans.group(1).strip().replace(' ', '')
-                 if q_ans:
-                      current_q["answer"] = q_ans
-                 continue
-
-            # 4. Handle Inline / Start-of-Line Options
-            # Try to extract trailing answer on the same line first
-            tail_match = re_ans_tail.search(line)
-            content_to_parse = line
-            
-            if tail_match and not line.startswith("答") and not line.startswith("解析") and current_q:
-                  q_ans = tail_match.group(1).strip().replace(' ', '')
-                  if q_ans: current_q["answer"] = q_ans
-                  content_to_parse = line[:tail_match.start()]
+    def on_text(self, line, has_options):
+        """Option runs, answer tails and free text."""
+        q = self.current_q
+        group_info = self.group_info
 
-            # Find all options in the line (Handles 'A:...' 'B:...' and 'A. ...')
-            inline_opts = re_inline_opt.findall(content_to_parse)
-            if inline_opts:
-                 for label, text in inline_opts:
-                      opt = {"label": label, "text": text.strip()}
-                      if current_q:
-                           current_q["options"].append(opt)
-                      
-                      # ALWAYS append to group_info if active (Fix for shared options)
-                      if group_info['active'] and group_info['type'] == 'options':
-                           group_info['data'].append(opt)
-                 continue
-
-            # 5. Analysis/Content Append
-            if current_q:
-                match_ana = re_analysis.match(line)
-                if match_ana:
-                    current_q["analysis"] += match_ana.group(1)
-                else:
-                    if not current_q["options"]: # If no options yet, maybe part of title?
-                          # Check if it looks like start of option A?
-                          if not re.match(r'^[A-G][:.]', line):
-                               current_q["title"] += "\n" + line
-                    else:
-                          pass # Ignore extra text after options? Or append to last option?
-            
-            # 6. 特殊处理：单行包含选项、答案的情况 (Inline Options)
-            # 例子: A:xxx B:xxx 您的答案是：A 正确答案是：A
-            # 或者是 A:xxx B:xxx ...
-            
-            # 首先尝试分离尾部的答案信息 "您的答案是..."
-            re_ans_tail = re.compile(r'\s*(您的答案.*)$')
-            tail_match = re_ans_tail.search(line)
-            
-            line_content = line
-            tail_content = ""
+        if self.legacy_inline:
+            re_tail, re_opts = re_your_ans_tail, re_inline_opt_ae
+        else:
+            re_tail, re_opts = re_ans_tail, re_inline_opt
+
+        # 1. Try to extract trailing answer on the same line first
+        content_to_parse = line
+        if q and not line.startswith("答") and not line.startswith("解析"):
+            tail_match = re_tail.search(line)
             if tail_match:
-                tail_content = tail_match.group(1)
-                line_content = line[:tail_match.start()]
-                
-                # 尝试从尾部提取答案
-                # tail_str like "您的答案是：A 正确答案是：A"
-                # 简单提取 "正确答案是：X"
-                real_ans_match = re.search(r'正确答案(?:是)?[:：]\s*([A-Z]+)', tail_content)
-                if real_ans_match and current_q:
-                    ans_str = real_ans_match.group(1).replace(' ', '')
-                    current_q["answer"] = ans_str
-                    if len(ans_str) > 1: current_q["type"] = "multi"
-
-            # 提取行内选项
-            # 正则: ([A-E])[:\.\、]\s*(.*?)(?=\s*[A-E][:\.\、]|$|您的答案|正确答案)
-            re_inline_opt = re.compile(r'([A-E])[:\.\、]\s*(.*?)(?=\s*[A-E][:\.\、]|\s*您的答案|\s*正确答案|$)', re.DOTALL)
-            inline_opts = re_inline_opt.findall(line_content)
-            
+                q_ans = tail_match.group(1).strip().replace(' ', '')
+                if q_ans: q["answer"] = q_ans
+                content_to_parse = line[:tail_match.start()]
+
+        # Find all options in the line (Handles 'A:...' 'B:...' and 'A. ...')
+        if has_options:
+            inline_opts = re_opts.findall(content_to_parse)
+            if inline_opts:
+                for label, text in inline_opts:
+                    opt = {"label": label, "text": text.strip()}
+                    if q:
+                        q["options"].append(opt)
+                    # ALWAYS append to group_info if active (Fix for shared options)
+                    if group_info['active'] and group_info['type'] == 'options':
+                        group_info['data'].append(opt)
+                return
+
+        self.legacy_inline = True
+
+        # 2. Analysis/Content Append
+        if q:
+            match_ana = re_analysis.match(line)
+            if match_ana:
+                q["analysis"] += match_ana.group(1)
+            elif not q["options"] and not re_opt_prefix.match(line):
+                # If no options yet, maybe part of title
+                q["title"] += "\n" + line
+
+        # 3. 单行包含选项、答案的情况: 分离尾部的 "您的答案是：A 正确答案是：A"
+        line_content = line
+        tail_match = re_your_ans_tail.search(line)
+        if tail_match:
+            line_content = line[:tail_match.start()]
+            real_ans_match = re_real_ans.search(tail_match.group(1))
+            if real_ans_match and q:
+                ans_str = real_ans_match.group(1).replace(' ', '')
+                q["answer"] = ans_str
+                if len(ans_str) > 1: q["type"] = "multi"
+
+        if has_options:
+            inline_opts = re_inline_opt_ae.findall(line_content)
             if inline_opts:
-                if current_q:
+                if q:
                     for tag, text in inline_opts:
-                         current_q["options"].append({
-                            "label": tag,
-                            "text": text.strip()
-                        })
-                continue
+                        q["options"].append({"label": tag, "text": text.strip()})
+                return
+
+        # 4. 内容追加 (如果不是选项也不是答案，就追加到上一级)
+        if q:
+            if q["analysis"]:
+                q["analysis"] += "\n" + line # Markdown 换行
+            elif q["options"]:
+                q["options"][-1]["text"] += " " + line
+            else:
+                q["title"] += " " + line
+
+
+class BuildCache:
+    """
+    On-disk store for build intermediates (parsed segments, encoded chapters).
+    Keys are content fingerprints salted with BUILD_FINGERPRINT.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.stats = {} # namespace -> [hits, misses]
+        self.used = set()
+
+    @staticmethod
+    def key(*parts):
+        h = hashlib.sha1(BUILD_FINGERPRINT.encode('utf-8'))
+        for part in parts:
+            h.update(b'\0')
+            h.update(part.encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, namespace, key):
+        return os.path.join(self.root, namespace, key + '.json')
+
+    def get(self, namespace, key, count=True):
+        """Entry text or None; count=False reads an entry has() already counted without touching the stats."""
+        path = self.path(namespace, key)
+        counts = self.stats.setdefault(namespace, [0, 0]) if count else [0, 0]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except OSError:
+            counts[1] += 1
+            return None
+        counts[0] += 1
+        self.used.add(path)
+        return text
+
+    def has(self, namespace, key):
+        """Like get() without reading the entry; a present entry counts as used."""
+        path = self.path(namespace, key)
+        counts = self.stats.setdefault(namespace, [0, 0])
+        if not os.path.exists(path):
+            counts[1] += 1
+            return False
+        counts[0] += 1
+        self.used.add(path)
+        return True
+
+    def put(self, namespace, key, text):
+        path = self.path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+        self.used.add(path)
+
+    def prune(self):
+        """Drop entries this build did not touch."""
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if path not in self.used:
+                    os.remove(path)
+
+    def report(self):
+        for namespace, (hits, misses) in sorted(self.stats.items()):
+            print(f"Cache {namespace}: {hits} hit / {misses} miss")
+
+
+# 分段边界: "# 第X章" (必须是 "# " 开头，与各模式的标题判断一致)
+re_chapter_boundary = re.compile(r'^# \s*第[一二三四五六七八九十0-9]+章')
+
+def split_chapter_segments(lines):
+    """Lazily group raw lines into segments, cutting before every "# 第X章" header."""
+    seg = []
+    for line in lines:
+        if seg and '章' in line and re_chapter_boundary.match(line.strip()):
+            yield seg
+            seg = []
+        seg.append(line)
+    if seg:
+        yield seg
+
+def chapter_boundary_safe(state, header):
+    """Would a parser in `state` treat `header` as a real chapter? (see BankParser mode handlers)"""
+    if state['in_requirements'] and not any(k in header for k in ("复习题", "选择题", "简答题")):
+        if "教学要求" in header or "【" in header or "（" in header:
+            return False
+    if state['in_noun_exp'] and not any(k in header for k in NOUN_EXIT_KEYWORDS):
+        return False
+    return True
+
+def parse_segment_lines(f_path, seg, is_last, legacy_inline):
+    """Parse one segment from a fresh parser state; returns {'chapters', 'exit'}. Also runs in pool workers."""
+    parser = BankParser()
+    parser.legacy_inline = legacy_inline
+    parser.start_file(f_path, seg[0] if seg else None)
+    for line in seg:
+        parser.feed(line)
+    state = parser.snapshot()
+    if is_last:
+        parser.close()
+    else:
+        parser.end_segment()
+    return {'chapters': parser.chapters, 'exit': state, 'issues': parser.answer_issues}
+
+def segment_key(cache, f_path, seg, is_last, legacy_inline):
+    return cache.key(f_path, str(is_last), str(legacy_inline), ''.join(seg))
+
+def dump_segment(result):
+    return json.dumps(result, ensure_ascii=False, default=Question.to_dict)
+
+def load_segment(text):
+    result = json.loads(text)
+    tables = {}
+    for chap in result['chapters']:
+        chap['questions'] = [Question.from_dict(q, tables) for q in chap['questions']]
+    return result
+
+def parse_segment(f_path, seg, is_last, legacy_inline, cache):
+    if not cache:
+        return parse_segment_lines(f_path, seg, is_last, legacy_inline)
+
+    key = segment_key(cache, f_path, seg, is_last, legacy_inline)
+    cached = cache.get('segment', key)
+    if cached is not None:
+        return load_segment(cached)
+
+    result = parse_segment_lines(f_path, seg, is_last, legacy_inline)
+    cache.put('segment', key, dump_segment(result))
+    return result
+
+def parse_file_cached(f_path, lines, legacy_inline, cache, issues):
+    """
+    Parse a file segment by segment through the build cache, yielding
+    (chapters, legacy_inline) per segment and collecting answer-key issues. A boundary swallowed by the
+    preceding mode (e.g. 名词解释) is parsed across instead.
+    """
+    segments = split_chapter_segments(lines)
+    seg, nxt = next(segments, []), next(segments, None)
+    while True:
+        while True:
+            result = parse_segment(f_path, seg, nxt is None, legacy_inline, cache)
+            if nxt is None or chapter_boundary_safe(result['exit'], nxt[0].strip()):
+                break
+            seg, nxt = seg + nxt, next(segments, None)
+        legacy_inline = result['exit']['legacy_inline']
+        issues.extend(result['issues'])
+        yield result['chapters'], legacy_inline
+        if nxt is None:
+            return
+        seg, nxt = nxt, next(segments, None)
+
+def report_answer_issues(issues):
+    grouped = {}
+    for title, kind, seq in issues:
+        grouped.setdefault((title, kind), []).append(seq)
+    for (title, kind), seqs in grouped.items():
+        label = "answer keys without a question" if kind == 'unresolved' else "duplicate answer keys"
+        print(f'Warning: {label} in "{title}": {", ".join(seqs)}')
+
+def iter_lines(f_path):
+    with open(f_path, 'r', encoding='utf-8') as f:
+        yield from f
+
+def iter_chapters(md_files, cache=None):
+    """
+    Lazily yield finished, non-empty chapters. Only the chapter being parsed
+    (and the last one of the previous file, which the next file may extend)
+    is held in memory.
+    """
+    parser = BankParser()
+
+    def finished():
+        done, parser.chapters = parser.chapters[:-1], parser.chapters[-1:]
+        return [c for c in done if c["questions"]]
 
-            # 7. 特殊处理：单独的 "您的答案...正确答案..." 行
-            # 如果不处理，会被当做文本追加到上一行(通常是最后一个选项)
-            # 允许 "您的答案" 部分缺失 (即只包含 正确答案)
-            # 6. Legacy inline check (Removed)
-            match_full_ans = re_full_ans_line.match(line)
-            if current_q and match_full_ans:
-                real_ans = match_full_ans.group(1).strip()
-                if real_ans:
-                    current_q["answer"] = real_ans
-                    if len(real_ans) > 1: current_q["type"] = "multi"
-                continue
+    for f_path in md_files:
+        print(f"Processing {f_path}...")
+        if not os.path.exists(f_path):
+            print(f"Warning: {f_path} not found.")
+            continue
 
-            # 8. 内容追加 (如果不是选项也不是答案，就追加到上一级)
-            if current_q:
-                # 如果刚才分离出的 tail 包含答案，可能还有解析信息? 暂不处理复杂解析
-                if current_q["analysis"]:
-                    current_q["analysis"] += "\n" + line # Markdown 换行
-                elif current_q["options"]:
-                    # 之前的逻辑: 如果有选项了，新行追加到最后一个选项
-                    # 但如果是 inline options 刚刚加进去的，不要轻易追加下一行，除非下一行确实是文本
-                    # 这里保持原有逻辑即可
-                    current_q["options"][-1]["text"] += " " + line
-                else:
-                    current_q["title"] += " " + line
+        lines = iter_lines(f_path)
+        first_line = next(lines, None)
+        if first_line is not None:
+            lines = itertools.chain([first_line], lines)
+
+        # 续接上一文件末章的文件依赖前文状态，只能整体顺序解析
+        continues_chapter = parser.chapters and not (first_line and first_line.strip().startswith('#'))
+        if cache and not continues_chapter:
+            for chapters, parser.legacy_inline in parse_file_cached(f_path, lines, parser.legacy_inline, cache, parser.answer_issues):
+                parser.chapters.extend(chapters)
+                yield from finished()
+            continue
 
-        # 文件结束，保存最后一道题
-        if current_q and current_chapter:
-            finalize_question(current_q)
-            current_chapter["questions"].append(current_q)
+        parser.start_file(f_path, first_line)
+        feed = parser.feed
+        for line in lines:
+            feed(line)
+            if len(parser.chapters) > 1:
+                yield from finished()
+        parser.close()
 
     # 过滤空章节
-    return [c for c in all_chapters if c["questions"]]
+    yield from (c for c in parser.chapters if c["questions"])
+    report_answer_issues(parser.answer_issues)
+
+class ParallelParse:
+    """
+    Parses the "# 第X章" segments of every book on a process pool, a bounded
+    window ahead of the consumer, and hands chapters back book by book in
+    source order (chapters(i) must be consumed for i = 0, 1, ...).
+
+    Segments after a book's first are parsed assuming the legacy inline switch
+    has already flipped; a wrong guess, or a boundary swallowed by the preceding
+    mode, is re-parsed here in order, so the result equals iter_chapters().
+    """
+
+    def __init__(self, book_sources, pool, cache=None, window=8):
+        self.pool = pool
+        self.cache = cache
+        self.window = window
+        self.queue = collections.deque()
+        self.tasks = self.plan(book_sources)
+
+    def plan(self, book_sources):
+        for book_idx, source in enumerate(book_sources):
+            files = [f for f in source['files'] if os.path.exists(f)]
+            # 续接上一文件末章的书只能整体顺序解析
+            if any(not next(iter_lines(f), '').strip().startswith('#') for f in files[1:]):
+                yield {'book': book_idx, 'serial': source['files']}
+                continue
+
+            assumed = False
+            for f_path in source['files']:
+                print(f"Processing {f_path}...")
+                if f_path not in files:
+                    print(f"Warning: {f_path} not found.")
+                    continue
+                segments = split_chapter_segments(iter_lines(f_path))
+                seg, nxt = next(segments, []), next(segments, None)
+                while True:
+                    yield self.submit(book_idx, f_path, seg, nxt is None, assumed)
+                    assumed = True
+                    if nxt is None:
+                        break
+                    seg, nxt = nxt, next(segments, None)
+
+    def submit(self, book_idx, f_path, seg, is_last, assumed):
+        task = {'book': book_idx, 'f_path': f_path, 'seg': seg, 'is_last': is_last, 'assumed': assumed}
+        if self.cache:
+            task['key'] = segment_key(self.cache, f_path, seg, is_last, assumed)
+            cached = self.cache.get('segment', task['key'])
+            if cached is not None:
+                task['result'] = load_segment(cached)
+                return task
+        task['future'] = self.pool.submit(parse_segment_lines, f_path, seg, is_last, assumed)
+        return task
+
+    def peek(self):
+        while len(self.queue) < self.window:
+            task = next(self.tasks, None)
+            if task is None:
+                break
+            self.queue.append(task)
+        return self.queue[0] if self.queue else None
+
+    def result(self, task):
+        if 'result' not in task:
+            task['result'] = task.pop('future').result()
+            if self.cache:
+                self.cache.put('segment', task['key'], dump_segment(task['result']))
+        return task['result']
+
+    def chapters(self, book_idx):
+        legacy_inline = False
+        issues = []
+        while True:
+            task = self.peek()
+            if task is None or task['book'] != book_idx:
+                report_answer_issues(issues)
+                return
+            self.queue.popleft()
+            if 'serial' in task:
+                yield from iter_chapters(task['serial'], self.cache)
+                return
+
+            f_path, seg, is_last = task['f_path'], task['seg'], task['is_last']
+            result = self.result(task)
+            if task['assumed'] != legacy_inline:
+                result = parse_segment(f_path, seg, is_last, legacy_inline, self.cache)
+            while not is_last and not chapter_boundary_safe(result['exit'], self.peek()['seg'][0].strip()):
+                nxt = self.queue.popleft()
+                if 'future' in nxt:
+                    nxt['future'].cancel()
+                seg, is_last = seg + nxt['seg'], nxt['is_last']
+                result = parse_segment(f_path, seg, is_last, legacy_inline, self.cache)
+
+            legacy_inline = result['exit']['legacy_inline']
+            issues.extend(result['issues'])
+            for chap in result['chapters']:
+                if chap["questions"]:
+                    yield chap
+
+def convert_to_json(md_files, cache=None):
+    return list(iter_chapters(md_files, cache))
 
 def parse_q2_markdown(file_path):
     print(f"Processing Q2 (Structured) {file_path}...")
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    lines = iter_lines(file_path)
 
     chapters = []
     current_chap = None
@@ -569,6 +1006,10 @@ def parse_q2_markdown(file_path):
                 current_chap["questions"].append(current_q)
                 current_q = None
             section_state = 'ans'
+            # 答案区不会再追加题目，一次建好 seq -> 题目 索引
+            ans_index = {}
+            for q in (current_chap["questions"] if current_chap else []):
+                ans_index.setdefault(q.get('seq'), q)
             continue
             
         # 3. 根据状态处理内容
@@ -634,17 +1075,11 @@ def parse_q2_markdown(file_path):
             clean_line = line.replace('~', ' ').replace('题', '') 
             matches = re_ans_line.findall(clean_line)
             for seq_str, ans_str in matches:
-                seq = int(seq_str)
-                # 在当前章节查找序号匹配的题目
-                # 注意：题目的顺序可能就是列表顺序，但序号可能不连续（如果中间有非题文本）。
-                # 为简单起见，且为了高性能，我们假设序号是递增的。但比较稳妥的是遍历查找。
-                # 倒序查找比较快？
-                 # Find question with seq
-                for q in current_chap["questions"]:
-                    if q.get('seq') == seq:
-                         q['answer'] = ans_str
-                         if len(ans_str) > 1: q['type'] = 'multi'
-                         break
+                # 在当前章节按序号查找题目 (取第一道匹配的题)
+                q = ans_index.get(int(seq_str))
+                if q:
+                    q['answer'] = ans_str
+                    if len(ans_str) > 1: q['type'] = 'multi'
         
         elif section_state == 'noun':
             # Noun explanation parsing
@@ -681,1072 +1116,1185 @@ def parse_q2_markdown(file_path):
 
     return chapters
 
-def get_html_template(json_data):
-    # Process LaTeX backslashes for Marked.js compat
-    # We must double-escape backslashes inside $...$ so they survive into MathJax
-    def fix_tex(text):
-        r"""
-        Robustly handle MathJax:
-        1. Split by '$' to separate Text vs Math.
-        2. In Text chunks: Find unwrapped LaTeX (e.g. \mathrm{cm}, 10^9) and wrap them.
-        3. In Math chunks: Double-escape backslashes for Marked.js.
-        4. Rejoin.
+# Process LaTeX backslashes for Marked.js compat
+# We must double-escape backslashes inside $...$ so they survive into MathJax
+
+# Text-chunk passes, in order. Each pass sees the previous pass's output (e.g. the
+# "\times" wrapped by pass 3 is wrapped again by pass 4), so they stay sequential.
+def _repl_mathrm(m):
+    base = m.group(1) # \mathrm{...}
+    sups = m.group(2) or "" # ^...
+    return f'${base}{sups}$'
+
+TEX_TEXT_PASSES = [
+    # 1. Roman numerals with super/subscript, e.g. III^{\circ}
+    (('^', '_'), re.compile(r'(?<!\$)\b([IVX]+(?:[\^_](?:\{[^}]+\}|\\circ|\d+)))\b'), r'$\1$'),
+    # 2. \mathrm{...}, keeping a following ^... or _... inside the $ (e.g. \mathrm{g}^{\circ})
+    (('\\mathrm{',), re.compile(r'(?<!\$)(\\mathrm\{[^}]+\})(?:([\^_](?:\{[^}]+\}|\\circ|\d+|[a-zA-Z])))?'), _repl_mathrm),
+    # 3. Dimensions: 1.5 \times 2.0
+    (('\\times',), re.compile(r'(?<!\$)(\d+(?:\.\d+)?)\s*\\times\s*(\d+(?:\.\d+)?)'), r'$\1 \\times \2$'),
+    # 4. Standalone math symbols: \sim, \approx, \le, \ge, \pm, \rightarrow, \times
+    (('\\',), re.compile(r'(?<!\$)\\((?:sim|approx|le|ge|pm|rightarrow|times)(?![a-zA-Z]))'), r'$\\\1$'),
+    # 5. Exponents: 10^9 or 10^{-9}
+    (('10^',), re.compile(r'(?<!\$)\b10\^\{?(-?\d+)\}?'), r'$10^{\1}$'),
+    # 6. Temperature: 39.5^\circ C or 39.5^{\circ}C
+    (('\\circ',), re.compile(r'(?<!\$)(\d+(?:\.\d+)?)\s*[\^_]\{?\\circ\}\s*C'), r'$\1^{\\circ}C$'),
+]
+
+# Characters without which fix_tex returns its input unchanged
+re_tex_trigger = re.compile(r'[$\\^_]')
+
+TEX_MEMO_SIZE = 8192 # 已处理文本的缓存条数 (共用选项、"以上都是" 等重复文本只处理一次)
+
+@functools.lru_cache(maxsize=TEX_MEMO_SIZE)
+def fix_tex(text):
+    r"""
+    Robustly handle MathJax:
+    1. Split by '$' to separate Text vs Math.
+    2. In Text chunks: Find unwrapped LaTeX (e.g. \mathrm{cm}, 10^9) and wrap them.
+    3. In Math chunks: Double-escape backslashes for Marked.js.
+    4. Rejoin.
+    Text with none of $ \ ^ _ is returned as is; a pass only runs when its
+    trigger substring is present.
+    """
+    if not text or not re_tex_trigger.search(text): return text
+
+    # Split by $; "text $math$ text" -> ["text ", "math", " text"], and '$'.join restores it
+    parts = text.split('$')
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            # Inside $...$ (Math chunk): double escape backslashes, tilde to space
+            parts[i] = part.replace('\\', '\\\\').replace('~', ' ')
+            continue
+        # Outside $...$ (Text chunk): find stray LaTeX and wrap it
+        if '\\' not in part and '^' not in part and '_' not in part:
+            continue
+        for triggers, pattern, repl in TEX_TEXT_PASSES:
+            if any(t in part for t in triggers):
+                part = pattern.sub(repl, part)
+        parts[i] = part
+    return '$'.join(parts)
+
+# Build-time Markdown -> HTML for question text, so the page never runs marked on it.
+# Covers what the banks use: paragraphs, ATX headings, lists, **strong**, *em*, `code`.
+# Backslash escapes follow marked (that is what fix_tex's doubling inside $...$ targets);
+# raw HTML in the source is escaped, never passed through, and $...$ goes to tex_html.
+re_md_escape = re.compile(r'\\([!-/:-@\[-`{-~])') # backslash + ASCII punctuation
+re_md_code = re.compile(r'(`+)(.+?)(?<!`)\1(?!`)', re.S)
+re_md_strong = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*|(?<!\w)__(?=\S)(.+?)(?<=\S)__(?!\w)', re.S)
+re_md_em = re.compile(r'\*(?=[^\s*])(.+?)(?<=[^\s*])\*|(?<!\w)_(?=[^\s_])(.+?)(?<=[^\s_])_(?!\w)', re.S)
+re_md_stash = re.compile('\ue000(\\d+)\ue000')
+re_md_tag = re.compile(r'<(/?)(sub|sup|br|b|i)\s*/?>', re.I) # 源文件中允许原样保留的 HTML 标签，其余一律转义
+re_md_heading = re.compile(r'^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$')
+re_md_item = re.compile(r'^ {0,3}(?:([-*+])|(\d{1,9})([.)]))(?:[ \t]+(.*)|$)')
+
+re_mathml_root = re.compile(r'<math xmlns="[^"]*" display="inline">')
+re_mathml_entity = re.compile(r'&#x([0-9a-fA-F]+);')
+
+def _mathml_char(m):
+    ch = chr(int(m.group(1), 16))
+    return m.group(0) if ch in '<>&' else ch
+
+@functools.lru_cache(maxsize=TEX_MEMO_SIZE)
+def tex_html(tex):
+    """
+    HTML for one $...$ span: MathML when latex2mathml is installed and accepts
+    the TeX, otherwise the TeX in a span.tex that the page typesets with MathJax.
+    """
+    if not tex.strip(): return f"${tex}$"
+    if latex2mathml:
+        try:
+            mathml = latex2mathml.converter.convert(tex)
+        except Exception: # 源文件中有不完整的公式 (缺少 } 或 \right 等)
+            pass
+        else:
+            # <math> needs no xmlns in HTML and is inline by default
+            return re_mathml_entity.sub(_mathml_char, re_mathml_root.sub('<math>', mathml, count=1))
+    return f'<span class="tex">${html.escape(tex, quote=False)}$</span>'
+
+def _md_tag(m):
+    tag = m.group(2).lower()
+    return '<br>' if tag == 'br' else f"<{m.group(1)}{tag}>"
+
+def inline_html(text):
+    """
+    One inline Markdown span (no block structure) -> sanitized HTML, with $...$
+    math through tex_html. Raw <sub> <sup> <br> <b> <i> pass through; any other
+    HTML is escaped.
+    """
+    parts = text.split('$')
+    closed = len(parts) - (len(parts) % 2 == 0) # an unmatched last $ is literal text
+    stash = [] # escaped characters, code spans and allowed tags, kept out of emphasis matching
+    def keep(fragment):
+        stash.append(fragment)
+        return f"\ue000{len(stash) - 1}\ue000"
+    for i, part in enumerate(parts):
+        if i % 2 == 1 and i < closed:
+            parts[i] = tex_html(re_md_escape.sub(r'\1', part))
+            continue
+        part = re_md_code.sub(lambda m: keep(f"<code>{html.escape(m.group(2).strip(), quote=False)}</code>"), part)
+        part = re_md_escape.sub(lambda m: keep(html.escape(m.group(1))), part)
+        part = re_md_tag.sub(lambda m: keep(_md_tag(m)), part)
+        part = html.escape(part, quote=False)
+        part = re_md_strong.sub(lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", part)
+        part = re_md_em.sub(lambda m: f"<em>{m.group(1) or m.group(2)}</em>", part)
+        parts[i] = '$' + part if i % 2 else part
+    joined = ''.join(parts)
+    return re_md_stash.sub(lambda m: stash[int(m.group(1))], joined) if stash else joined
+
+@functools.lru_cache(maxsize=TEX_MEMO_SIZE)
+def markdown_html(text):
+    """
+    Block Markdown -> sanitized HTML. Like marked, an ordered list only
+    interrupts a paragraph when it starts at 1, and list items take lazy
+    continuation lines.
+    """
+    if not text or not text.strip(): return ''
+    out = []
+    para = []
+    items = None # open list: [kind, start, [item lines, ...]]
+
+    def close_para():
+        if para:
+            out.append(f"<p>{inline_html(chr(10).join(para))}</p>")
+            para.clear()
+
+    def close_list():
+        nonlocal items
+        if items:
+            kind, start, entries = items
+            tag = 'ul' if kind in '-*+' else 'ol'
+            attr = f' start="{start}"' if tag == 'ol' and start != 1 else ''
+            lis = ''.join(f"<li>{inline_html(chr(10).join(e).strip())}</li>" for e in entries)
+            out.append(f"<{tag}{attr}>{lis}</{tag}>")
+            items = None
+
+    lines = text.split('\n')
+    for idx, line in enumerate(lines):
+        if not line.strip():
+            close_para()
+            if items:
+                # A blank line ends the list unless the next item follows
+                nxt = next((l for l in lines[idx + 1:] if l.strip()), None)
+                m = nxt is not None and re_md_item.match(nxt)
+                if not m or (m.group(1) or m.group(3)) != items[0]:
+                    close_list()
+            continue
+        m = re_md_heading.match(line)
+        if m:
+            close_para(); close_list()
+            level = len(m.group(1))
+            out.append(f"<h{level}>{inline_html(m.group(2) or '')}</h{level}>")
+            continue
+        m = re_md_item.match(line)
+        if m and (m.group(4) or items):
+            kind = m.group(1) or m.group(3)
+            if items and items[0] == kind:
+                items[2].append([m.group(4) or ''])
+                continue
+            if not para or m.group(1) or int(m.group(2)) == 1:
+                close_para(); close_list()
+                items = [kind, int(m.group(2) or 1), [[m.group(4) or '']]]
+                continue
+        if items:
+            items[2][-1].append(line.strip())
+        else:
+            para.append(line)
+    close_para(); close_list()
+    return '\n'.join(out)
+
+def fix_options_tex(options):
+    return [{"label": label, "text": inline_html(fix_tex(text))} for label, text in options]
+
+def fix_question_tex(q):
+    """
+    Emitted dict of a Question with fix_tex applied to every text field; title,
+    analysis and option texts are pre-rendered to HTML.
+    Shared-option group members carry only group_id; their options go to the chapter's "groups" table.
+    """
+    fixed = q.to_dict()
+    fixed['title'] = markdown_html(fix_tex(q.title))
+    fixed['analysis'] = markdown_html(fix_tex(q.analysis))
+    fixed['answer'] = fix_tex(q.answer) # Answer might have latex too
+    if q.group_id is None:
+        fixed['options'] = fix_options_tex(q.options)
+    else:
+        del fixed['options']
+    return fixed
+
+def chapter_groups(questions):
+    """group_id -> TeX-fixed options of every shared-option group in the chapter."""
+    groups = {}
+    for q in questions:
+        if q.group_id is not None and q.group_id not in groups:
+            groups[q.group_id] = fix_options_tex(q.options)
+    return groups
+
+def fix_chapter_tex(chap):
+    """Emitted dict of a chapter: TeX-fixed questions plus its shared-option "groups" table."""
+    fixed = dict(chap)
+    fixed['questions'] = [fix_question_tex(q) for q in chap.get('questions', [])]
+    groups = chapter_groups(chap.get('questions', []))
+    if groups:
+        fixed['groups'] = groups
+    return fixed
+
+def content_digest(q):
+    """Full md5 of the text behind generate_hash_id; equal IDs with different digests are collisions."""
+    full_content = q.title + "".join([text for _, text in q.options])
+    # str.split() drops exactly the characters re_whitespace matches, and is faster
+    return hashlib.md5(''.join(full_content.split()).encode('utf-8')).hexdigest()
+
+# json.dumps builds a new encoder per call when given options; per-question encoding reuses one
+encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+def pack_chapter(chap, fixed):
+    """
+    Split a TeX-fixed chapter into question bodies (JSON, without seq) and a
+    skeleton whose "questions" slot is filled by QuestionStore.chapter_js.
+    """
+    questions = fixed['questions']
+    return {
+        'chapter': dict(fixed, questions=None),
+        'ids': [q['id'] for q in questions],
+        'seqs': [q.pop('seq') for q in questions],
+        'digests': [content_digest(q) for q in chap.get('questions', [])],
+        'bodies': [encode_json(q) for q in questions],
+    }
+
+def encode_chapter(chap, cache=None):
+    """TeX-fix and pack one chapter; the packed form is cached by chapter content."""
+    key = None
+    if cache:
+        key = cache.key(json.dumps(chap, ensure_ascii=False, sort_keys=True, default=Question.to_dict),
+                        getattr(latex2mathml, '__version__', '') if latex2mathml else '')
+        payload = cache.get('chapter', key)
+        if payload is not None:
+            return json.loads(payload)
+
+    packed = pack_chapter(chap, fix_chapter_tex(chap))
+
+    if cache:
+        cache.put('chapter', key, json.dumps(packed, ensure_ascii=False))
+    return packed
+
+
+# Columnar binary chapter shards (BANK_FORMAT = 'binary'), decoded by BIN_DECODER_JS
+BIN_MAGIC = b'QBK1'
+BIN_NONE = 0xFFFFFFFF # null string index
+BIN_TYPES = ('single', 'multi', 'essay', 'mix', 'case') # type 枚举，顺序与页面 QTYPES 一致
+BIN_QUESTION_FIELDS = ('id', 'seq', 'title', 'answer', 'analysis', 'group_id')
+
+def _u32_bytes(values):
+    return struct.pack(f'<{len(values)}I', *values)
+
+def _pad4(data):
+    return data + b'\0' * (-len(data) % 4)
+
+def encode_chapter_bin(chapter, questions):
+    """
+    Binary shard of one chapter; `questions` are emitted dicts (with seq).
+    Little-endian, every section 4-byte aligned so the page reads it through
+    typed-array views:
+        'QBK1', u32 question count n, string count s, option row count m, meta length
+        meta JSON (chapter fields other than questions/groups)
+        u32[s + 1]  string offsets (UTF-16 code units) into the decoded blob
+        u32[n]      one column per BIN_QUESTION_FIELDS (string index, BIN_NONE for null)
+        u32[n]      first option row
+        u32[m] x 2  option label / text (string index)
+        u8[n] x 2   type (index into BIN_TYPES) / option count
+        UTF-8 blob of the deduplicated strings
+    Members of a shared-option group point at the same option rows.
+    """
+    strings = {}
+    def sid(text):
+        if text is None: return BIN_NONE
+        idx = strings.get(text)
+        if idx is None:
+            idx = strings[text] = len(strings)
+        return idx
+
+    groups = chapter.get('groups') or {}
+    group_rows = {}
+    columns = {field: [] for field in BIN_QUESTION_FIELDS}
+    opt_start, labels, texts = [], [], []
+    types, opt_count = bytearray(), bytearray()
+    for q in questions:
+        for field in BIN_QUESTION_FIELDS:
+            columns[field].append(sid(q.get(field)))
+        shared = 'options' not in q
+        rows = group_rows.get(q.get('group_id')) if shared else None
+        if rows is None:
+            options = groups.get(q.get('group_id'), []) if shared else q['options']
+            rows = (len(labels), len(options))
+            for o in options:
+                labels.append(sid(o['label']))
+                texts.append(sid(o['text']))
+            if shared: group_rows[q.get('group_id')] = rows
+        opt_start.append(rows[0])
+        opt_count.append(rows[1])
+        types.append(BIN_TYPES.index(q['type']))
+
+    blob = ''.join(strings).encode('utf-8')
+    # Offsets count UTF-16 code units: the page decodes the blob once and slices the JS string
+    offsets = list(itertools.accumulate((len(t.encode('utf-16-le')) // 2 for t in strings), initial=0))
+    meta = json.dumps({k: v for k, v in chapter.items() if k not in ('questions', 'groups')},
+                      ensure_ascii=False).encode('utf-8')
+    parts = [
+        BIN_MAGIC, _u32_bytes([len(questions), len(strings), len(labels), len(meta)]),
+        _pad4(meta), _u32_bytes(offsets),
+        *(_u32_bytes(columns[field]) for field in BIN_QUESTION_FIELDS),
+        _u32_bytes(opt_start), _u32_bytes(labels), _u32_bytes(texts),
+        bytes(types), bytes(opt_count), blob,
+    ]
+    return b''.join(parts)
+
+def read_template(name, **values):
+    """Text of TEMPLATE_DIR/name with each __KEY__ replaced by values[KEY]."""
+    with open(os.path.join(TEMPLATE_DIR, name), encoding='utf-8') as f:
+        text = f.read()
+    for key, value in values.items():
+        text = text.replace(f'__{key}__', value)
+    return text
+
+# Page-side decoder for encode_chapter_bin (also run by bench.py --decode). Question
+# objects are created up front, but each field is decoded from the typed arrays on first use.
+BIN_DECODER_JS = read_template('bin_decoder.js')
+
+class QuestionStore:
+    """
+    Content-addressed question bodies for one build. A body is emitted once per
+    output unit (the whole page, or one shard), inline where it is first used
+    and keyed by its question ID; later uses hold a [key, seq] reference. A
+    differing body under an ID already taken (whitespace variant, or a real
+    hash collision) is keyed "id~n".
+    """
+
+    def __init__(self):
+        # int(id, 16) -> 章节序号 << 64 | 内容摘要哈希 << 32 | 题目正文哈希 (各 32 位)
+        # 每题只留两个小整数，百万题规模下也不会把元组、ID 字符串和标题常驻内存
+        self.seen = {}
+        self.chapters = {} # chapter title -> 序号，冲突时据此找回首次出现的章节
+        self.variants = {} # id -> [(body hash, key), ...]
+        self.collisions = {} # (id, content digest) -> (first chapter title, chapter title)
+        self.refs = 0
+        self.bodies = 0
+        self.emitted = set() # keys already in the inlined page; shards pass their own set
+
+    def add(self, qid, digest, body, title):
+        """Returns (key, is_new_body) where is_new_body is build-wide."""
+        self.refs += 1
+        body_hash = hash(body) & 0xFFFFFFFF
+        digest = hash(digest) & 0xFFFFFFFF
+        seen_key = int(qid, 16) # generate_hash_id() 的 12 位十六进制
+        first = self.seen.get(seen_key)
+        if first is None:
+            chapter = self.chapters.setdefault(title, len(self.chapters))
+            self.seen[seen_key] = chapter << 64 | digest << 32 | body_hash
+            self.bodies += 1
+            return qid, True
+        if (first >> 32) & 0xFFFFFFFF != digest and (qid, digest) not in self.collisions:
+            chapter = first >> 64
+            first_title = next(t for t, no in self.chapters.items() if no == chapter)
+            self.collisions[(qid, digest)] = (first_title, title)
+        if first & 0xFFFFFFFF == body_hash:
+            return qid, False
+        variants = self.variants.setdefault(qid, [])
+        for variant_hash, key in variants:
+            if variant_hash == body_hash:
+                return key, False
+        key = f"{qid}~{len(variants) + 1}"
+        variants.append((body_hash, key))
+        self.bodies += 1
+        return key, True
+
+    def chapter_js(self, packed, emitted=None):
         """
-        if not text: return text
-        
-        # Split by $ (but keep the delimiters implicitly by logic)
-        parts = text.split('$')
-        
-        new_parts = []
-        for i, part in enumerate(parts):
-            if i % 2 == 1:
-                # Inside $...$ (Math chunk)
-                # Double escape backslashes: \ -> \\
-                part = part.replace('\\', '\\\\')
-                part = part.replace('~', ' ') # Tilde to space often helps spacing in MathJax
-                new_parts.append(part)
+        JSON for one packed chapter: bodies not yet in `emitted` go inline (plus
+        their seq), the rest as [key, seq]. A shard passes its own empty set.
+        """
+        if emitted is None: emitted = self.emitted
+        chapter = packed['chapter']
+        entries = []
+        for qid, seq, digest, body in zip(packed['ids'], packed['seqs'], packed['digests'], packed['bodies']):
+            key, _ = self.add(qid, digest, body, chapter['title'])
+            seq = encode_json(seq)
+            if key in emitted:
+                entries.append(f'["{key}", {seq}]')
+            elif key == qid:
+                entries.append(f'{body[:-1]}, "seq": {seq}}}')
             else:
-                # Outside $...$ (Text chunk)
-                # We need to find stray LaTeX and wrap it.
-                
-                # 1. Fix Roman Numerals like III^{\circ} or \mathrm{III}^{\circ}
-                # Pattern: Optional \mathrm{...} around Roman Numeral, followed by ^...
-                # We simply look for the sequence and wrap it all.
-                # Regex: (?:\\mathrm\{)? ...
-                # Actually, let's just catch Roman+Superscript first.
-                part = re.sub(r'(?<!\$)\b([IVX]+(?:[\^_](?:\{[^}]+\}|\\circ|\d+)))\b', r'$\1$', part)
-
-                # 2. Wrap \mathrm{...}, potentially followed by superscript/subscript (e.g. \mathrm{g}^{\circ})
-                # We need to capture the following ^... if present to keep it inside $.
-                # Matches: \mathrm{...} followed optionally by ^... or _...
-                # Note: This primitive regex assumes no nested braces in the ^ part unless simply {...}
-                def repl_mathrm(m):
-                    base = m.group(1) # \mathrm{...}
-                    sups = m.group(2) or "" # ^...
-                    return f'${base}{sups}$'
-                
-                part = re.sub(r'(?<!\$)(\\mathrm\{[^}]+\})(?:([\^_](?:\{[^}]+\}|\\circ|\d+|[a-zA-Z])))?', repl_mathrm, part)
-
-                # 3. Wrap Dimensions: 1.5 \times 2.0
-                part = re.sub(r'(?<!\$)(\d+(?:\.\d+)?)\s*\\times\s*(\d+(?:\.\d+)?)', r'$\1 \\times \2$', part)
-
-                # 4. Wrap common standalone math symbols
-                # \sim, \approx, \le, \ge, \pm, \rightarrow, \times (if not caught above)
-                part = re.sub(r'(?<!\$)\\((?:sim|approx|le|ge|pm|rightarrow|times)(?![a-zA-Z]))', r'$\\\1$', part)
-
-                # 5. Fix exponents: 10^9 or 10^{-9}
-                part = re.sub(r'(?<!\$)\b10\^\{?(-?\d+)\}?', r'$10^{\1}$', part)
-                
-                # 6. Fix temperature: 39.5^\circ C or 39.5^{\circ}C
-                # Often appears as: 39 ^\circ C or similar
-                part = re.sub(r'(?<!\$)(\d+(?:\.\d+)?)\s*[\^_]\{?\\circ\}\s*C', r'$\1^{\\circ}C$', part)
-                
-                new_parts.append(part)
-        
-        # Rejoin with $ delimiters
-        # Note: split gives n parts. Join with '$' restores the delimiters.
-        # But wait: "text $math$ text". split -> ["text ", "math", " text"]
-        # join('$') -> "text $math$ text". Correct.
-        return '$'.join(new_parts)
-
-    for book in json_data:
+                entries.append(f'{body[:-1]}, "seq": {seq}, "key": "{key}"}}')
+            emitted.add(key)
+        parts = []
+        for k, v in chapter.items():
+            v = '[' + ', '.join(entries) + ']' if k == 'questions' else encode_json(v)
+            parts.append(f'{json.dumps(k)}: {v}')
+        return '{' + ', '.join(parts) + '}'
+
+    def chapter_bin(self, packed):
+        """Binary shard for one packed chapter; always self-contained, so no [key, seq] references."""
+        chapter = packed['chapter']
+        questions = []
+        for qid, seq, digest, body in zip(packed['ids'], packed['seqs'], packed['digests'], packed['bodies']):
+            self.add(qid, digest, body, chapter['title'])
+            q = json.loads(body)
+            q['seq'] = seq
+            questions.append(q)
+        return encode_chapter_bin(chapter, questions)
+
+    def report(self):
+        print(f"Question store: {self.bodies} bodies for {self.refs} questions "
+              f"({self.refs - self.bodies} deduplicated, {sum(map(len, self.variants.values()))} variant)")
+        for (qid, _), (first_title, title) in self.collisions.items():
+            print(f'Warning: ID collision {qid}: different questions in "{first_title}" and "{title}"')
+
+def iter_books_js(books, cache=None, store=None, sizes=None, index=None):
+    """
+    Yield the BOOKS literal piece by piece. A book's "chapters" may be any
+    iterable, e.g. iter_chapters(), so chapters are TeX-fixed, encoded and
+    released one at a time; question bodies are deduplicated through `store`.
+    With `index` each book also gets a "search" index file.
+    """
+    if store is None: store = QuestionStore()
+    yield '['
+    for i, book in enumerate(books):
+        if i: yield ', '
+        head = json.dumps({k: v for k, v in book.items() if k != 'chapters'}, ensure_ascii=False)
+        yield head[:-1] + ', "chapters": ['
+        count = 0
         for chap in book.get('chapters', []):
-            for q in chap.get('questions', []):
-                q['title'] = fix_tex(q.get('title', ''))
-                q['analysis'] = fix_tex(q.get('analysis', ''))
-                q['answer'] = fix_tex(q.get('answer', '')) # Answer might have latex too
-                if 'options' in q:
-                    for opt in q['options']:
-                        opt['text'] = fix_tex(opt['text'])
-
-    data_js = json.dumps(json_data, ensure_ascii=False)
-    
-    return f"""<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>儿科题库 (Pediatrics QBank)</title>
-    <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
-    <script>
-    MathJax = {{
-      tex: {{
-        inlineMath: [['$', '$'], ['\\\\(', '\\\\)']]
-      }},
-      svg: {{
-        fontCache: 'global'
-      }}
-    }};
-    </script>
-    <script type="text/javascript" id="MathJax-script" async
-      src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js">
-    </script>
-    <style>
-        :root {{
-            --bg: #f4f6f9; --text: #333; --card: #fff;
-            --primary: #4a90e2; --success: #2ecc71; --danger: #e74c3c;
-            --border: #e1e4e8; --gray: #888;
-        }}
-        @media (prefers-color-scheme: dark) {{
-            :root {{
-                --bg: #1a1a1a; --text: #e0e0e0; --card: #2d2d2d;
-                --primary: #5d9cec; --border: #444;
-            }}
-            .option.correct {{ background: rgba(46, 204, 113, 0.2) !important; border-color: #2ecc71 !important; color: #a2f2c2 !important; }}
-            .option.wrong {{ background: rgba(231, 76, 60, 0.2) !important; border-color: #e74c3c !important; color: #f5b7b1 !important; }}
-        }}
-        body {{ font-family: -apple-system, sans-serif; background: var(--bg); color: var(--text); margin: 0; height: 100vh; display: flex; overflow: hidden; }}
-        
-        /* 布局 */
-        .sidebar {{ width: 280px; background: var(--card); border-right: 1px solid var(--border); overflow-y: auto; flex-shrink: 0; display: flex; flex-direction: column; }}
-        .book-switcher {{ display: flex; border-bottom: 1px solid var(--border); background: var(--bg); }}
-        .book-tab {{ flex: 1; padding: 12px; text-align: center; cursor: pointer; font-size: 14px; font-weight: 500; color: var(--gray); border-bottom: 2px solid transparent; }}
-        .book-tab.active {{ color: var(--primary); border-bottom-color: var(--primary); background: var(--card); }}
-        
-        .main {{ flex: 1; display: flex; flex-direction: column; overflow: hidden; position: relative; }}
-        .chapter-list {{ flex: 1; overflow-y: auto; }}
-        .chapter-item {{ padding: 12px 15px; border-bottom: 1px solid var(--border); cursor: pointer; font-size: 14px; }}
-        .chapter-item:hover {{ background: var(--bg); }}
-        .chapter-item.active {{ background: rgba(74, 144, 226, 0.1); color: var(--primary); border-left: 4px solid var(--primary); }}
-        
-        .toolbar {{ padding: 10px; background: var(--card); border-bottom: 1px solid var(--border); display: flex; gap: 10px; align-items: center; }}
-        .search-input {{ flex: 1; padding: 8px; border: 1px solid var(--border); border-radius: 4px; background: var(--bg); color: var(--text); }}
-        
-        .content {{ flex: 1; overflow-y: auto; padding: 15px; scroll-behavior: smooth; }}
-        .card {{ background: var(--card); border-radius: 8px; padding: 20px; margin-bottom: 20px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); }}
-        
-        /* 题目样式 */
-        .q-title {{ font-size: 1.1em; font-weight: 600; margin-bottom: 15px; line-height: 1.5; }}
-        .option {{ padding: 10px; border: 1px solid var(--border); border-radius: 6px; margin-bottom: 8px; cursor: pointer; display: flex; }}
-        .option:hover {{ background: rgba(0,0,0,0.02); }}
-        .option.selected {{ border-color: var(--primary); background: rgba(74, 144, 226, 0.05); }}
-        .option.correct {{ background: rgba(46, 204, 113, 0.15); border-color: var(--success); color: #155724; }}
-        .option.wrong {{ background: rgba(231, 76, 60, 0.15); border-color: var(--danger); color: #721c24; }}
-        
-        /* 解析与数据 */
-        .group-options-box {{ background: var(--bg); padding: 10px; border-radius: 6px; margin-bottom: 10px; border: 1px dashed var(--gray); font-size: 0.9em; }}
-        .group-option-item {{ margin-bottom: 4px; }}
-        .simple-options-container {{ display: flex; gap: 8px; flex-wrap: wrap; margin-bottom: 5px; }}
-        .simple-option-btn {{ width: 36px; height: 36px; display: flex; align-items: center; justify-content: center; border: 1px solid var(--border); border-radius: 50%; cursor: pointer; font-weight: bold; background: var(--card); }}
-        .simple-option-btn:hover {{ background: rgba(0,0,0,0.05); }}
-        .simple-option-btn.selected {{ border-color: var(--primary); background: var(--primary); color: white; }}
-        .simple-option-btn.correct {{ border-color: var(--success); background: var(--success); color: white; }}
-        .simple-option-btn.wrong {{ border-color: var(--danger); background: var(--danger); color: white; }}
-
-        .analysis-box {{ margin-top: 15px; padding: 15px; background: var(--bg); border-radius: 6px; display: none; }}
-        .analysis-box.show {{ display: block; }}
-        .stat-btn {{ color: var(--primary); cursor: pointer; text-decoration: underline; font-size: 0.9em; margin-left: 10px; }}
-        .stat-display {{ display: none; font-weight: bold; color: var(--primary); margin-left: 5px; }}
-        
-        /* 底部操作 */
-        .footer-actions {{ margin-top: 15px; padding-top: 10px; border-top: 1px solid var(--border); display: flex; gap: 20px; color: var(--gray); font-size: 0.9em; }}
-        .action {{ cursor: pointer; display: flex; align-items: center; gap: 4px; }}
-        .action:hover {{ color: var(--primary); }}
-        .fav-active {{ color: #f1c40f; }}
-
-        /* 评论区 */
-        .comments-box {{ margin-top: 15px; display: none; border-top: 1px dashed var(--border); padding-top: 10px; }}
-        .comment-item {{ font-size: 0.9em; padding: 8px 0; border-bottom: 1px solid var(--border); }}
-        .comment-item p {{ margin: 4px 0 0 0; }}
-        .md-content img {{ max-width: 100%; }}
-        
-        .input-tabs {{ display: flex; gap: 10px; margin-bottom: 5px; border-bottom: 1px solid var(--border); }}
-        .input-tabs .tab {{ padding: 5px 10px; cursor: pointer; font-size: 13px; color: var(--gray); }}
-        .input-tabs .tab.active {{ color: var(--primary); border-bottom: 2px solid var(--primary); font-weight: bold; }}
-        .toolbar {{ display: flex; gap: 2px; }}
-        .toolbar button {{ padding: 2px 6px; font-size: 12px; background: #eee; border: 1px solid #ccc; border-radius: 3px; cursor: pointer; }}
-        .cmt-textarea {{ width: 100%; min-height: 80px; padding: 8px; border: 1px solid var(--border); border-radius: 4px; box-sizing: border-box; font-family: inherit; }}
-        .cmt-preview-box {{ min-height: 80px; padding: 10px; background: #f9f9f9; border: 1px solid var(--border); border-radius: 4px; font-size: 0.9em; }}
-        
-        /* 移动端 */
-        @media (max-width: 768px) {{
-            .sidebar {{ position: absolute; height: 100%; z-index: 100; transform: translateX(-100%); transition: 0.3s; }}
-            .sidebar.show {{ transform: translateX(0); }}
-            .toggle-menu {{ display: block; }}
-        }}
-
-        /* 模态框 */
-        .modal {{ display: none; position: fixed; top: 0; left: 0; width: 100%; height: 100%; background: rgba(0,0,0,0.5); z-index: 1000; justify-content: center; align-items: center; }}
-        .modal.show {{ display: flex; }}
-        .modal-content {{ background: var(--card); padding: 25px; border-radius: 8px; width: 300px; max-width: 90%; position: relative; }}
-        .close-btn {{ position: absolute; top: 10px; right: 10px; cursor: pointer; font-size: 20px; }}
-        .form-group {{ margin-bottom: 15px; }}
-        .form-group label {{ display: block; margin-bottom: 5px; font-size: 0.9em; }}
-        .form-input {{ width: 100%; padding: 8px; border: 1px solid var(--border); border-radius: 4px; box-sizing: border-box; }}
-        .btn-primary {{ width: 100%; padding: 10px; background: var(--primary); color: white; border: none; border-radius: 4px; cursor: pointer; }}
-        .btn-secondary {{ width: 100%; padding: 10px; background: var(--bg); border: 1px solid var(--border); color: var(--text); border-radius: 4px; cursor: pointer; margin-top: 10px; }}
-        .user-info {{ display: flex; align-items: center; gap: 10px; margin-right: 15px; font-size: 14px; cursor: pointer; }}
-    </style>
-</head>
-<body>
-
-<div class="sidebar" id="sidebar">
-    <div class="book-switcher" id="bookTabs"></div>
-    <div class="chapter-list" id="chapList"></div>
-</div>
-
-<div class="main">
-    <div class="toolbar">
-        <button onclick="toggleSidebar()" style="background:none; border:1px solid var(--border); padding:5px 10px; border-radius:4px; color:var(--text)">☰</button>
-        <input class="search-input" id="search" placeholder="搜索题目..." oninput="filterQ()">
-        <button onclick="toggleWrong()" id="btnWrong" style="background:none; border:1px solid var(--border); padding:5px; border-radius:4px; color:var(--text)">只看错题</button>
-        <button onclick="toggleFavFilter()" id="btnFavFilter" style="background:none; border:1px solid var(--border); padding:5px; border-radius:4px; color:var(--text); margin-left:5px">只看收藏</button>
-        <button onclick="resetProgress()" style="background:none; border:1px solid var(--border); padding:5px; border-radius:4px; color:var(--text); margin-left:5px" title="重置本章进度">↺</button>
-        <div style="flex:1"></div> 
-        <div id="user-area" class="user-info" onclick="showUserModal()">
-            <span id="user-name">未登录</span> 👤
-        </div>
-    </div>
-    <div class="content" id="content"></div>
-</div>
-
-<div id="auth-modal" class="modal">
-    <div class="modal-content">
-        <span class="close-btn" onclick="closeModal()">×</span>
-        
-        <div id="auth-form">
-            <h3 id="auth-title">登录</h3>
-            <div class="form-group">
-                <label>用户名</label>
-                <input type="text" id="u-name" class="form-input">
-            </div>
-            <div class="form-group">
-                <label>密码</label>
-                <input type="password" id="u-pass" class="form-input">
-            </div>
-            <div class="form-group" id="invite-group" style="display:none">
-                <label>邀请码 (注册必填)</label>
-                <input type="text" id="u-code" class="form-input">
-            </div>
-            <button class="btn-primary" onclick="doAuth()">提交</button>
-            <div style="margin-top:10px; text-align:center; font-size:12px">
-                <a href="#" onclick="toggleAuthMode()">没有账号？去注册</a>
-            </div>
-        </div>
-
-        <div id="user-panel" style="display:none">
-            <h3>个人中心</h3>
-            <p>你好, <b id="panel-name"></b></p>
-            <p style="font-size:12px; color:var(--gray)">云端最后同步: <span id="sync-time">从未</span></p>
-            
-            <button class="btn-primary" onclick="syncUpload()">☁️ 备份进度到云端</button>
-            <button class="btn-secondary" onclick="syncDownload()">⬇️ 从云端恢复进度</button>
-            <button class="btn-secondary" onclick="logout()" style="border-color:var(--danger); color:var(--danger)">退出登录</button>
-        </div>
-    </div>
-</div>
-
-<script>
-    const BOOKS = {data_js}; // [ {{id, title, chapters: []}} ]
-    const API = "{DOMAIN}/api";
-    
-    let state = {{
-        bookIdx: 0,
-        chapIdx: 0,
-        onlyWrong: false,
-        onlyFav: false,
-        records: JSON.parse(localStorage.getItem('qb_records') || '{{}}'), 
-        favs: JSON.parse(localStorage.getItem('qb_favs') || '[]'),
-        stats: {{}}, 
-        nick: localStorage.getItem('qb_nick') || '',
-        user: JSON.parse(localStorage.getItem('qb_user') || 'null')
-    }};
-
-    // ================= 用户系统 =================
-    let isRegister = false;
-
-    function updateUserUI() {{
-        const area = document.getElementById('user-name');
-        if (state.user) {{
-            area.innerText = state.user.username;
-            area.style.color = 'var(--primary)';
-        }} else {{
-            area.innerText = '登录/注册';
-            area.style.color = 'var(--text)';
-        }}
-    }}
-
-    function showUserModal() {{
-        document.getElementById('auth-modal').classList.add('show');
-        if (state.user) {{
-            document.getElementById('auth-form').style.display = 'none';
-            document.getElementById('user-panel').style.display = 'block';
-            document.getElementById('panel-name').innerText = state.user.username;
-        }} else {{
-            document.getElementById('auth-form').style.display = 'block';
-            document.getElementById('user-panel').style.display = 'none';
-        }}
-    }}
-
-    function closeModal() {{
-        document.getElementById('auth-modal').classList.remove('show');
-    }}
-
-    function toggleAuthMode() {{
-        isRegister = !isRegister;
-        document.getElementById('auth-title').innerText = isRegister ? '注册新账号' : '登录';
-        const link = document.querySelector('#auth-form a');
-        link.innerText = isRegister ? '已有账号？去登录' : '没有账号？去注册';
-        // Show/Hide Invite Code
-        document.getElementById('invite-group').style.display = isRegister ? 'block' : 'none';
-    }}
-
-    async function doAuth() {{
-        const name = document.getElementById('u-name').value;
-        const pass = document.getElementById('u-pass').value;
-        const code = document.getElementById('u-code').value; // Get Invite Code
-        
-        if (!name || !pass) return alert('请输入完整');
-        if (isRegister && !code) return alert('请输入邀请码');
-
-        const action = isRegister ? 'register' : 'login';
-        const btn = document.querySelector('#auth-form button');
-        btn.innerText = '处理中...'; btn.disabled = true;
-
-        try {{
-            const payload = {{ username: name, password: pass }};
-            if (isRegister) payload.inviteCode = code; // Send Invite Code
-
-            const res = await fetch(`${{API}}/user?action=${{action}}`, {{
-                method: 'POST',
-                headers: {{ 'Content-Type': 'application/json' }},
-                body: JSON.stringify(payload)
-            }});
-            const data = await res.json();
-            
-            if (data.error) throw new Error(data.error);
-            
-            if (isRegister) {{
-                alert('注册成功，请登录');
-                toggleAuthMode();
-            }} else {{
-                state.user = {{ username: data.username, token: data.token }};
-                localStorage.setItem('qb_user', JSON.stringify(state.user));
-                updateUserUI();
-                closeModal();
-                // 登录后尝试自动拉取一次时间检查（可选）
-                alert('登录成功！请记得定期备份数据。');
-            }}
-        }} catch (e) {{
-            alert(e.message);
-        }} finally {{
-            btn.innerText = '提交'; btn.disabled = false;
+            if count: yield ', '
+            payload = store.chapter_js(encode_chapter(chap, cache))
+            if sizes:
+                sizes.add_chapter(book['title'], chap, compressed_sizes(payload.encode('utf-8')))
+            if index:
+                index.add_chapter(chap)
+            yield payload
+            count += 1
+        yield ']'
+        if index:
+            yield f', "search": {json.dumps(index.write_book(book))}'
+        yield '}'
+        print(f"Book {i + 1} chapters: {count}")
+    yield ']'
+
+def write_fingerprinted(directory, stem, ext, payload):
+    """Write bytes as <stem>.<content hash>.<ext> unless already there; returns the file name."""
+    name = f"{stem}.{hashlib.sha1(payload).hexdigest()[:10]}.{ext}"
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+    return name
+
+def prune_dir(directory, keep):
+    """Remove files (and their .gz/.br siblings) from earlier builds that this build no longer references."""
+    for name in os.listdir(directory):
+        base = name[:-3] if name.endswith(('.gz', '.br')) else name
+        if base not in keep:
+            os.remove(os.path.join(directory, name))
+
+def compressed_sizes(data):
+    """(raw, gzip, brotli) byte counts at maximum compression; brotli is None without the module."""
+    return (len(data), len(gzip.compress(data, 9, mtime=0)),
+            len(brotli.compress(data, quality=11)) if brotli else None)
+
+def precompress(path, immutable=False):
+    """
+    Write .gz / .br siblings of a text artifact at maximum compression and
+    return its (raw, gzip, brotli) sizes. Siblings of fingerprinted
+    (immutable) files are reused when already present.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not PRECOMPRESS:
+        return compressed_sizes(data)
+    sizes = [len(data)]
+    for ext, compress in (('.gz', lambda d: gzip.compress(d, 9, mtime=0)),
+                          ('.br', lambda d: brotli.compress(d, quality=11) if brotli else None)):
+        out = path + ext
+        if not (immutable and os.path.exists(out)):
+            packed = compress(data)
+            if packed is None:
+                sizes.append(None)
+                continue
+            with open(out + '.tmp', 'wb') as f:
+                f.write(packed)
+            os.replace(out + '.tmp', out)
+        sizes.append(os.path.getsize(out))
+    return tuple(sizes)
+
+
+class SizeReport:
+    """Raw / gzip / brotli bytes of the entry files and of every chapter, checked against SIZE_BUDGET."""
+
+    def __init__(self):
+        self.entry = (0, 0, 0)
+        self.books = [] # [(title, [(chapter title, sizes), ...])]
+        self.heaviest = [] # min-heap of (analysis length, id, chapter title)
+
+    def add_entry(self, sizes):
+        self.entry = tuple(None if a is None or b is None else a + b for a, b in zip(self.entry, sizes))
+
+    def add_chapter(self, book_title, chap, sizes):
+        if not self.books or self.books[-1][0] != book_title:
+            self.books.append((book_title, []))
+        self.books[-1][1].append((chap['title'], sizes))
+        for q in chap['questions']:
+            item = (len(q.analysis), q.id, chap['title'])
+            if len(self.heaviest) < HEAVIEST_QUESTIONS:
+                heapq.heappush(self.heaviest, item)
+            elif item > self.heaviest[0]:
+                heapq.heapreplace(self.heaviest, item)
+
+    @staticmethod
+    def total(rows):
+        return tuple(None if None in col else sum(col) for col in zip(*[sizes for _, sizes in rows]))
+
+    def report(self):
+        """Print the report; returns the list of budget violations."""
+        fmt = lambda sizes: " / ".join("-" if n is None else f"{n:,}" for n in sizes)
+        print("Size report (raw / gzip / brotli bytes):")
+        print(f"  entry (index.html + assets): {fmt(self.entry)}")
+        over = []
+        def check(kind, label, sizes):
+            budget = SIZE_BUDGET.get(kind)
+            if budget is not None and sizes[1] > budget:
+                over.append(f"{kind} {label}: {sizes[1]:,} > {budget:,} gzip bytes")
+        if SHARDED_OUTPUT:
+            check("entry", "index.html + assets", self.entry)
+        for title, rows in self.books:
+            totals = self.total(rows)
+            print(f"  {title}: {fmt(totals)}")
+            check("book", f'"{title}"', totals)
+            for chap_title, sizes in rows:
+                print(f"    {chap_title}: {fmt(sizes)}")
+                check("chapter", f'"{chap_title}"', sizes)
+        if self.heaviest:
+            print("  Heaviest questions by analysis length:")
+            for length, qid, chap_title in sorted(self.heaviest, reverse=True):
+                print(f"    {length:,} chars  {qid}  ({chap_title})")
+        return over
+
+# Search index tokens: CJK character bigrams (a lone character stands for itself) and
+# Latin/digit words; TeX control words are skipped. The page tokenizes queries the same
+# way (searchTokens), so keep the two in step; a one-character CJK query or a Latin/digit
+# query matches every key that contains it.
+re_search_cjk = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+re_search_word = re.compile(r'[a-z0-9]+')
+re_search_tex = re.compile(r'\\[a-zA-Z]+')
+
+def search_tokens(text):
+    text = re_search_tex.sub(' ', text).lower()
+    tokens = re_search_word.findall(text)
+    for run in re_search_cjk.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def chapter_terms(chap):
+    """token -> [question position, weight, ...] for one chapter, weights per SEARCH_FIELD_WEIGHTS."""
+    title_w, option_w, analysis_w = SEARCH_FIELD_WEIGHTS
+    terms = collections.defaultdict(list)
+    for pos, q in enumerate(chap.get('questions', [])):
+        weights = collections.Counter()
+        for text, w in ((q.title, title_w), (' '.join(t for _, t in q.options), option_w), (q.analysis, analysis_w)):
+            for token in search_tokens(text):
+                weights[token] += w
+        for token, w in weights.items():
+            terms[token] += (pos, w)
+    return terms
+
+re_html_tag = re.compile(r'<[^>]*>')
+
+def search_snippet(q):
+    """Plain text of the rendered title, cut to SEARCH_SNIPPET_CHARS."""
+    text = ' '.join(html.unescape(re_html_tag.sub('', markdown_html(fix_tex(q.title)))).split())
+    return text if len(text) <= SEARCH_SNIPPET_CHARS else text[:SEARCH_SNIPPET_CHARS] + '…'
+
+def chapter_search(chap):
+    """One chapter's share of the book index: {"terms": chapter_terms, "snippets": [search_snippet, ...]}."""
+    return {"terms": chapter_terms(chap), "snippets": [search_snippet(q) for q in chap.get('questions', [])]}
+
+
+class SearchIndex:
+    """
+    Per-book inverted index, written as SHARD_DIR/<book>-search.<hash>.json and
+    fetched by the page on the first search:
+    {"chapters": [question count, ...], "snippets": [title snippet per doc, ...],
+     "terms": {token: [posting, ...]}}.
+    Documents are numbered through the book's chapters in order; a posting is
+    (doc - previous doc) * 4 + min(weight, 4) - 1. The snippets let the page list
+    hits without downloading their chapters. Chapter entries and the finished
+    book are cached by content.
+    """
+
+    def __init__(self, out_dir, cache=None):
+        self.dir = os.path.join(out_dir, SHARD_DIR)
+        self.cache = cache
+        self.written = set()
+        self.start_book()
+
+    def start_book(self):
+        self.chapters = [] # [(cache key, chapter_search entry or None when cached, question count)]
+
+    def add_chapter(self, chap):
+        count = len(chap.get('questions', []))
+        if not self.cache:
+            self.chapters.append((None, chapter_search(chap), count))
+            return
+        key = self.cache.key(json.dumps(chap, ensure_ascii=False, sort_keys=True, default=Question.to_dict))
+        entry = None
+        if not self.cache.has('search', key):
+            # 新算的条目留在内存里，免得 encode_book 再读回来
+            entry = chapter_search(chap)
+            self.cache.put('search', key, json.dumps(entry, ensure_ascii=False))
+        self.chapters.append((key, entry, count))
+
+    def chapter_entry(self, key, entry):
+        if entry is not None: return entry
+        payload = self.cache.get('search', key, count=False) # has() already counted it
+        return json.loads(payload) if payload is not None else {"terms": {}, "snippets": []}
+
+    def encode_book(self):
+        packed = collections.defaultdict(list)
+        last = {} # token -> previous doc
+        snippets = []
+        base = 0
+        for key, entry, count in self.chapters:
+            entry = self.chapter_entry(key, entry)
+            snippets += entry['snippets']
+            snippets += [''] * (base + count - len(snippets)) # 缓存条目缺失时补齐，保持与文档号对齐
+            for token, postings in entry['terms'].items():
+                out = packed[token]
+                prev = last.get(token, 0)
+                for i in range(0, len(postings), 2):
+                    doc = base + postings[i]
+                    out.append((doc - prev) * 4 + min(postings[i + 1], 4) - 1)
+                    prev = doc
+                last[token] = prev
+            base += count
+        counts = [count for _, _, count in self.chapters]
+        return json.dumps({"chapters": counts, "snippets": snippets, "terms": packed},
+                          ensure_ascii=False, separators=(',', ':'))
+
+    def write_book(self, book):
+        """Write the finished book's index; returns its path relative to the page."""
+        payload = key = None
+        if self.cache:
+            key = self.cache.key(*[k for k, _, _ in self.chapters])
+            payload = self.cache.get('search-book', key)
+        if payload is None:
+            payload = self.encode_book()
+            if self.cache:
+                self.cache.put('search-book', key, payload)
+        os.makedirs(self.dir, exist_ok=True)
+        name = write_fingerprinted(self.dir, f"{book['id']}-search", 'json', payload.encode('utf-8'))
+        self.written.add(name)
+        raw, gz, _ = precompress(os.path.join(self.dir, name), immutable=True)
+        print(f"Search index {book['id']}: {raw:,} bytes ({gz:,} gzip)")
+        self.start_book()
+        return f"{SHARD_DIR}/{name}"
+
+class DeltaPublisher:
+    """
+    Diffs this build's chapter shards against the previous build's manifest.
+    A changed chapter whose old shard is still on disk gets a patch
+    SHARD_DIR/<book>-<n>-patch.<hash>.json:
+    {"from": old shard, "chapter": {fields but questions}, "questions": [old index | question]},
+    so a client holding the old shard downloads only the changed questions.
+    Added, removed and modified question ids per chapter are appended to
+    CHANGELOG_FILE. Only JSON shards are diffed.
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.dir = os.path.join(out_dir, SHARD_DIR)
+        self.previous = {} # book id -> {chapter title: previous manifest entry}
+        try:
+            with open(os.path.join(out_dir, MANIFEST_FILE), encoding='utf-8') as f:
+                for book in json.load(f)['books']:
+                    chapters = self.previous.setdefault(book['id'], {})
+                    for chap in book['chapters']:
+                        chapters.setdefault(chap['title'], chap)
+        except (OSError, ValueError, KeyError):
+            pass # 首次构建或上次为内联模式: 没有可比较的基线
+        self.written = set()
+        self.sources = set() # old shards the patches apply to
+        self.changes = []
+
+    def read_shard(self, path):
+        if not path or not path.endswith('.json'): return None
+        try:
+            with open(os.path.join(self.out_dir, path), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def signatures(chap):
+        """
+        {question key: canonical JSON of each of its entries with its group's
+        options}. A question repeated within the shard is a [key, seq] reference
+        to the earlier entry and is resolved to that body.
+        """
+        groups = chap.get('groups') or {}
+        bodies, signed = {}, {}
+        for e in chap.get('questions', []):
+            if isinstance(e, list): # 同一章内重复出现的题目
+                key, seq = e
+                e = dict(bodies.get(key, {}), seq=seq)
+            else:
+                key = e.get('key') or e['id']
+                bodies[key] = e
+            signed.setdefault(key, []).append(json.dumps([e, groups.get(e.get('group_id'))], ensure_ascii=False, sort_keys=True))
+        return {key: '\n'.join(entries) for key, entries in signed.items()}
+
+    def record(self, book, title, old, new):
+        before, after = self.signatures(old or {}), self.signatures(new or {})
+        change = {
+            "book": book['id'], "chapter": title,
+            "added": [k for k in after if k not in before],
+            "removed": [k for k in before if k not in after],
+            "modified": [k for k in after if k in before and before[k] != after[k]],
+        }
+        if change['added'] or change['removed'] or change['modified']:
+            self.changes.append(change)
+
+    def add_chapter(self, book, title, shard, payload):
+        """Diff one written shard; returns extra manifest fields ({"delta": ...}) or {}."""
+        chapters = self.previous.get(book['id'])
+        if chapters is None: return {}
+        prev = chapters.pop(title, {})
+        old_shard = prev.get('shard')
+        if old_shard == shard:
+            # 本章未变: 沿用上次的补丁，晚一个版本的客户端仍可打补丁
+            kept = prev.get('delta')
+            if not kept or not os.path.exists(os.path.join(self.out_dir, kept['patch'])): return {}
+            self.written.add(kept['patch'].rsplit('/', 1)[-1])
+            self.sources.add(kept['from'])
+            return {"delta": kept}
+        if not shard.endswith('.json'): return {}
+        new = json.loads(payload)
+        old = self.read_shard(old_shard)
+        if old_shard and old is None: return {} # 上次的分片已不在磁盘上，无法比较
+        self.record(book, title, old, new)
+        if old is None: return {}
+
+        # 与旧分片逐字节相同的题目只引用其下标
+        reuse = {}
+        for i, e in enumerate(old['questions']):
+            reuse.setdefault(json.dumps(e, ensure_ascii=False, sort_keys=True), i)
+        questions = [reuse.get(json.dumps(e, ensure_ascii=False, sort_keys=True), e) for e in new['questions']]
+        patch = {"from": old_shard, "chapter": {k: v for k, v in new.items() if k != 'questions'}, "questions": questions}
+        payload = json.dumps(patch, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        stem = shard.rsplit('/', 1)[-1].split('.', 1)[0]
+        name = write_fingerprinted(self.dir, f"{stem}-patch", 'json', payload)
+        precompress(os.path.join(self.dir, name), immutable=True)
+        self.written.add(name)
+        self.sources.add(old_shard)
+        return {"delta": {"from": old_shard, "patch": f"{SHARD_DIR}/{name}"}}
+
+    def finish(self):
+        """Record chapters that disappeared and append this build to CHANGELOG_FILE."""
+        for book_id, chapters in self.previous.items():
+            for title, prev in chapters.items():
+                old = self.read_shard(prev.get('shard'))
+                if old is not None:
+                    self.record({"id": book_id}, title, old, None)
+        if not self.changes: return
+        path = os.path.join(self.out_dir, CHANGELOG_FILE)
+        try:
+            with open(path, encoding='utf-8') as f:
+                builds = json.load(f)['builds']
+        except (OSError, ValueError, KeyError):
+            builds = []
+        builds.insert(0, {"time": time.strftime('%Y-%m-%d %H:%M:%S'), "chapters": self.changes})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"builds": builds[:CHANGELOG_KEEP]}, f, ensure_ascii=False, separators=(',', ':'))
+        precompress(path)
+        counts = [sum(len(c[k]) for c in self.changes) for k in ('added', 'removed', 'modified')]
+        print(f"Delta: {len(self.changes)} chapters changed ({counts[0]} added, {counts[1]} removed, "
+              f"{counts[2]} modified), {len(self.written)} patches")
+
+def write_shards(books, out_dir, cache=None, store=None, sizes=None, index=None, delta=None, retain=()):
+    """
+    Write one content-hashed shard per chapter (JSON, or binary per BANK_FORMAT) under out_dir/SHARD_DIR and
+    return the manifest: [{id, title, chapters: [{title, count, shard[, delta]}]}].
+    Shards are self-contained so any chapter loads with one request; files
+    from earlier builds that are no longer referenced are removed, except the
+    names in retain (the previous build's).
+    """
+    if store is None: store = QuestionStore()
+    shard_dir = os.path.join(out_dir, SHARD_DIR)
+    os.makedirs(shard_dir, exist_ok=True)
+    written = set()
+    manifest = []
+    for i, book in enumerate(books):
+        entry = {k: v for k, v in book.items() if k != 'chapters'}
+        entry['chapters'] = []
+        for chap in book.get('chapters', []):
+            packed = encode_chapter(chap, cache)
+            if BANK_FORMAT == 'binary':
+                payload, ext = store.chapter_bin(packed), 'bin'
+            else:
+                payload, ext = store.chapter_js(packed, emitted=set()).encode('utf-8'), 'json'
+            name = write_fingerprinted(shard_dir, f"{book['id']}-{len(entry['chapters']) + 1}", ext, payload)
+            written.add(name)
+            if sizes:
+                sizes.add_chapter(book['title'], chap, precompress(os.path.join(shard_dir, name), immutable=True))
+            if index:
+                index.add_chapter(chap)
+            chapter = {"title": chap['title'], "count": len(chap['questions']), "shard": f"{SHARD_DIR}/{name}"}
+            if delta:
+                chapter.update(delta.add_chapter(book, chap['title'], chapter['shard'], payload))
+            entry['chapters'].append(chapter)
+        if index:
+            entry['search'] = index.write_book(book)
+        manifest.append(entry)
+        print(f"Book {i + 1} chapters: {len(entry['chapters'])}")
+
+    if delta:
+        delta.finish()
+    prune_dir(shard_dir, written | (index.written if index else set()) | (delta.written if delta else set()) | set(retain))
+    return manifest
+
+def manifest_data_files(manifest):
+    """SHARD_DIR paths a sharded manifest references: chapter shards, their patches and the search indexes."""
+    paths = []
+    for book in manifest:
+        paths += [chap['shard'] for chap in book['chapters']]
+        paths += [chap['delta']['patch'] for chap in book['chapters'] if 'delta' in chap]
+        if 'search' in book:
+            paths.append(book['search'])
+    return paths
+
+re_css_comment = re.compile(r'/\*.*?\*/', re.S)
+re_css_space = re.compile(r'\s*([{};,>])\s*')
+
+def minify_css(css):
+    css = re_css_space.sub(r'\1', re_whitespace.sub(' ', re_css_comment.sub('', css)))
+    return css.replace(';}', '}').strip()
+
+# JS tokens outside template literals; '/' is decided (regex or division) by the previous token
+re_js_token = re.compile(r"""
+    (?P<space>\s+) | (?P<line>//[^\n]*) | (?P<block>/\*.*?\*/)
+  | (?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+  | (?P<word>[\w$\u0080-\uffff]+) | (?P<punct>.)""", re.S | re.X)
+re_js_regex = re.compile(r'/(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[a-z]*')
+re_js_template = re.compile(r'(?:[^`\\$]|\\.|\$(?!\{))*')
+JS_REGEX_AFTER = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'instanceof', 'yield', 'await'}
+
+def minify_js(js):
+    """
+    Drop comments and indentation and squeeze whitespace between tokens.
+    Strings, regex literals and template literals (with nested ${...}) are
+    copied verbatim; line breaks are kept where automatic semicolon insertion
+    could depend on them.
+    """
+    out = []
+    prev = ''         # last token emitted
+    space = ''        # whitespace seen since prev: '', ' ' or '\n'
+    braces = []       # open '{' count per enclosing template substitution
+    pos, end = 0, len(js)
+
+    def emit(token):
+        nonlocal prev, space
+        if space and prev:
+            a, b = prev[-1], token[0]
+            word = lambda c: c.isalnum() or c in '_$' or ord(c) > 127
+            if word(a) and word(b) or a == b and a in '+-':
+                out.append(space)
+            elif space == '\n' and a not in '{;,([' and b not in ')]},;.':
+                out.append(space)
+        out.append(token)
+        prev, space = token, ''
+
+    while pos < end:
+        if js[pos] == '`' or (js[pos] == '}' and braces and braces[-1] == 0):
+            # template literal text, up to the closing ` or the next ${
+            if js[pos] == '}': braces.pop()
+            m = re_js_template.match(js, pos + 1)
+            stop = m.end()
+            if js.startswith('${', stop):
+                braces.append(0)
+                stop += 2
+            else:
+                stop += 1
+            emit(js[pos:stop])
+            pos = stop
+            continue
+        m = re_js_token.match(js, pos)
+        kind, token = m.lastgroup, m.group()
+        pos = m.end()
+        if kind == 'space' or kind == 'line' or kind == 'block':
+            if kind == 'line' or '\n' in token: space = '\n'
+            elif not space: space = ' '
+            continue
+        if token == '/' and not (prev and (prev[-1].isalnum() or prev[-1] in '_$)]}\'"`') and prev not in JS_REGEX_AFTER):
+            regex = re_js_regex.match(js, pos - 1)
+            if regex:
+                token, pos = regex.group(), regex.end()
+        elif token == '{' and braces:
+            braces[-1] += 1
+        elif token == '}' and braces:
+            braces[-1] -= 1
+        emit(token)
+    return ''.join(out)
+
+def write_app_assets(out_dir, retain=()):
+    """
+    Minify TEMPLATE_DIR's app.css and app.js (+ bin_decoder.js) into
+    fingerprinted files under out_dir/ASSET_DIR; returns their (css, js) paths
+    relative to the page. They change only with the code, so the data-only
+    entry page and the assets cache independently. Older assets are removed
+    except the names in retain.
+    """
+    asset_dir = os.path.join(out_dir, ASSET_DIR)
+    os.makedirs(asset_dir, exist_ok=True)
+    css = minify_css(read_template('app.css'))
+    js = minify_js(read_template('app.js', DOMAIN=DOMAIN, SERVICE_WORKER=SERVICE_WORKER,
+                                 MARKED_CDN=MARKED_CDN, MATHJAX_CDN=MATHJAX_CDN) + BIN_DECODER_JS)
+    css_name = write_fingerprinted(asset_dir, 'app', 'css', css.encode('utf-8'))
+    js_name = write_fingerprinted(asset_dir, 'app', 'js', js.encode('utf-8'))
+    prune_dir(asset_dir, {css_name, js_name} | set(retain))
+    return f"{ASSET_DIR}/{css_name}", f"{ASSET_DIR}/{js_name}"
+
+def headers_file():
+    """Cloudflare Pages _headers: fingerprinted files are immutable, entry points always revalidate."""
+    rules = ["/*\n  Access-Control-Allow-Origin: *"]
+    for path in ('/', '/' + OUTPUT_HTML, '/' + MANIFEST_FILE, '/' + SERVICE_WORKER, '/' + ASSET_MANIFEST, '/' + CHANGELOG_FILE):
+        rules.append(f"{path}\n  Cache-Control: {REVALIDATE_CACHE}")
+    for directory in (ASSET_DIR, SHARD_DIR):
+        rules.append(f"/{directory}/*\n  Cache-Control: {IMMUTABLE_CACHE}")
+    return "\n\n".join(rules) + "\n"
+
+def previous_build_files(out_dir):
+    """
+    Fingerprinted SHARD_DIR/ and ASSET_DIR/ paths of the previous build (from
+    its ASSET_MANIFEST). They stay on disk and in the service worker's data
+    list for one more build: a page opened before the deploy still fetches
+    them after the new worker has taken over.
+    """
+    try:
+        with open(os.path.join(out_dir, ASSET_MANIFEST), encoding='utf-8') as f:
+            files = json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return set() # 首次构建
+    return {path for path in files if path.startswith((SHARD_DIR + '/', ASSET_DIR + '/'))}
+
+def in_dir(paths, directory):
+    """File names of the paths that lie directly under directory."""
+    return {path[len(directory) + 1:] for path in paths if path.startswith(directory + '/')}
+
+def asset_manifest(out_dir, files):
+    """{"version", "files": {path: content hash}} for the emitted files (paths relative to out_dir)."""
+    hashes = {}
+    for path in sorted(files):
+        with open(os.path.join(out_dir, path), 'rb') as f:
+            hashes[path] = hashlib.sha1(f.read()).hexdigest()[:10]
+    version = hashlib.sha1(json.dumps(hashes, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    return {"version": version, "files": hashes}
+
+def service_worker_js(manifest, shell, keep=()):
+    """
+    Service worker for one build. The page shell (index.html, assets, manifest)
+    is precached per version; navigations go to the network first so a deploy
+    is picked up on the next visit, and fall back to the cached page offline.
+    Content-hashed data files share one cache and are added as they are fetched
+    or when the page asks for a book. A new build changes VERSION, so browsers
+    install the new worker in the background and it takes over at once. Cached
+    files listed in keep (the bases of this build's patches and the previous
+    build's data, which pages opened before the deploy still use) survive
+    until the next build.
+    """
+    data = [path for path in manifest['files'] if path.startswith(SHARD_DIR + '/')]
+    data += sorted(set(keep) - set(data))
+    cdn = sorted({url.split('/npm/')[0] for url in (MARKED_CDN, MATHJAX_CDN)})
+    return f"""// 由 convert.py 生成，请勿手动修改
+const VERSION = "{manifest['version']}";
+const SCOPE = self.registration.scope;
+const SHELL = {json.dumps(shell)}.map(p => new URL(p, SCOPE).href);
+const DATA = new Set({json.dumps(data)}.map(p => new URL(p, SCOPE).href));
+const CDN = {json.dumps(cdn)};
+const SHELL_CACHE = `qbank-shell-${{VERSION}}`;
+const DATA_CACHE = 'qbank-data';
+const CDN_CACHE = 'qbank-cdn';
+
+self.addEventListener('install', e => {{
+    e.waitUntil(caches.open(SHELL_CACHE).then(c => c.addAll(SHELL)).then(() => self.skipWaiting()));
+}});
+
+self.addEventListener('activate', e => {{
+    e.waitUntil((async () => {{
+        for (const key of await caches.keys()) {{
+            if (key.startsWith('qbank-shell-') && key !== SHELL_CACHE) await caches.delete(key);
         }}
-    }}
-
-    function logout() {{
-        state.user = null;
-        localStorage.removeItem('qb_user');
-        updateUserUI();
-        closeModal();
-    }}
-
-    // ================= 数据同步 =================
-    
-    async function syncUpload() {{
-        if (!state.user) return alert('请先登录');
-        if (!confirm('确定要将本地进度上传覆盖云端吗？')) return;
-
-        try {{
-            const res = await fetch(`${{API}}/user?action=upload`, {{
-                method: 'POST',
-                headers: {{ 
-                    'Content-Type': 'application/json',
-                    'Authorization': 'Bearer ' + state.user.token 
-                }},
-                body: JSON.stringify({{ records: state.records, favs: state.favs }})
-            }});
-            const data = await res.json();
-            if (data.error) throw new Error(data.error);
-            
-            alert('备份成功！');
-            document.getElementById('sync-time').innerText = new Date().toLocaleString();
-        }} catch (e) {{
-            alert('上传失败: ' + e.message);
-            if (e.message.includes('失效')) logout();
+        // 数据文件名含内容哈希: 只删除本次构建不再引用的
+        const data = await caches.open(DATA_CACHE);
+        for (const req of await data.keys()) {{
+            if (!DATA.has(req.url)) await data.delete(req);
         }}
+        await self.clients.claim();
+    }})());
+}});
+
+async function cacheFirst(cacheName, req) {{
+    const cache = await caches.open(cacheName);
+    const hit = await cache.match(req);
+    if (hit) return hit;
+    const res = await fetch(req);
+    if (res.ok) cache.put(req, res.clone());
+    return res;
+}}
+
+async function staleWhileRevalidate(cacheName, req, e) {{
+    const cache = await caches.open(cacheName);
+    const hit = await cache.match(req);
+    const update = fetch(req).then(res => {{
+        if (res.ok || res.type === 'opaque') cache.put(req, res.clone());
+        return res;
+    }});
+    if (hit) {{
+        e.waitUntil(update.catch(() => {{}}));
+        return hit;
     }}
-
-    async function syncDownload() {{
-        if (!state.user) return alert('请先登录');
-        if (!confirm('警告：这将使用云端数据覆盖本地进度，本地未备份的数据将丢失！确定吗？')) return;
-
-        try {{
-            const res = await fetch(`${{API}}/user?action=download`, {{
-                method: 'GET',
-                headers: {{ 'Authorization': 'Bearer ' + state.user.token }}
-            }});
-            const data = await res.json();
-            if (data.error) throw new Error(data.error);
-            if (data.empty) return alert('云端暂无备份数据');
-
-            // 恢复数据
-            state.records = data.records || {{}};
-            state.favs = data.favs || [];
-            
-            // 写入本地存储
-            localStorage.setItem('qb_records', JSON.stringify(state.records));
-            localStorage.setItem('qb_favs', JSON.stringify(state.favs));
-            
-            // 刷新界面
-            alert('恢复成功！');
-            document.getElementById('sync-time').innerText = new Date(data.updated_at).toLocaleString();
-            loadChap(state.chapIdx); // 刷新当前视图
-        }} catch (e) {{
-            alert('下载失败: ' + e.message);
-        }}
+    return update;
+}}
+
+self.addEventListener('fetch', e => {{
+    const req = e.request;
+    if (req.method !== 'GET') return;
+    const url = req.url.split('#')[0];
+    if (req.mode === 'navigate' && url.startsWith(SCOPE)) {{
+        // 入口页先走网络，保证与服务器上的数据文件同一版本；离线时用缓存的外壳
+        e.respondWith(fetch(req).catch(() => caches.match(SHELL[0]).then(hit => hit || Response.error())));
+    }} else if (SHELL.includes(url)) {{
+        e.respondWith(cacheFirst(SHELL_CACHE, req));
+    }} else if (DATA.has(url)) {{
+        e.respondWith(cacheFirst(DATA_CACHE, req));
+    }} else if (CDN.some(origin => url.startsWith(origin))) {{
+        e.respondWith(staleWhileRevalidate(CDN_CACHE, req, e));
     }}
-
-    window.copyQ = (qid) => {{
-        const b = BOOKS[state.bookIdx];
-        let q = null;
-        for(let c of b.chapters) {{
-             q = c.questions.find(x=>x.id===qid);
-             if(q) break;
-        }}
-        if(!q) return;
-        
-        const typeStr = q.type==='multi' ? '多选题' : '单选题';
-        let text = `[${{typeStr}}] ${{q.title}}\n`;
-        q.options.forEach(o => {{
-            text += `${{o.label}}. ${{o.text}}\n`;
-        }});
-        text += `\n正确答案: ${{q.answer}}`;
-        if(q.analysis) text += `\n解析: ${{q.analysis}}`;
-        
-        navigator.clipboard.writeText(text).then(() => {{
-            const btn = document.querySelector(`#card-${{qid}} .action:nth-child(3)`);
-            if(btn) {{
-                 const origin = btn.innerHTML;
-                 btn.innerHTML = '✅ 已复制';
-                 setTimeout(()=>btn.innerHTML = origin, 2000);
+    // 其他请求 (API 等) 直接走网络
+}});
+
+// 页面切换书目时请求预缓存该书的全部章节
+self.addEventListener('message', e => {{
+    if (!e.data || e.data.type !== 'precache') return;
+    e.waitUntil((async () => {{
+        const cache = await caches.open(DATA_CACHE);
+        for (const path of e.data.urls) {{
+            const href = new URL(path, SCOPE).href;
+            if (!DATA.has(href) || await cache.match(href)) continue;
+            try {{
+                await cache.add(href);
+            }} catch (err) {{
+                // 离线或请求失败: 下次再试
             }}
-        }}).catch(err=>alert('复制失败'));
-    }};
-
-    window.filterQ = () => {{
-        renderList();
-    }};
-
-    window.toggleAnalysis = (qid) => {{
-        const box = document.getElementById(`analysis-${{qid}}`);
-        if(box) box.classList.toggle('show');
-    }};
-
-    function init() {{
-        renderBooks();
-        loadChap(0);
-        updateUserUI();
-        window.onbeforeunload = () => {{
-            localStorage.setItem('qb_records', JSON.stringify(state.records));
-            localStorage.setItem('qb_favs', JSON.stringify(state.favs));
-        }};
-    }}
-
-    function renderBooks() {{
-        const html = BOOKS.map((b, i) => 
-            `<div class="book-tab ${{i===state.bookIdx?'active':''}}" onclick="switchBook(${{i}})">${{b.title}}</div>`
-        ).join('');
-        document.getElementById('bookTabs').innerHTML = html;
-    }}
-    
-    function switchBook(idx) {{
-        state.bookIdx = idx;
-        renderBooks(); // update active tab
-        loadChap(0);
-    }}
-
-    function renderMenu() {{
-        const chapters = BOOKS[state.bookIdx].chapters;
-        document.getElementById('chapList').innerHTML = chapters.map((c, i) => 
-            `<div class="chapter-item ${{i===state.chapIdx?'active':''}}" onclick="loadChap(${{i}})">
-                ${{c.title}} <span style="font-size:0.8em; color:var(--gray)">(${{c.questions.length}})</span>
-            </div>`
-        ).join('');
-    }}
-
-    function loadChap(idx) {{
-        state.chapIdx = idx;
-        renderMenu();
-        document.getElementById('sidebar').classList.remove('show');
-        renderList();
-        
-        // 批量获取统计数据
-        const data = BOOKS[state.bookIdx];
-        if(!data.chapters[idx]) return;
-        
-        const ids = data.chapters[idx].questions.map(q => q.id);
-        fetch(API + '/batch-info', {{
-            method: 'POST', body: JSON.stringify({{ ids }})
-        }}).then(async r => {{
-            if (!r.ok) {{
-                const err = await r.text();
-                console.error("Batch Info Error:", r.status, err);
-                return;
-            }}
-            return r.json();
-        }}).then(res => {{
-            if(res) {{
-                state.stats = {{ ...state.stats, ...res }};
-                updateStatsUI(ids); 
-            }}
-        }}).catch(e => console.error("Network Error:", e));
-    }}
-
-    function renderList() {{
-        const b = BOOKS[state.bookIdx];
-        if (!b || !b.chapters[state.chapIdx]) return;
-        
-        const qs = b.chapters[state.chapIdx].questions;
-        const kw = document.getElementById('search').value.toLowerCase();
-        
-        // Calculate Stats for Chart
-        let done = 0, correct = 0, wrong = 0;
-        qs.forEach(q => {{
-            const rec = state.records[q.id];
-            if (rec && rec.status) {{
-                done++;
-                if (rec.status === 'correct') correct++;
-                else wrong++;
-            }}
-        }});
-        const total = qs.length;
-        const pCorrect = total ? (correct / total * 100) : 0;
-        const pWrong = total ? (wrong / total * 100) : 0;
-        // const pUndone = total ? 100 - pCorrect - pWrong : 100; // Not directly used in conic-gradient, calculated implicitly
-
-        // Sticky Header HTML
-        const chartHtml = `
-        <div id="chap-header" style="position:sticky; top:0; z-index:100; background:rgba(255,255,255,0.95); backdrop-filter:blur(5px); padding:10px 15px; border-bottom:1px solid #eee; display:flex; align-items:center; justify-content:space-between; margin: -15px -15px 15px -15px; box-shadow:0 2px 5px rgba(0,0,0,0.05)">
-            <div style="font-weight:bold; font-size:1.1em">${{b.chapters[state.chapIdx].title}}</div>
-            <div style="display:flex; align-items:center; gap:10px">
-                <div class="text-stats" style="text-align:right; font-size:12px; line-height:1.2; color:#666">
-                    <div>已做 ${{done}}/${{total}}</div>
-                    <div>正确率 ${{done ? Math.round(correct/done*100) : 0}}%</div>
-                </div>
-                <!-- Pie Chart with CSS Conic Gradient -->
-                <div class="chart-container" style="width:36px; height:36px; border-radius:50%; background: conic-gradient(
-                    var(--success) 0% ${{pCorrect}}%, 
-                    var(--danger) ${{pCorrect}}% ${{pCorrect + pWrong}}%, 
-                    #eee ${{pCorrect + pWrong}}% 100%
-                )"></div>
-            </div>
-        </div>`;
-
-        // Description HTML (Teaching Objectives)
-        const chapDesc = b.chapters[state.chapIdx].desc;
-        const descHtml = chapDesc ? `<div class="chapter-desc" style="background:#f9f9f9; padding:15px; border-radius:8px; margin-bottom:20px; border-left:4px solid var(--primary); color:#555; font-size:0.95em; line-height:1.6">${{chapDesc}}</div>` : '';
-
-        const listHtml = qs.filter(q => {{
-            const isWrong = state.records[q.id]?.status === 'wrong';
-            if (state.onlyWrong && !isWrong) return false;
-            
-            const isFav = state.favs.includes(q.id);
-            if (state.onlyFav && !isFav) return false;
-            
-            return q.title.toLowerCase().includes(kw) || q.id.includes(kw);
-        }}).map((q, i, arr) => {{
-             // Check if group start
-             const prev = arr[i-1];
-             const isGroupStart = q.group_id && (!prev || prev.group_id !== q.group_id);
-             return buildCard(q, isGroupStart);
-        }}).join('');
-        
-        document.getElementById('content').innerHTML = chartHtml + descHtml + (listHtml || '<div style="text-align:center; padding:20px; color:var(--gray)">没有找到题目</div>');
-        
-        // 恢复状态
-        qs.forEach(q => {{
-            if (state.records[q.id]?.checked) checkAnswer(q.id, true);
-        }});
-
-        // 渲染数学公式
-        if (window.MathJax) {{
-             MathJax.typesetPromise && MathJax.typesetPromise();
-        }}
-    }}
-
-    function buildCard(q, isGroupStart = false) {{
-        const isFav = state.favs.includes(q.id);
-        const stat = state.stats[q.id] || {{ fav:0, rate:0, total:0 }};
-        
-        // Group Header (Shared Options)
-        let groupHeader = '';
-        if (isGroupStart && q.group_id) {{
-             const optsHtml = q.options.map(o => 
-                 `<div class="group-option-item"><b>${{o.label}}.</b> ${{o.text}}</div>`
-             ).join('');
-             groupHeader = `<div class="group-options-box">${{optsHtml}}</div>`;
-        }}
-
-        let contentHtml = '';
-        let optionsHtml = '';
-
-        if (q.type === 'essay' || q.type === 'mix' || q.type === 'case') {{
-             optionsHtml = `<button onclick="toggleAnalysis('${{q.id}}')" style="padding:8px 15px; background:var(--primary); color:#fff; border:none; border-radius:4px; cursor:pointer">查看答案</button>`;
-        }} else {{
-             // If grouped, show simplified buttons
-             if (q.group_id) {{
-                  optionsHtml = `<div class="simple-options-container">` + 
-                      q.options.map(o => 
-                        `<div class="simple-option-btn" id="opt-${{q.id}}-${{o.label}}" onclick="clickOpt('${{q.id}}', '${{o.label}}', '${{q.type}}')">${{o.label}}</div>`
-                      ).join('') + 
-                  `</div>`;
-             }} else {{
-                  // Normal Display
-                  optionsHtml = q.options.map(o => 
-                    `<div class="option" id="opt-${{q.id}}-${{o.label}}" onclick="clickOpt('${{q.id}}', '${{o.label}}', '${{q.type}}')">
-                        <b style="width:25px">${{o.label}}.</b> 
-                        <span>${{o.text}}</span>
-                     </div>`
-                ).join('');
-             }}
         }}
+    }})());
+}});
+"""
 
-        const submitBtn = q.type === 'multi' ? `<button onclick="checkAnswer('${{q.id}}')" style="margin-top:10px; padding:5px 15px; background:var(--primary); color:#fff; border:none; border-radius:4px">提交</button>` : '';
-
-        // Label for question type
-        let typeLabel = '单选题';
-        if (q.type === 'multi') typeLabel = '多选题';
-        else if (q.type === 'essay') typeLabel = '名词解释';
-        else if (q.type === 'mix') typeLabel = '简答题';
-        else if (q.type === 'case') typeLabel = '病例分析';
-
-        const seqBadge = q.seq ? `<span class="badg">[${{q.seq}}]</span>` : '';
-
-        return `
-        <div class="card" id="card-${{q.id}}">
-            <div style="font-size:12px; color:var(--gray); margin-bottom:5px">ID: ${{q.id}} · ${{typeLabel}}</div>
-            ${{groupHeader}}
-            <div class="q-title">
-                ${{seqBadge}} 
-                ${{marked.parse(q.title)}}
-            </div>
-            <div>${{optionsHtml}}</div>
-            ${{submitBtn}}
-            
-            <div class="analysis-box" id="analysis-${{q.id}}">
-                <div><strong>参考答案:</strong> ${{q.answer || '见解析'}}</div>
-                <div style="margin-top:5px"><strong>解析:</strong> 
-                    <div class="md-content">${{marked.parse(q.analysis || '暂无解析')}}</div>
-                    ${{ (q.type === 'essay' || q.type === 'mix' || q.type === 'case') ? '' : 
-                    `<span class="stat-btn" onclick="showRate('${{q.id}}', this)">📊 查看正确率</span>
-                    <span class="stat-display" id="rate-${{q.id}}"></span>` }}
-                </div>
-            </div>
-
-            <div class="footer-actions">
-                <div class="action ${{isFav?'fav-active':''}}" onclick="toggleFav('${{q.id}}', this)">
-                    ★ <span class="fav-cnt">${{stat.fav}}</span>
-                </div>
-                <div class="action" onclick="toggleComments('${{q.id}}')">💬 评论</div>
-                <div class="action" onclick="copyQ('${{q.id}}')">📋 复制</div>
-            </div>
-            
-            <div class="comments-box" id="cmt-box-${{q.id}}">
-                <div id="cmt-list-${{q.id}}" style="margin-bottom:10px; max-height:200px; overflow-y:auto">加载中...</div>
-                <div class="input-tabs">
-                    <span class="tab active" onclick="switchCommentTab('${{q.id}}', 'edit')">编辑</span>
-                    <span class="tab" onclick="switchCommentTab('${{q.id}}', 'preview')">预览</span>
-                </div>
-                <div id="cmt-edit-${{q.id}}" style="display:block">
-                    <div style="margin-bottom:5px; display:flex; gap:5px">
-                        <input id="nick-${{q.id}}" placeholder="昵称" style="width:80px; padding:5px; border:1px solid #ddd; border-radius:4px" value="${{state.nick}}">
-                        <div class="toolbar">
-                            <button onclick="insertMd('${{q.id}}', '**', '**')">B</button>
-                            <button onclick="insertMd('${{q.id}}', '*', '*')">I</button>
-                            <button onclick="insertMd('${{q.id}}', '\\`', '\\`')">Code</button>
-                        </div>
-                    </div>
-                    <textarea id="cmt-in-${{q.id}}" class="cmt-textarea" placeholder="支持 Markdown 格式..."></textarea>
-                    <div style="text-align:right; margin-top:5px">
-                        <button class="primary-btn" onclick="postCmt('${{q.id}}')">发布评论</button>
-                    </div>
-                </div>
-                <div id="cmt-preview-${{q.id}}" class="md-content cmt-preview-box" style="display:none"></div>
-            </div>
-        </div>`;
-    }}
-
-    // 交互逻辑
-    window.clickOpt = (qid, label, type) => {{
-        if (state.records[qid]?.checked) return;
-        
-        let ans = state.records[qid]?.ans || [];
-        if (type === 'single') {{
-            state.records[qid] = {{ ans: [label], checked: false }};
-            checkAnswer(qid);
-        }} else {{
-            // 多选切换
-            if (ans.includes(label)) ans = ans.filter(x=>x!==label);
-            else ans.push(label);
-            state.records[qid] = {{ ans, checked: false }};
-            // 渲染选中态
-            document.querySelectorAll(`#card-${{qid}} .option, #card-${{qid}} .simple-option-btn`).forEach(el => {{
-                el.classList.remove('selected');
-                const l = el.id.split('-').pop();
-                if (ans.includes(l)) el.classList.add('selected');
-            }});
-        }}
-    }};
-
-    window.checkAnswer = (qid, isReplay=false) => {{
-        const b = BOOKS[state.bookIdx];
-        let q = null;
-        for(let c of b.chapters) {{
-             q = c.questions.find(x=>x.id===qid);
-             if(q) break;
-        }}
-        if (!q) return; // Fallback scan
-        
-        const myAns = state.records[qid]?.ans || [];
-        
-        // 判分
-        const rightStr = q.answer.split('').sort().join('');
-        const myStr = [...myAns].sort().join('');
-        const isCorrect = rightStr === myStr;
-
-        state.records[qid].checked = true;
-        state.records[qid].status = isCorrect ? 'correct' : 'wrong';
-
-        // 样式更新
-        const card = document.getElementById(`card-${{qid}}`);
-        if(card) {{
-            card.querySelectorAll('.option, .simple-option-btn').forEach(el => {{
-                el.classList.remove('selected');
-                // Remove old status classes just in case
-                el.classList.remove('correct');
-                el.classList.remove('wrong');
-                const l = el.id.split('-').pop();
-                if (q.answer.includes(l)) el.classList.add('correct');
-                else if (myAns.includes(l)) el.classList.add('wrong');
-            }});
-        }}
-
-        // 显示解析
-        const anaBox = document.getElementById(`analysis-${{qid}}`);
-        if(anaBox) anaBox.classList.add('show');
-        
-        // 自动展开评论 (仅在用户刚答完时，回放时不自动展开以免干扰)
-        if (!isReplay) {{
-             toggleComments(qid, true); 
-             // 上报答题结果
-             reportAnswer(qid, isCorrect);
-             // Update Chart Dynamically
-             updateChart();
-        }}
-    }};
-
-    function reportAnswer(qid, isCorrect) {{
-        fetch(API + '/stats', {{
-            method: 'POST',
-            body: JSON.stringify({{ questionId: qid, type: 'answer', value: isCorrect ? 1 : 0 }})
-        }});
-    }}
-    
-    function updateChart() {{
-        const b = BOOKS[state.bookIdx];
-        if (!b || !b.chapters[state.chapIdx]) return;
-        const qs = b.chapters[state.chapIdx].questions;
-        
-        let done = 0, correct = 0, wrong = 0;
-        qs.forEach(q => {{
-            const rec = state.records[q.id];
-            if (rec && rec.status) {{
-                done++;
-                if (rec.status === 'correct') correct++;
-                else wrong++;
-            }}
-        }});
-        const total = qs.length;
-        const pCorrect = total ? (correct / total * 100) : 0;
-        const pWrong = total ? (wrong / total * 100) : 0;
-        
-        const header = document.getElementById('chap-header');
-        if(header) {{
-            const chartDiv = header.querySelector('.chart-container');
-            const textDiv = header.querySelector('.text-stats');
-            
-            if(textDiv) {{
-                textDiv.innerHTML = `<div>已做 ${{done}}/${{total}}</div><div>正确率 ${{done ? Math.round(correct/done*100) : 0}}%</div>`;
-            }}
-            if(chartDiv) {{
-                chartDiv.style.background = `conic-gradient(
-                    var(--success) 0% ${{pCorrect}}%, 
-                    var(--danger) ${{pCorrect}}% ${{pCorrect + pWrong}}%, 
-                    #eee ${{pCorrect + pWrong}}% 100%
-                )`;
-            }}
-        }}
-    }}
-
-    window.showRate = (qid, btn) => {{
-        const stat = state.stats[qid];
-        const span = document.getElementById(`rate-${{qid}}`);
-        if (stat && stat.total > 0) {{
-            span.innerText = `正确率: ${{stat.rate}}% (共 ${{stat.total}} 次)`;
-        }} else {{
-            span.innerText = "暂无数据";
-        }}
-        span.style.display = 'inline';
-        btn.style.display = 'none';
-    }};
-
-    window.toggleComments = async (qid, forceOpen=false) => {{
-        const box = document.getElementById(`cmt-box-${{qid}}`);
-        if (!forceOpen && box.style.display === 'block') {{
-            box.style.display = 'none';
-            return;
-        }}
-        box.style.display = 'block';
-        
-        // 加载评论
-        const res = await fetch(`${{API}}/comments?qid=${{qid}}`);
-        const list = await res.json();
-        
-        if (!res.ok) {{
-            alert("加载评论失败: " + (list.error || "未知错误"));
-            document.getElementById(`cmt-list-${{qid}}`).innerHTML = '<div style="color:red; padding:10px">加载失败</div>';
-            return;
-        }}
-
-        // Check current user
-        const currUser = localStorage.getItem('qb_username');
-        console.log("Current User:", currUser);
-        
-        const html = list.map(c => {{
-            const isMine = currUser && (c.nickname === currUser); 
-            if(c.nickname === currUser && !isMine) console.warn("Mismatch type/value?", c.nickname, currUser);
-            const editBtn = isMine ? `<span style="color:blue; cursor:pointer; margin-left:10px; font-size:0.8em" onclick="editCmt('${{qid}}', ${{c.id}}, this)">[编辑]</span>` : '';
-            
-            return `
-            <div class="comment-item" id="cmt-item-${{c.id}}">
-                <div>
-                    <b style="color:var(--primary)">${{c.nickname}}</b> 
-                    <span style="font-size:0.8em; color:#aaa">${{new Date(c.created_at*1000).toLocaleDateString()}}</span>
-                    ${{editBtn}}
-                </div>
-                <div class="md-content" id="cmt-content-${{c.id}}">${{marked.parse(c.content)}}</div>
-                <div style="display:none" id="cmt-raw-${{c.id}}">${{c.content}}</div>
-            </div>`;
-        }}
-        ).join('') || '<div style="padding:10px; text-align:center">暂无评论</div>';
-        
-        document.getElementById(`cmt-list-${{qid}}`).innerHTML = html;
-        if (window.MathJax) MathJax.typesetPromise();
-    }};
-
-    window.editCmt = (qid, cid, btn) => {{
-        const raw = document.getElementById(`cmt-raw-${{cid}}`).innerText;
-        document.getElementById(`cmt-in-${{qid}}`).value = raw;
-        
-        // Switch to edit mode UI
-        const postBtn = document.querySelector(`#cmt-edit-${{qid}} .primary-btn`);
-        postBtn.innerText = "更新评论";
-        postBtn.dataset.mode = "update";
-        postBtn.dataset.cid = cid;
-        
-        // Add cancel button if not exists
-        let cancelBtn = document.getElementById(`cmt-cancel-${{qid}}`);
-        if(!cancelBtn) {{
-            cancelBtn = document.createElement('button');
-            cancelBtn.id = `cmt-cancel-${{qid}}`;
-            cancelBtn.innerText = "取消";
-            cancelBtn.style.marginLeft = "10px";
-            cancelBtn.style.background = "#eee";
-            cancelBtn.onclick = () => window.cancelEdit(qid);
-            postBtn.parentNode.appendChild(cancelBtn);
-        }}
-        cancelBtn.style.display = 'inline-block';
-        
-        // Scroll to input
-        document.getElementById(`cmt-edit-${{qid}}`).scrollIntoView({{behavior:'smooth'}});
-    }};
-
-    window.cancelEdit = (qid) => {{
-        const postBtn = document.querySelector(`#cmt-edit-${{qid}} .primary-btn`);
-        postBtn.innerText = "发布评论";
-        postBtn.dataset.mode = "create";
-        delete postBtn.dataset.cid;
-        
-        const cancelBtn = document.getElementById(`cmt-cancel-${{qid}}`);
-        if(cancelBtn) cancelBtn.style.display = 'none';
-        
-        document.getElementById(`cmt-in-${{qid}}`).value = '';
-    }};
-
-    window.postCmt = async (qid) => {{
-        const nick = document.getElementById(`nick-${{qid}}`).value;
-        const content = document.getElementById(`cmt-in-${{qid}}`).value;
-        if(!nick || !content) return alert("请填写完整");
-        
-        localStorage.setItem('qb_nick', nick);
-        state.nick = nick;
-        
-        const token = localStorage.getItem('qb_token');
-        const headers = {{ 'Content-Type': 'application/json' }};
-        if(token) headers['Authorization'] = 'Bearer ' + token;
-
-        const btn = document.querySelector(`#cmt-edit-${{qid}} .primary-btn`);
-        const mode = btn.dataset.mode || 'create';
-        
-            if (mode === 'update') {{
-                const cid = btn.dataset.cid;
-                res = await fetch(`${{API}}/comments`, {{
-                    method: 'PUT',
-                    headers: headers,
-                    body: JSON.stringify({{ commentId: cid, content }})
-                }});
-                if(res.ok) window.cancelEdit(qid); 
-            }} else {{
-                res = await fetch(`${{API}}/comments?qid=${{qid}}`, {{
-                    method: 'POST', 
-                    headers: headers,
-                    body: JSON.stringify({{ nickname:nick, content }})
-                }});
-            }}
-            
-            const data = await res.json();
-            if(!res.ok) {{
-                alert("操作失败: " + (data.error || "未知错误"));
-            }} else {{
-                document.getElementById(`cmt-in-${{qid}}`).value = '';
-                toggleComments(qid, true);
-            }}
-    }};
+BOOKS_PLACEHOLDER = '/*__BOOKS__*/'
+re_html_indent = re.compile(r'\n\s+') # 页面模板里没有 <pre>/<textarea>，缩进和空行可直接去掉
 
-    window.switchCommentTab = (qid, mode) => {{
-        const editBox = document.getElementById(`cmt-edit-${{qid}}`);
-        const prevBox = document.getElementById(`cmt-preview-${{qid}}`);
-        const card = document.getElementById(`card-${{qid}}`);
-        const tabs = card.querySelectorAll('.input-tabs .tab');
-        
-        if(mode === 'edit') {{
-            editBox.style.display = 'block';
-            prevBox.style.display = 'none';
-            tabs[0].classList.add('active');
-            tabs[1].classList.remove('active');
-        }} else {{
-            const content = document.getElementById(`cmt-in-${{qid}}`).value;
-            editBox.style.display = 'none';
-            prevBox.style.display = 'block';
-            prevBox.innerHTML = content ? marked.parse(content) : '<i style="color:#999">暂无内容</i>';
-            if(window.MathJax) MathJax.typesetPromise();
-            tabs[0].classList.remove('active');
-            tabs[1].classList.add('active');
-        }}
-    }};
-
-    window.insertMd = (qid, start, end) => {{
-        const textarea = document.getElementById(`cmt-in-${{qid}}`);
-        const s = textarea.selectionStart;
-        const e = textarea.selectionEnd;
-        const val = textarea.value;
-        const before = val.substring(0, s);
-        const sel = val.substring(s, e);
-        const after = val.substring(e);
-        textarea.value = before + start + sel + end + after;
-        textarea.selectionStart = s + start.length;
-        textarea.selectionEnd = e + start.length;
-        textarea.focus();
-    }};
-
-    window.toggleFav = async (qid, el) => {{
-        const isAdd = !state.favs.includes(qid);
-        if(isAdd) state.favs.push(qid);
-        else state.favs = state.favs.filter(x=>x!==qid);
-        
-        // 乐观更新
-        el.classList.toggle('fav-active');
-        const numSpan = el.querySelector('.fav-cnt');
-        numSpan.innerText = parseInt(numSpan.innerText) + (isAdd?1:-1);
-        
-        fetch(API + '/stats', {{
-            method: 'POST', body: JSON.stringify({{ questionId:qid, type:'fav', value: isAdd?1:-1 }})
-        }});
-    }};
-
-    window.toggleSidebar = () => document.getElementById('sidebar').classList.toggle('show');
-    window.toggleWrong = () => {{
-        state.onlyWrong = !state.onlyWrong;
-        document.getElementById('btnWrong').style.background = state.onlyWrong ? 'var(--primary)' : 'none';
-        document.getElementById('btnWrong').style.color = state.onlyWrong ? '#fff' : 'var(--text)';
-        renderList();
-    }};
-
-    window.toggleFavFilter = () => {{
-        state.onlyFav = !state.onlyFav;
-        document.getElementById('btnFavFilter').style.background = state.onlyFav ? 'var(--primary)' : 'none';
-        document.getElementById('btnFavFilter').style.color = state.onlyFav ? '#fff' : 'var(--text)';
-        renderList();
-    }};
-
-    window.resetProgress = () => {{
-        if(!confirm("确定要重置当前章节的答题进度吗？此操作不可恢复。")) return;
-        const b = BOOKS[state.bookIdx];
-        if (!b) return;
-        const chap = b.chapters[state.chapIdx];
-        if (!chap) return;
-        
-        let count = 0;
-        chap.questions.forEach(q => {{
-            if(state.records[q.id]) {{
-                delete state.records[q.id];
-                count++;
-            }}
-        }});
-        
-        if(count > 0) {{
-            localStorage.setItem('qb_rec', JSON.stringify(state.records));
-            renderList();
-            alert(`已重置 ${{count}} 道题目的进度。`);
-        }} else {{
-            alert("当前章节没有答题记录。");
-        }}
-    }};
-    window.updateStatsUI = (ids) => {{
-        ids.forEach(id => {{
-            const el = document.querySelector(`#card-${{id}} .fav-cnt`);
-            if(el && state.stats[id]) el.innerText = state.stats[id].fav;
-        }});
-    }};
-    
-    init();
-</script>
-</body>
-</html>
-"""
+def get_html_template(data_js, css=f"{ASSET_DIR}/app.css", js=f"{ASSET_DIR}/app.js"):
+    """The entry page (TEMPLATE_DIR/index.html): markup, the BOOKS literal and links to the app assets."""
+    page = re_html_indent.sub('\n', read_template('index.html', APP_CSS=css, APP_JS=js))
+    return page.replace(BOOKS_PLACEHOLDER, data_js)
 
 def main():
+    started = time.perf_counter()
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
+    cache = BuildCache(CACHE_DIR) if CACHE_DIR else None
+    previous = previous_build_files(OUTPUT_DIR)
+    store = QuestionStore()
+    sizes = SizeReport()
+    index = SearchIndex(OUTPUT_DIR, cache)
+    delta = DeltaPublisher(OUTPUT_DIR) if SHARDED_OUTPUT else None
     print("Parsing books...")
-    
-    # Build books data
+
+    # Build books data (chapters are parsed lazily while the page is written)
+    pool = ProcessPoolExecutor(PARALLEL_WORKERS) if PARALLEL_WORKERS > 1 else None
+    if pool:
+        parsing = ParallelParse(BOOK_SOURCES, pool, cache, window=PARALLEL_WORKERS * 4)
+        book_chapters = parsing.chapters
+    else:
+        book_chapters = lambda i: iter_chapters(BOOK_SOURCES[i]['files'], cache)
     books = [
-        {
-            "id": "q1",
-            "title": "儿科学（题库1）",
-            "chapters": convert_to_json(['Q1.md'])
-        },
-        {
-            "id": "q2",
-            "title": "儿科学习题集（题库2）",
-            "chapters": convert_to_json(['Q2.md'])
-        }
+        {"id": source["id"], "title": source["title"], "chapters": book_chapters(i)}
+        for i, source in enumerate(BOOK_SOURCES)
     ]
-    
-    print(f"Book 1 chapters: {len(books[0]['chapters'])}")
-    print(f"Book 2 chapters: {len(books[1]['chapters'])}")
 
-    html = get_html_template(books)
-    
-    with open(os.path.join(OUTPUT_DIR, OUTPUT_HTML), 'w', encoding='utf-8') as f:
-        f.write(html)
-        
-    with open(os.path.join(OUTPUT_DIR, '_headers'), 'w', encoding='utf-8') as f:
-        f.write("/*\n  Cache-Control: no-cache\n  Access-Control-Allow-Origin: *")
+    # Stream chapter payloads between the template head and tail (or into shards)
+    css, js = write_app_assets(OUTPUT_DIR, in_dir(previous, ASSET_DIR))
+    html_head, html_tail = get_html_template(BOOKS_PLACEHOLDER, css, js).split(BOOKS_PLACEHOLDER)
+    out_path = os.path.join(OUTPUT_DIR, OUTPUT_HTML)
+    if BANK_FORMAT == 'binary' and not SHARDED_OUTPUT:
+        print("Warning: BANK_FORMAT 'binary' needs SHARDED_OUTPUT, writing JSON inline")
+    try:
+        if SHARDED_OUTPUT:
+            manifest = write_shards(books, OUTPUT_DIR, cache, store, sizes, index, delta, in_dir(previous, SHARD_DIR))
+            with open(os.path.join(OUTPUT_DIR, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                json.dump({"books": manifest}, f, ensure_ascii=False)
+            parts = [json.dumps(manifest, ensure_ascii=False)]
+        else:
+            parts = iter_books_js(books, cache, store, sizes, index)
+        with open(out_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(html_head)
+            for part in parts:
+                f.write(part)
+            f.write(html_tail)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    os.replace(out_path + '.tmp', out_path)
+    if not SHARDED_OUTPUT:
+        prune_dir(os.path.join(OUTPUT_DIR, SHARD_DIR), index.written | in_dir(previous, SHARD_DIR))
 
+    with open(os.path.join(OUTPUT_DIR, '_headers'), 'w', encoding='utf-8') as f:
+        f.write(headers_file())
+
+    # Precompress entry files (shards were compressed as they were written)
+    sizes.add_entry(precompress(out_path))
+    for path in (css, js):
+        sizes.add_entry(precompress(os.path.join(OUTPUT_DIR, path), immutable=True))
+    if SHARDED_OUTPUT:
+        precompress(os.path.join(OUTPUT_DIR, MANIFEST_FILE))
+
+    # Asset manifest + service worker over everything this build emitted (files kept from the previous build excluded)
+    shell = [OUTPUT_HTML, css, js]
+    if SHARDED_OUTPUT: shell.append(MANIFEST_FILE)
+    data = manifest_data_files(manifest) if SHARDED_OUTPUT else [f"{SHARD_DIR}/{name}" for name in sorted(index.written)]
+    manifest_files = asset_manifest(OUTPUT_DIR, shell + data)
+    keep = {path for path in previous if path.startswith(SHARD_DIR + '/')} | (delta.sources if delta else set())
+    for name, text in ((ASSET_MANIFEST, json.dumps(manifest_files, indent=1)),
+                       (SERVICE_WORKER, service_worker_js(manifest_files, ['./'] + shell, keep))):
+        with open(os.path.join(OUTPUT_DIR, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+        precompress(os.path.join(OUTPUT_DIR, name))
+    if PRECOMPRESS and not brotli:
+        print("Warning: brotli module not installed, .br files skipped (pip install brotli)")
+
+
+    store.report()
+    over_budget = sizes.report()
+    if cache:
+        cache.prune()
+        cache.report()
+    print(f"Built in {(time.perf_counter() - started) * 1000:.0f} ms")
+    if over_budget:
+        for line in over_budget:
+            print(f"Error: size budget exceeded: {line}")
+        sys.exit(1)
     print("Done! Upload 'dist' and 'functions' to Cloudflare.")
 
 if __name__ == "__main__":
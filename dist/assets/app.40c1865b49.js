@@ -0,0 +1,218 @@
+function resolveGroups(chap){if(!chap.groups)return;chap.questions.forEach(q=>{if(q.group_id&&!q.options)q.options=chap.groups[q.group_id]||[];});}
+const QUESTIONS={};function resolveChapter(chap){chap.questions=chap.questions.map(e=>{if(Array.isArray(e))return{...QUESTIONS[e[0]],seq:e[1]};QUESTIONS[e.key||e.id]=e;return e;});resolveGroups(chap);}
+BOOKS.forEach(b=>b.chapters.forEach(c=>{if(c.questions)resolveChapter(c);}));function patchShard(chap){if(!chap.delta||!window.caches)return Promise.resolve(null);if(!chap.patching){chap.patching=(async()=>{const cache=await caches.open('qbank-data');const url=p=>new URL(p,location.href).href;if(await cache.match(url(chap.shard)))return null;const old=await cache.match(url(chap.delta.from));if(!old)return null;const res=await fetch(chap.delta.patch);if(!res.ok)throw new Error(`${chap.delta.patch}: ${res.status}`);const[base,patch]=await Promise.all([old.json(),res.json()]);const data=Object.assign({},patch.chapter,{questions:patch.questions.map(e=>typeof e==='number'?base.questions[e]:e)});await cache.put(url(chap.shard),new Response(JSON.stringify(data),{headers:{'Content-Type':'application/json'}}));return data;})().catch(e=>{console.warn("Patch failed, fetching full shard:",e);return null;});}
+return chap.patching;}
+function fetchChapter(chap){if(chap.questions)return Promise.resolve(chap);if(!chap.loading){chap.loading=patchShard(chap).then(patched=>patched||fetch(chap.shard).then(r=>{if(!r.ok)throw new Error(`${chap.shard}: ${r.status}`);return chap.shard.endsWith('.bin')?r.arrayBuffer().then(decodeChapter):r.json();})).then(data=>{Object.assign(chap,data);resolveChapter(chap);indexChapter(chap);return chap;}).catch(e=>{chap.loading=null;throw e;});}
+return chap.loading;}
+function plainText(html){const t=document.createElement('template');t.innerHTML=html;return t.content.textContent;}
+function escapeHtml(text){return text.replace(/&/g,'&amp;').replace(/</g,'&lt;').replace(/>/g,'&gt;');}
+const scriptLoading={};function loadScript(src){if(!scriptLoading[src]){scriptLoading[src]=new Promise((resolve,reject)=>{const s=document.createElement('script');s.src=src;s.async=true;s.onload=resolve;s.onerror=()=>{delete scriptLoading[src];reject(new Error(`${src} 加载失败`));};document.head.appendChild(s);});}
+return scriptLoading[src];}
+function loadMarked(){return window.marked?Promise.resolve():loadScript("https://cdn.jsdelivr.net/npm/marked/marked.min.js");}
+let mathJaxLoading=null;function loadMathJax(){if(mathJaxLoading)return mathJaxLoading;window.MathJax={tex:{inlineMath:[['$','$'],['\\(','\\)']]},svg:{fontCache:'local'},startup:{typeset:false}};mathJaxLoading=loadScript("https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js").then(()=>MathJax.startup.promise).catch(e=>{mathJaxLoading=null;throw e;});return mathJaxLoading;}
+let mathQueue=Promise.resolve();function typesetMath(elements,job){mathQueue=mathQueue.then(()=>{if(job?.cancelled)return false;return loadMathJax().then(()=>MathJax.typesetPromise(elements)).then(()=>true);}).catch(e=>{console.warn(e);return false;});return mathQueue;}
+function hasTeX(text){return text.includes('$')||text.includes('\\(');}
+const MATH_MARGIN='300px';const mathCache=new Map();const mathJobs=new Map();let mathObserver=null;function watchMath(target,elements,key){if(!elements.length)return;const cached=key&&mathCache.get(key);if(cached&&cached.length===elements.length){elements.forEach((el,i)=>{el.innerHTML=cached[i];});return;}
+if(!mathObserver){mathObserver=new IntersectionObserver(onMathVisible,{root:document.getElementById('content'),rootMargin:`${MATH_MARGIN} 0px`});}
+const old=mathJobs.get(target);if(old)old.cancelled=true;mathJobs.set(target,{elements,key,cancelled:false});mathObserver.observe(target);}
+function onMathVisible(entries){for(const{target,isIntersecting}of entries){const job=mathJobs.get(target);if(!isIntersecting||!job||job.queued)continue;job.queued=true;mathObserver.unobserve(target);typesetMath(job.elements,job).then(done=>{if(mathJobs.get(target)===job)mathJobs.delete(target);if(!done)return;if(job.key)mathCache.set(job.key,job.elements.map(el=>el.innerHTML));if(job.cancelled)MathJax.typesetClear(job.elements);else scheduleWindow();});}}
+function cancelMath(node){for(const[target,job]of mathJobs){if(node&&!node.contains(target))continue;job.cancelled=true;mathJobs.delete(target);if(mathObserver)mathObserver.unobserve(target);}
+if(window.MathJax?.typesetClear)MathJax.typesetClear(node?[node]:undefined);}
+const SEARCH_LIMIT=50;function loadSearchIndex(b){if(!b.search)return Promise.resolve(null);if(!b.searchLoading){b.searchLoading=fetch(b.search).then(r=>{if(!r.ok)throw new Error(`${b.search}: ${r.status}`);return r.json();}).then(idx=>{idx.terms=new Map(Object.entries(idx.terms));idx.keys=[...idx.terms.keys()];idx.starts=[];let n=0;idx.chapters.forEach(count=>{idx.starts.push(n);n+=count;});return idx;}).catch(e=>{b.searchLoading=null;throw e;});}
+return b.searchLoading;}
+function searchTokens(text){text=text.replace(/\\[a-zA-Z]+/g,' ').toLowerCase();const tokens=text.match(/[a-z0-9]+/g)||[];for(const run of text.match(/[㐀-䶿一-鿿豈-﫿]+/g)||[]){if(run.length===1)tokens.push(run);else for(let i=0;i<run.length-1;i++)tokens.push(run.slice(i,i+2));}
+return[...new Set(tokens)];}
+function addPostings(hits,list){let doc=0;for(const v of list){doc+=v>>2;hits.set(doc,(hits.get(doc)||0)+(v&3)+1);}}
+function searchBook(idx,tokens){let scores=null;for(const token of tokens){const hits=new Map();if(token.length===1||/^[a-z0-9]/.test(token)){for(const key of idx.keys){if(key.includes(token))addPostings(hits,idx.terms.get(key));}}else if(idx.terms.has(token)){addPostings(hits,idx.terms.get(token));}
+if(scores){for(const[doc,score]of scores){if(hits.has(doc))scores.set(doc,score+hits.get(doc));else scores.delete(doc);}}else{scores=hits;}
+if(!scores.size)break;}
+return scores||new Map();}
+let searchSeq=0;async function renderSearch(kw){const seq=++searchSeq;const content=document.getElementById('content');let indexes;try{indexes=await Promise.all(BOOKS.map(loadSearchIndex));}catch(e){console.error("Search Index Error:",e);if(seq===searchSeq)content.innerHTML='<div style="text-align:center; padding:20px; color:var(--danger)">搜索索引加载失败</div>';return;}
+if(seq!==searchSeq)return;const tokens=searchTokens(kw);const hits=[];BOOKS.forEach((b,bi)=>{const idx=indexes[bi];if(!idx||!tokens.length)return;for(const[doc,score]of searchBook(idx,tokens)){let ci=idx.starts.length-1;while(idx.starts[ci]>doc)ci--;hits.push({bi,ci,pos:doc-idx.starts[ci],score});}});hits.sort((x,y)=>y.score-x.score);const idKw=kw.toLowerCase();if(/^[0-9a-f]{4,12}$/.test(idKw)){BOOKS.forEach((b,bi)=>b.chapters.forEach((c,ci)=>(c.questions||[]).forEach((q,pos)=>{if(q.id.includes(idKw))hits.unshift({bi,ci,pos});})));}
+const filtering=state.onlyWrong||state.onlyFav;const show=done=>{if(seq!==searchSeq)return;const shown=[],seen=new Set();let waiting=false,total=0;for(const h of hits){const key=`${h.bi}/${h.ci}/${h.pos}`;if(seen.has(key))continue;seen.add(key);if(filtering){const q=BOOKS[h.bi].chapters[h.ci].questions?.[h.pos];if(!q){waiting=true;continue;}
+if(state.onlyWrong&&state.records[q.id]?.status!=='wrong')continue;if(state.onlyFav&&!state.favs.has(q.id))continue;}
+total++;if(shown.length<SEARCH_LIMIT)shown.push(h);}
+const header=`<div style="font-size:13px; color:var(--gray); margin-bottom:10px">搜索 “${escapeHtml(kw)}”: ${total} 条结果${total>shown.length?`，显示前 ${shown.length} 条`:''}</div>`;const list=shown.map(h=>`<div class="search-hit" onclick="openHit(${h.bi}, ${h.ci}, ${h.pos})">
+            <div class="search-hit-meta">${BOOKS[h.bi].title} · ${BOOKS[h.bi].chapters[h.ci].title}</div>
+            <div>${escapeHtml(hitSnippet(indexes[h.bi],h))}</div>
+        </div>`).join('');const more=waiting&&!done?'<div style="text-align:center; padding:10px; color:var(--gray)">正在筛选…</div>':'';content.innerHTML=header+(list||more?list+more:'<div style="text-align:center; padding:20px; color:var(--gray)">没有找到题目</div>');};show(!filtering);if(!filtering)return;const chaps=new Set(hits.map(h=>BOOKS[h.bi].chapters[h.ci]).filter(c=>!c.questions));await Promise.all([...chaps].map(c=>fetchChapter(c).then(()=>show(false),e=>console.error("Chapter Load Error:",e))));show(true);}
+function hitSnippet(idx,h){const snippet=idx&&idx.snippets?idx.snippets[idx.starts[h.ci]+h.pos]:null;if(snippet!=null)return snippet;const q=BOOKS[h.bi].chapters[h.ci].questions?.[h.pos];const title=q?plainText(q.title).trim():'';return title.length>100?title.slice(0,100)+'…':title;}
+window.openHit=(bookIdx,chapIdx,pos)=>{document.getElementById('search').value='';state.bookIdx=bookIdx;renderBooks();Promise.resolve(loadChap(chapIdx)).then(()=>{const q=BOOKS[bookIdx].chapters[chapIdx].questions?.[pos];if(q)scrollToQuestion(q.id);});};const API="https://PediatricsQBank.heihaheihaha.com/api";let state={bookIdx:0,chapIdx:0,onlyWrong:false,onlyFav:false,records:JSON.parse(localStorage.getItem('qb_records')||'{}'),favs:new Set(JSON.parse(localStorage.getItem('qb_favs')||'[]')),stats:{},nick:localStorage.getItem('qb_nick')||'',user:JSON.parse(localStorage.getItem('qb_user')||'null')};const DB_NAME='qbank';const DB_VERSION=1;const STORE_FLUSH_DELAY=1000;const dirtyRecords=new Set();const dirtyFavs=new Set();let db=null;let storeReplaced=false;let flushTimer=0;function openStore(){return new Promise((resolve,reject)=>{const req=indexedDB.open(DB_NAME,DB_VERSION);req.onupgradeneeded=()=>{req.result.createObjectStore('records');req.result.createObjectStore('favs');};req.onsuccess=()=>resolve(req.result);req.onerror=()=>reject(req.error);});}
+function loadStore(){if(!window.indexedDB)return Promise.resolve();return openStore().then(opened=>new Promise((resolve,reject)=>{const tx=opened.transaction(['records','favs'],'readwrite');const records=tx.objectStore('records'),favs=tx.objectStore('favs');for(const[qid,r]of Object.entries(state.records))records.put(r,qid);state.favs.forEach(qid=>favs.put(1,qid));const keys=records.getAllKeys(),values=records.getAll(),favKeys=favs.getAllKeys();tx.oncomplete=()=>{db=opened;state.records={};keys.result.forEach((qid,i)=>{state.records[qid]=values.result[i];});state.favs=new Set(favKeys.result);['qb_records','qb_favs','qb_rec'].forEach(k=>localStorage.removeItem(k));resolve();};tx.onerror=()=>reject(tx.error);})).catch(e=>console.warn("IndexedDB:",e));}
+function saveRecord(qid){dirtyRecords.add(qid);scheduleFlush();}
+function saveFav(qid){dirtyFavs.add(qid);scheduleFlush();}
+function saveAll(){storeReplaced=true;flushStore();}
+function scheduleFlush(){if(!flushTimer)flushTimer=setTimeout(flushStore,STORE_FLUSH_DELAY);}
+function flushStore(){clearTimeout(flushTimer);flushTimer=0;localStorage.setItem('qb_progress',JSON.stringify(savedProgress));if(!db){localStorage.setItem('qb_records',JSON.stringify(state.records));localStorage.setItem('qb_favs',JSON.stringify([...state.favs]));dirtyRecords.clear();dirtyFavs.clear();return;}
+if(!dirtyRecords.size&&!dirtyFavs.size&&!storeReplaced)return;const replaced=storeReplaced;const recIds=replaced?Object.keys(state.records):[...dirtyRecords];const favIds=replaced?[...state.favs]:[...dirtyFavs];dirtyRecords.clear();dirtyFavs.clear();storeReplaced=false;const tx=db.transaction(['records','favs'],'readwrite');const records=tx.objectStore('records'),favs=tx.objectStore('favs');if(replaced){records.clear();favs.clear();}
+recIds.forEach(qid=>state.records[qid]?records.put(state.records[qid],qid):records.delete(qid));favIds.forEach(qid=>state.favs.has(qid)?favs.put(1,qid):favs.delete(qid));tx.onerror=()=>{console.warn("IndexedDB:",tx.error);if(replaced)storeReplaced=true;recIds.forEach(qid=>dirtyRecords.add(qid));favIds.forEach(qid=>dirtyFavs.add(qid));};}
+const questionIndex=new Map();const chaptersOf=new Map();const savedProgress=JSON.parse(localStorage.getItem('qb_progress')||'{}');function progressKey(chap){return`${chap.book.id}/${chap.title}`;}
+function addProgress(p,status,sign){if(!p||!status)return;p.done+=sign;p[status]+=sign;}
+function mergeProgress(total,p,sign){if(!p)return;total.done+=sign*p.done;total.correct+=sign*p.correct;total.wrong+=sign*p.wrong;}
+function initIndexes(){BOOKS.forEach(b=>{b.progress={done:0,correct:0,wrong:0};b.chapters.forEach((c,i)=>{c.book=b;c.index=i;c.progress=savedProgress[progressKey(c)]||null;mergeProgress(b.progress,c.progress,1);if(c.questions)indexChapter(c);});});}
+function indexChapter(chap){if(chap.indexed)return;chap.indexed=true;const p={done:0,correct:0,wrong:0};chap.questions.forEach(q=>{if(!questionIndex.has(q.id))questionIndex.set(q.id,q);const list=chaptersOf.get(q.id);if(list)list.push(chap);else chaptersOf.set(q.id,[chap]);addProgress(p,state.records[q.id]?.status,1);});mergeProgress(chap.book.progress,chap.progress,-1);mergeProgress(chap.book.progress,p,1);chap.progress=savedProgress[progressKey(chap)]=p;renderChapterProgress(chap);}
+function reindexProgress(){BOOKS.forEach(b=>b.chapters.forEach(c=>{delete savedProgress[progressKey(c)];c.progress=null;c.indexed=false;}));questionIndex.clear();chaptersOf.clear();initIndexes();}
+function updateProgress(qid,before,after){if(before===after)return;(chaptersOf.get(qid)||[]).forEach(c=>{[c.progress,c.book.progress].forEach(p=>{addProgress(p,before,-1);addProgress(p,after,1);});renderChapterProgress(c);});renderBooks();}
+function progressBar(p,total){if(!p||!total)return'';return`<div class="chap-bar" title="已做 ${p.done}/${total}"><i style="width:${p.correct/total*100}%; background:var(--success)"></i><i style="width:${p.wrong/total*100}%; background:var(--danger)"></i></div>`;}
+function chapterCount(c){return c.questions?c.questions.length:c.count;}
+function renderChapterProgress(chap){if(chap.book!==BOOKS[state.bookIdx])return;const el=document.getElementById(`chap-prog-${chap.index}`);if(el)el.innerHTML=progressBar(chap.progress,chapterCount(chap));}
+let isRegister=false;function updateUserUI(){const area=document.getElementById('user-name');if(state.user){area.innerText=state.user.username;area.style.color='var(--primary)';}else{area.innerText='登录/注册';area.style.color='var(--text)';}}
+function showUserModal(){document.getElementById('auth-modal').classList.add('show');if(state.user){document.getElementById('auth-form').style.display='none';document.getElementById('user-panel').style.display='block';document.getElementById('panel-name').innerText=state.user.username;}else{document.getElementById('auth-form').style.display='block';document.getElementById('user-panel').style.display='none';}}
+function closeModal(){document.getElementById('auth-modal').classList.remove('show');}
+function toggleAuthMode(){isRegister=!isRegister;document.getElementById('auth-title').innerText=isRegister?'注册新账号':'登录';const link=document.querySelector('#auth-form a');link.innerText=isRegister?'已有账号？去登录':'没有账号？去注册';document.getElementById('invite-group').style.display=isRegister?'block':'none';}
+async function doAuth(){const name=document.getElementById('u-name').value;const pass=document.getElementById('u-pass').value;const code=document.getElementById('u-code').value;if(!name||!pass)return alert('请输入完整');if(isRegister&&!code)return alert('请输入邀请码');const action=isRegister?'register':'login';const btn=document.querySelector('#auth-form button');btn.innerText='处理中...';btn.disabled=true;try{const payload={username:name,password:pass};if(isRegister)payload.inviteCode=code;const res=await fetch(`${API}/user?action=${action}`,{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(payload)});const data=await res.json();if(data.error)throw new Error(data.error);if(isRegister){alert('注册成功，请登录');toggleAuthMode();}else{state.user={username:data.username,token:data.token};localStorage.setItem('qb_user',JSON.stringify(state.user));updateUserUI();closeModal();alert('登录成功！请记得定期备份数据。');}}catch(e){alert(e.message);}finally{btn.innerText='提交';btn.disabled=false;}}
+function logout(){state.user=null;localStorage.removeItem('qb_user');updateUserUI();closeModal();}
+async function syncUpload(){if(!state.user)return alert('请先登录');if(!confirm('确定要将本地进度上传覆盖云端吗？'))return;try{const res=await fetch(`${API}/user?action=upload`,{method:'POST',headers:{'Content-Type':'application/json','Authorization':'Bearer '+state.user.token},body:JSON.stringify({records:state.records,favs:[...state.favs]})});const data=await res.json();if(data.error)throw new Error(data.error);alert('备份成功！');document.getElementById('sync-time').innerText=new Date().toLocaleString();}catch(e){alert('上传失败: '+e.message);if(e.message.includes('失效'))logout();}}
+async function syncDownload(){if(!state.user)return alert('请先登录');if(!confirm('警告：这将使用云端数据覆盖本地进度，本地未备份的数据将丢失！确定吗？'))return;try{const res=await fetch(`${API}/user?action=download`,{method:'GET',headers:{'Authorization':'Bearer '+state.user.token}});const data=await res.json();if(data.error)throw new Error(data.error);if(data.empty)return alert('云端暂无备份数据');state.records=data.records||{};state.favs=new Set(data.favs||[]);reindexProgress();saveAll();alert('恢复成功！');document.getElementById('sync-time').innerText=new Date(data.updated_at).toLocaleString();vlist=null;loadChap(state.chapIdx);}catch(e){alert('下载失败: '+e.message);}}
+window.copyQ=(qid)=>{const q=questionIndex.get(qid);if(!q)return;const typeStr=q.type==='multi'?'多选题':'单选题';let text=`[${typeStr}] ${plainText(q.title)}
+`;q.options.forEach(o=>{text+=`${o.label}. ${plainText(o.text)}
+`;});text+=`
+正确答案: ${q.answer}`;if(q.analysis)text+=`
+解析: ${plainText(q.analysis)}`;navigator.clipboard.writeText(text).then(()=>{const btn=document.querySelector(`#card-${qid} .action:nth-child(3)`);if(btn){const origin=btn.innerHTML;btn.innerHTML='✅ 已复制';setTimeout(()=>btn.innerHTML=origin,2000);}}).catch(err=>alert('复制失败'));};const SEARCH_DEBOUNCE=200;let filterTimer=0;window.filterQ=()=>{clearTimeout(filterTimer);filterTimer=setTimeout(()=>renderList(),SEARCH_DEBOUNCE);};window.toggleAnalysis=(qid)=>{const box=document.getElementById(`analysis-${qid}`);if(box)box.classList.toggle('show');scheduleWindow();};function precacheBook(b){if(!('serviceWorker'in navigator)||!b)return;Promise.all(b.chapters.map(c=>patchShard(c).then(patched=>patched?null:c.shard))).then(shards=>{const urls=shards.filter(Boolean);if(!urls.length)return;navigator.serviceWorker.ready.then(reg=>reg.active&&reg.active.postMessage({type:'precache',urls}));});}
+function init(){document.getElementById('content').addEventListener('scroll',scheduleWindow,{passive:true});window.addEventListener('resize',scheduleWindow);if('serviceWorker'in navigator){navigator.serviceWorker.register('sw.js').catch(e=>console.warn("Service Worker:",e));}
+updateUserUI();loadStore().then(()=>{initIndexes();renderBooks();loadChap(0);precacheBook(BOOKS[state.bookIdx]);});document.addEventListener('visibilitychange',()=>{if(document.visibilityState==='hidden')flushStore();});window.addEventListener('pagehide',flushStore);}
+function renderBooks(){const html=BOOKS.map((b,i)=>{const total=b.chapters.reduce((n,c)=>n+chapterCount(c),0);const done=b.progress&&b.progress.done?`<div class="book-progress">已做 ${b.progress.done}/${total}</div>`:'';return`<div class="book-tab ${i===state.bookIdx?'active':''}" onclick="switchBook(${i})">${b.title}${done}</div>`;}).join('');document.getElementById('bookTabs').innerHTML=html;}
+function switchBook(idx){state.bookIdx=idx;renderBooks();loadChap(0);precacheBook(BOOKS[idx]);}
+function renderMenu(){const chapters=BOOKS[state.bookIdx].chapters;document.getElementById('chapList').innerHTML=chapters.map((c,i)=>
+`<div class="chapter-item ${i===state.chapIdx?'active':''}" onclick="loadChap(${i})">
+            ${c.title} <span style="font-size:0.8em; color:var(--gray)">(${chapterCount(c)})</span>
+            <div id="chap-prog-${i}">${progressBar(c.progress,chapterCount(c))}</div>
+        </div>`).join('');}
+function loadChap(idx){state.chapIdx=idx;renderMenu();document.getElementById('sidebar').classList.remove('show');const data=BOOKS[state.bookIdx];const chap=data.chapters[idx];if(!chap)return renderList();if(!chap.questions){document.getElementById('content').innerHTML='<div style="text-align:center; padding:20px; color:var(--gray)">加载中...</div>';}
+return fetchChapter(chap).then(()=>{if(BOOKS[state.bookIdx]!==data||state.chapIdx!==idx)return;renderList();loadStats(chap);}).catch(e=>{console.error("Chapter Load Error:",e);if(BOOKS[state.bookIdx]===data&&state.chapIdx===idx){document.getElementById('content').innerHTML=`<div style="text-align:center; padding:20px; color:var(--danger)">章节加载失败，<a href="#" onclick="loadChap(${idx}); return false">点击重试</a></div>`;}});}
+function loadStats(chap){const ids=chap.questions.map(q=>q.id);fetch(API+'/batch-info',{method:'POST',body:JSON.stringify({ids})}).then(async r=>{if(!r.ok){const err=await r.text();console.error("Batch Info Error:",r.status,err);return;}
+return r.json();}).then(res=>{if(res){state.stats={...state.stats,...res};updateStatsUI(ids);}}).catch(e=>console.error("Network Error:",e));}
+function renderList(dirty){const kw=document.getElementById('search').value.trim();if(kw)return renderSearch(kw);searchSeq++;const b=BOOKS[state.bookIdx];if(!b||!b.chapters[state.chapIdx]||!b.chapters[state.chapIdx].questions)return;const qs=b.chapters[state.chapIdx].questions;const items=qs.filter(q=>{const isWrong=state.records[q.id]?.status==='wrong';if(state.onlyWrong&&!isWrong)return false;if(state.onlyFav&&!state.favs.has(q.id))return false;return true;}).map((q,i,arr)=>{const prev=arr[i-1];return{q,groupStart:!!q.group_id&&(!prev||prev.group_id!==q.group_id)};});if(items.length&&vlist&&vlist.chap===b.chapters[state.chapIdx]&&vlist.el.isConnected){updateChart();updateList(items,dirty);return;}
+const{done,correct,wrong}=b.chapters[state.chapIdx].progress;const total=qs.length;const pCorrect=total?(correct/total*100):0;const pWrong=total?(wrong/total*100):0;const chartHtml=`
+    <div id="chap-header" style="position:sticky; top:0; z-index:100; background:rgba(255,255,255,0.95); backdrop-filter:blur(5px); padding:10px 15px; border-bottom:1px solid #eee; display:flex; align-items:center; justify-content:space-between; margin: -15px -15px 15px -15px; box-shadow:0 2px 5px rgba(0,0,0,0.05)">
+        <div style="font-weight:bold; font-size:1.1em">${b.chapters[state.chapIdx].title}</div>
+        <div style="display:flex; align-items:center; gap:10px">
+            <div class="text-stats" style="text-align:right; font-size:12px; line-height:1.2; color:#666">
+                <div>已做 ${done}/${total}</div>
+                <div>正确率 ${done?Math.round(correct/done*100):0}%</div>
+            </div>
+            <!-- Pie Chart with CSS Conic Gradient -->
+            <div class="chart-container" style="width:36px; height:36px; border-radius:50%; background: conic-gradient(
+                var(--success) 0% ${pCorrect}%, 
+                var(--danger) ${pCorrect}% ${pCorrect+pWrong}%, 
+                #eee ${pCorrect+pWrong}% 100%
+            )"></div>
+        </div>
+    </div>`;const chapDesc=b.chapters[state.chapIdx].desc;const descHtml=chapDesc?`<div class="chapter-desc" style="background:#f9f9f9; padding:15px; border-radius:8px; margin-bottom:20px; border-left:4px solid var(--primary); color:#555; font-size:0.95em; line-height:1.6">${chapDesc}</div>`:'';const content=document.getElementById('content');if(!items.length){vlist=null;cancelMath();content.innerHTML=chartHtml+descHtml+'<div style="text-align:center; padding:20px; color:var(--gray)">没有找到题目</div>';return;}
+content.innerHTML=chartHtml+descHtml+'<div id="vlist"><div></div><div></div></div>';mountList(document.getElementById('vlist'),items,b.chapters[state.chapIdx]);}
+const VLIST_OVERSCAN=800;const VLIST_ESTIMATE=320;const cardHeights={};const cardUI={};let vlist=null;let vlistFrame=0;function mountList(el,items,chap){const nodes=vlist?[...vlist.nodes.values()]:[];cancelMath();if(!vlist||vlist.chap!==chap)document.getElementById('content').scrollTo({top:0,behavior:'instant'});vlist={el,items,chap,top:el.firstChild,bottom:el.lastChild,start:0,end:0,nodes:new Map(),pool:nodes,offsets:null};measureOffsets();updateWindow();}
+function updateList(items,dirty){const keep=new Map();for(const[i,node]of vlist.nodes){const{q,groupStart}=vlist.items[i];node.remove();if(dirty&&dirty.has(q.id)){cancelMath(node);vlist.pool.push(node);}else keep.set(cardKey(q,groupStart),node);}
+Object.assign(vlist,{items,start:0,end:0,nodes:new Map(),keep});measureOffsets();updateWindow();for(const[key,node]of keep){saveCardUI(key.split('#')[0],node);cancelMath(node);}
+vlist.pool.push(...keep.values());vlist.keep=null;}
+function cardKey(q,groupStart){return groupStart?q.id+'#group':q.id;}
+function measureOffsets(){const{items}=vlist;const offsets=vlist.offsets=new Float64Array(items.length+1);for(let i=0;i<items.length;i++){offsets[i+1]=offsets[i]+(cardHeights[cardKey(items[i].q,items[i].groupStart)]||VLIST_ESTIMATE);}}
+function indexAt(y){const{offsets}=vlist;let lo=0,hi=offsets.length-2;while(lo<hi){const mid=(lo+hi)>>1;if(offsets[mid+1]>y)hi=mid;else lo=mid+1;}
+return lo;}
+function scheduleWindow(){if(vlist&&!vlistFrame)vlistFrame=requestAnimationFrame(updateWindow);}
+function updateWindow(){vlistFrame=0;if(!vlist||!vlist.el.isConnected)return;const content=document.getElementById('content');for(let round=0;round<4;round++){const base=vlist.el.getBoundingClientRect().top-content.getBoundingClientRect().top+content.scrollTop;const top=content.scrollTop-base;const start=indexAt(top-VLIST_OVERSCAN);const end=Math.min(vlist.items.length,indexAt(top+content.clientHeight+VLIST_OVERSCAN)+1);const added=start===vlist.start&&end===vlist.end?[]:renderRange(start,end);const anchor=indexAt(top);const anchorOffset=vlist.offsets[anchor];let changed=false;for(const[i,node]of vlist.nodes){const{q,groupStart}=vlist.items[i];const key=cardKey(q,groupStart),h=node.offsetHeight;if(h&&h!==cardHeights[key]){cardHeights[key]=h;changed=true;}}
+if(changed)measureOffsets();vlist.top.style.height=vlist.offsets[start]+'px';vlist.bottom.style.height=(vlist.offsets[vlist.items.length]-vlist.offsets[end])+'px';const shift=vlist.offsets[anchor]-anchorOffset;if(shift&&top>0)content.scrollTo({top:content.scrollTop+shift,behavior:'instant'});if(!added.length&&!changed)break;}}
+function renderRange(start,end){for(const[i,node]of vlist.nodes){if(i<start||i>=end)recycleCard(i,node);}
+const keepFrom=Math.max(start,vlist.start),keepTo=Math.min(end,vlist.end);const overlap=keepFrom<keepTo;const added=[];const before=overlap?vlist.nodes.get(keepFrom):vlist.bottom;for(let i=start;i<(overlap?keepFrom:end);i++)added.push([i,insertCard(i,before)]);if(overlap){for(let i=keepTo;i<end;i++)added.push([i,insertCard(i,vlist.bottom)]);}
+vlist.start=start;vlist.end=end;return added.filter(([,node])=>node);}
+function insertCard(i,before){const{q,groupStart}=vlist.items[i];const kept=vlist.keep&&vlist.keep.get(cardKey(q,groupStart));if(kept){vlist.keep.delete(cardKey(q,groupStart));vlist.el.insertBefore(kept,before);vlist.nodes.set(i,kept);return null;}
+const node=vlist.pool.pop()||document.createElement('div');node.className='vitem';node.innerHTML=buildCard(q,groupStart);vlist.el.insertBefore(node,before);vlist.nodes.set(i,node);watchMath(node,[...node.querySelectorAll('.tex')],cardKey(q,groupStart));if(state.records[q.id]?.checked)checkAnswer(q.id,true);const ui=cardUI[q.id];if(ui){delete cardUI[q.id];if(ui.analysis)document.getElementById(`analysis-${q.id}`).classList.add('show');if(ui.draft)document.getElementById(`cmt-in-${q.id}`).value=ui.draft;if(ui.comments)toggleComments(q.id,true);}
+return node;}
+function recycleCard(i,node){saveCardUI(vlist.items[i].q.id,node);cancelMath(node);node.remove();vlist.nodes.delete(i);vlist.pool.push(node);}
+function saveCardUI(qid,node){const ui={analysis:!state.records[qid]?.checked&&node.querySelector('.analysis-box').classList.contains('show'),comments:node.querySelector('.comments-box').style.display==='block',draft:node.querySelector('.cmt-textarea').value,};if(ui.analysis||ui.comments||ui.draft)cardUI[qid]=ui;}
+function scrollToQuestion(qid){if(!vlist)return;const i=vlist.items.findIndex(it=>it.q.id===qid);if(i<0)return;const content=document.getElementById('content');const base=vlist.el.getBoundingClientRect().top-content.getBoundingClientRect().top+content.scrollTop;content.scrollTo({top:base+vlist.offsets[i],behavior:'instant'});updateWindow();const card=document.getElementById(`card-${qid}`);if(card)card.scrollIntoView({block:'center'});}
+function buildCard(q,isGroupStart=false){const isFav=state.favs.has(q.id);const stat=state.stats[q.id]||{fav:0,rate:0,total:0};let groupHeader='';if(isGroupStart&&q.group_id){const optsHtml=q.options.map(o=>
+`<div class="group-option-item"><b>${o.label}.</b> ${o.text}</div>`).join('');groupHeader=`<div class="group-options-box">${optsHtml}</div>`;}
+let contentHtml='';let optionsHtml='';if(q.type==='essay'||q.type==='mix'||q.type==='case'){optionsHtml=`<button onclick="toggleAnalysis('${q.id}')" style="padding:8px 15px; background:var(--primary); color:#fff; border:none; border-radius:4px; cursor:pointer">查看答案</button>`;}else{if(q.group_id){optionsHtml=`<div class="simple-options-container">`+
+q.options.map(o=>
+`<div class="simple-option-btn" id="opt-${q.id}-${o.label}" onclick="clickOpt('${q.id}', '${o.label}', '${q.type}')">${o.label}</div>`).join('')+
+`</div>`;}else{optionsHtml=q.options.map(o=>
+`<div class="option" id="opt-${q.id}-${o.label}" onclick="clickOpt('${q.id}', '${o.label}', '${q.type}')">
+                    <b style="width:25px">${o.label}.</b> 
+                    <span>${o.text}</span>
+                 </div>`).join('');}}
+const submitBtn=q.type==='multi'?`<button onclick="checkAnswer('${q.id}')" style="margin-top:10px; padding:5px 15px; background:var(--primary); color:#fff; border:none; border-radius:4px">提交</button>`:'';let typeLabel='单选题';if(q.type==='multi')typeLabel='多选题';else if(q.type==='essay')typeLabel='名词解释';else if(q.type==='mix')typeLabel='简答题';else if(q.type==='case')typeLabel='病例分析';const seqBadge=q.seq?`<span class="badg">[${q.seq}]</span>`:'';return`
+    <div class="card" id="card-${q.id}">
+        <div style="font-size:12px; color:var(--gray); margin-bottom:5px">ID: ${q.id} · ${typeLabel}</div>
+        ${groupHeader}
+        <div class="q-title">
+            ${seqBadge} 
+            ${q.title}
+        </div>
+        <div>${optionsHtml}</div>
+        ${submitBtn}
+
+        <div class="analysis-box" id="analysis-${q.id}">
+            <div><strong>参考答案:</strong> ${q.answer||'见解析'}</div>
+            <div style="margin-top:5px"><strong>解析:</strong> 
+                <div class="md-content">${q.analysis||'暂无解析'}</div>
+                ${(q.type==='essay'||q.type==='mix'||q.type==='case')?'':
+`<span class="stat-btn" onclick="showRate('${q.id}', this)">📊 查看正确率</span>
+                <span class="stat-display" id="rate-${q.id}"></span>`}
+            </div>
+        </div>
+
+        <div class="footer-actions">
+            <div class="action ${isFav?'fav-active':''}" onclick="toggleFav('${q.id}', this)">
+                ★ <span class="fav-cnt">${stat.fav}</span>
+            </div>
+            <div class="action" onclick="toggleComments('${q.id}')">💬 评论</div>
+            <div class="action" onclick="copyQ('${q.id}')">📋 复制</div>
+        </div>
+
+        <div class="comments-box" id="cmt-box-${q.id}">
+            <div id="cmt-list-${q.id}" style="margin-bottom:10px; max-height:200px; overflow-y:auto">加载中...</div>
+            <div class="input-tabs">
+                <span class="tab active" onclick="switchCommentTab('${q.id}', 'edit')">编辑</span>
+                <span class="tab" onclick="switchCommentTab('${q.id}', 'preview')">预览</span>
+            </div>
+            <div id="cmt-edit-${q.id}" style="display:block">
+                <div style="margin-bottom:5px; display:flex; gap:5px">
+                    <input id="nick-${q.id}" placeholder="昵称" style="width:80px; padding:5px; border:1px solid #ddd; border-radius:4px" value="${state.nick}">
+                    <div class="toolbar">
+                        <button onclick="insertMd('${q.id}', '**', '**')">B</button>
+                        <button onclick="insertMd('${q.id}', '*', '*')">I</button>
+                        <button onclick="insertMd('${q.id}', '\`', '\`')">Code</button>
+                    </div>
+                </div>
+                <textarea id="cmt-in-${q.id}" class="cmt-textarea" placeholder="支持 Markdown 格式..."></textarea>
+                <div style="text-align:right; margin-top:5px">
+                    <button class="primary-btn" onclick="postCmt('${q.id}')">发布评论</button>
+                </div>
+            </div>
+            <div id="cmt-preview-${q.id}" class="md-content cmt-preview-box" style="display:none"></div>
+        </div>
+    </div>`;}
+window.clickOpt=(qid,label,type)=>{if(state.records[qid]?.checked)return;let ans=state.records[qid]?.ans||[];if(type==='single'){state.records[qid]={ans:[label],checked:false};checkAnswer(qid);}else{if(ans.includes(label))ans=ans.filter(x=>x!==label);else ans.push(label);state.records[qid]={ans,checked:false};document.querySelectorAll(`#card-${qid} .option, #card-${qid} .simple-option-btn`).forEach(el=>{el.classList.remove('selected');const l=el.id.split('-').pop();if(ans.includes(l))el.classList.add('selected');});}
+saveRecord(qid);};window.checkAnswer=(qid,isReplay=false)=>{const q=questionIndex.get(qid);if(!q)return;const myAns=state.records[qid]?.ans||[];const rightStr=q.answer.split('').sort().join('');const myStr=[...myAns].sort().join('');const isCorrect=rightStr===myStr;const before=state.records[qid].status;state.records[qid].checked=true;state.records[qid].status=isCorrect?'correct':'wrong';updateProgress(qid,before,state.records[qid].status);if(!isReplay)saveRecord(qid);const card=document.getElementById(`card-${qid}`);if(card){card.querySelectorAll('.option, .simple-option-btn').forEach(el=>{el.classList.remove('selected');el.classList.remove('correct');el.classList.remove('wrong');const l=el.id.split('-').pop();if(q.answer.includes(l))el.classList.add('correct');else if(myAns.includes(l))el.classList.add('wrong');});}
+const anaBox=document.getElementById(`analysis-${qid}`);if(anaBox)anaBox.classList.add('show');if(!isReplay){toggleComments(qid,true);reportAnswer(qid,isCorrect);updateChart();scheduleWindow();}};function reportAnswer(qid,isCorrect){fetch(API+'/stats',{method:'POST',body:JSON.stringify({questionId:qid,type:'answer',value:isCorrect?1:0})});}
+function updateChart(){const b=BOOKS[state.bookIdx];if(!b||!b.chapters[state.chapIdx]||!b.chapters[state.chapIdx].questions)return;const qs=b.chapters[state.chapIdx].questions;const{done,correct,wrong}=b.chapters[state.chapIdx].progress;const total=qs.length;const pCorrect=total?(correct/total*100):0;const pWrong=total?(wrong/total*100):0;const header=document.getElementById('chap-header');if(header){const chartDiv=header.querySelector('.chart-container');const textDiv=header.querySelector('.text-stats');if(textDiv){textDiv.innerHTML=`<div>已做 ${done}/${total}</div><div>正确率 ${done?Math.round(correct/done*100):0}%</div>`;}
+if(chartDiv){chartDiv.style.background=`conic-gradient(
+                var(--success) 0% ${pCorrect}%, 
+                var(--danger) ${pCorrect}% ${pCorrect+pWrong}%, 
+                #eee ${pCorrect+pWrong}% 100%
+            )`;}}}
+window.showRate=(qid,btn)=>{const stat=state.stats[qid];const span=document.getElementById(`rate-${qid}`);if(stat&&stat.total>0){span.innerText=`正确率: ${stat.rate}% (共 ${stat.total} 次)`;}else{span.innerText="暂无数据";}
+span.style.display='inline';btn.style.display='none';};window.toggleComments=async(qid,forceOpen=false)=>{const box=document.getElementById(`cmt-box-${qid}`);if(!forceOpen&&box.style.display==='block'){box.style.display='none';scheduleWindow();return;}
+box.style.display='block';scheduleWindow();const res=await fetch(`${API}/comments?qid=${qid}`);const list=await res.json();if(!res.ok){alert("加载评论失败: "+(list.error||"未知错误"));document.getElementById(`cmt-list-${qid}`).innerHTML='<div style="color:red; padding:10px">加载失败</div>';return;}
+await loadMarked();const currUser=localStorage.getItem('qb_username');console.log("Current User:",currUser);const html=list.map(c=>{const isMine=currUser&&(c.nickname===currUser);if(c.nickname===currUser&&!isMine)console.warn("Mismatch type/value?",c.nickname,currUser);const editBtn=isMine?`<span style="color:blue; cursor:pointer; margin-left:10px; font-size:0.8em" onclick="editCmt('${qid}', ${c.id}, this)">[编辑]</span>`:'';return`
+        <div class="comment-item" id="cmt-item-${c.id}">
+            <div>
+                <b style="color:var(--primary)">${c.nickname}</b> 
+                <span style="font-size:0.8em; color:#aaa">${new Date(c.created_at*1000).toLocaleDateString()}</span>
+                ${editBtn}
+            </div>
+            <div class="md-content" id="cmt-content-${c.id}">${marked.parse(c.content)}</div>
+            <div style="display:none" id="cmt-raw-${c.id}">${c.content}</div>
+        </div>`;}).join('')||'<div style="padding:10px; text-align:center">暂无评论</div>';const listEl=document.getElementById(`cmt-list-${qid}`);if(!listEl)return;cancelMath(listEl);listEl.innerHTML=html;scheduleWindow();for(const c of list){if(!hasTeX(c.content))continue;const el=document.getElementById(`cmt-content-${c.id}`);watchMath(el,[el]);}};window.editCmt=(qid,cid,btn)=>{const raw=document.getElementById(`cmt-raw-${cid}`).innerText;document.getElementById(`cmt-in-${qid}`).value=raw;const postBtn=document.querySelector(`#cmt-edit-${qid} .primary-btn`);postBtn.innerText="更新评论";postBtn.dataset.mode="update";postBtn.dataset.cid=cid;let cancelBtn=document.getElementById(`cmt-cancel-${qid}`);if(!cancelBtn){cancelBtn=document.createElement('button');cancelBtn.id=`cmt-cancel-${qid}`;cancelBtn.innerText="取消";cancelBtn.style.marginLeft="10px";cancelBtn.style.background="#eee";cancelBtn.onclick=()=>window.cancelEdit(qid);postBtn.parentNode.appendChild(cancelBtn);}
+cancelBtn.style.display='inline-block';document.getElementById(`cmt-edit-${qid}`).scrollIntoView({behavior:'smooth'});};window.cancelEdit=(qid)=>{const postBtn=document.querySelector(`#cmt-edit-${qid} .primary-btn`);postBtn.innerText="发布评论";postBtn.dataset.mode="create";delete postBtn.dataset.cid;const cancelBtn=document.getElementById(`cmt-cancel-${qid}`);if(cancelBtn)cancelBtn.style.display='none';document.getElementById(`cmt-in-${qid}`).value='';};window.postCmt=async(qid)=>{const nick=document.getElementById(`nick-${qid}`).value;const content=document.getElementById(`cmt-in-${qid}`).value;if(!nick||!content)return alert("请填写完整");localStorage.setItem('qb_nick',nick);state.nick=nick;const token=localStorage.getItem('qb_token');const headers={'Content-Type':'application/json'};if(token)headers['Authorization']='Bearer '+token;const btn=document.querySelector(`#cmt-edit-${qid} .primary-btn`);const mode=btn.dataset.mode||'create';if(mode==='update'){const cid=btn.dataset.cid;res=await fetch(`${API}/comments`,{method:'PUT',headers:headers,body:JSON.stringify({commentId:cid,content})});if(res.ok)window.cancelEdit(qid);}else{res=await fetch(`${API}/comments?qid=${qid}`,{method:'POST',headers:headers,body:JSON.stringify({nickname:nick,content})});}
+const data=await res.json();if(!res.ok){alert("操作失败: "+(data.error||"未知错误"));}else{document.getElementById(`cmt-in-${qid}`).value='';toggleComments(qid,true);}};window.switchCommentTab=async(qid,mode)=>{const editBox=document.getElementById(`cmt-edit-${qid}`);const prevBox=document.getElementById(`cmt-preview-${qid}`);const card=document.getElementById(`card-${qid}`);const tabs=card.querySelectorAll('.input-tabs .tab');if(mode==='edit'){editBox.style.display='block';prevBox.style.display='none';tabs[0].classList.add('active');tabs[1].classList.remove('active');}else{const content=document.getElementById(`cmt-in-${qid}`).value;editBox.style.display='none';prevBox.style.display='block';if(content)await loadMarked();prevBox.innerHTML=content?marked.parse(content):'<i style="color:#999">暂无内容</i>';cancelMath(prevBox);if(content&&hasTeX(content))watchMath(prevBox,[prevBox]);tabs[0].classList.remove('active');tabs[1].classList.add('active');}};window.insertMd=(qid,start,end)=>{const textarea=document.getElementById(`cmt-in-${qid}`);const s=textarea.selectionStart;const e=textarea.selectionEnd;const val=textarea.value;const before=val.substring(0,s);const sel=val.substring(s,e);const after=val.substring(e);textarea.value=before+start+sel+end+after;textarea.selectionStart=s+start.length;textarea.selectionEnd=e+start.length;textarea.focus();};window.toggleFav=async(qid,el)=>{const isAdd=!state.favs.has(qid);if(isAdd)state.favs.add(qid);else state.favs.delete(qid);saveFav(qid);el.classList.toggle('fav-active');const numSpan=el.querySelector('.fav-cnt');numSpan.innerText=parseInt(numSpan.innerText)+(isAdd?1:-1);fetch(API+'/stats',{method:'POST',body:JSON.stringify({questionId:qid,type:'fav',value:isAdd?1:-1})});};window.toggleSidebar=()=>document.getElementById('sidebar').classList.toggle('show');window.toggleWrong=()=>{state.onlyWrong=!state.onlyWrong;document.getElementById('btnWrong').style.background=state.onlyWrong?'var(--primary)':'none';document.getElementById('btnWrong').style.color=state.onlyWrong?'#fff':'var(--text)';renderList();};window.toggleFavFilter=()=>{state.onlyFav=!state.onlyFav;document.getElementById('btnFavFilter').style.background=state.onlyFav?'var(--primary)':'none';document.getElementById('btnFavFilter').style.color=state.onlyFav?'#fff':'var(--text)';renderList();};window.resetProgress=()=>{if(!confirm("确定要重置当前章节的答题进度吗？此操作不可恢复。"))return;const b=BOOKS[state.bookIdx];if(!b)return;const chap=b.chapters[state.chapIdx];if(!chap||!chap.questions)return;const reset=new Set();chap.questions.forEach(q=>{if(state.records[q.id]){const before=state.records[q.id].status;delete state.records[q.id];saveRecord(q.id);reset.add(q.id);updateProgress(q.id,before,undefined);}});const count=reset.size;if(count>0){renderList(reset);alert(`已重置 ${count} 道题目的进度。`);}else{alert("当前章节没有答题记录。");}};window.updateStatsUI=(ids)=>{ids.forEach(id=>{const el=document.querySelector(`#card-${id} .fav-cnt`);if(el&&state.stats[id])el.innerText=state.stats[id].fav;});};init();const QTYPES=['single','multi','essay','mix','case'];function decodeChapter(buf){const head=new Uint32Array(buf,0,5);if(head[0]!==0x314b4251)throw new Error('not a QBK1 shard');const[,n,s,m,metaLen]=head;const bytes=new Uint8Array(buf);const utf8=new TextDecoder();let off=20;const chap=JSON.parse(utf8.decode(bytes.subarray(off,off+metaLen)));off+=(metaLen+3)&~3;const u32=len=>{const a=new Uint32Array(buf,off,len);off+=len*4;return a;};const strOff=u32(s+1);const idCol=u32(n),seqCol=u32(n),titleCol=u32(n),answerCol=u32(n),analysisCol=u32(n),groupCol=u32(n);const optStart=u32(n),optLabel=u32(m),optText=u32(m);const typeCol=bytes.subarray(off,off+n),optCount=bytes.subarray(off+n,off+2*n);let text=null;const str=i=>{if(i===0xffffffff)return null;if(text===null)text=utf8.decode(bytes.subarray(off+2*n));return text.slice(strOff[i],strOff[i+1]);};class Question{constructor(i){this.i=i;}
+get id(){return str(idCol[this.i]);}
+get seq(){return str(seqCol[this.i]);}
+get title(){return str(titleCol[this.i]);}
+get answer(){return str(answerCol[this.i]);}
+get analysis(){return str(analysisCol[this.i]);}
+get group_id(){return str(groupCol[this.i]);}
+get type(){return QTYPES[typeCol[this.i]];}
+get options(){if(!this._options){const first=optStart[this.i];this._options=[];for(let r=first;r<first+optCount[this.i];r++){this._options.push({label:str(optLabel[r]),text:str(optText[r])});}}
+return this._options;}}
+chap.questions=Array.from({length:n},(_,i)=>new Question(i));return chap;}
\ No newline at end of file
@@ -0,0 +1,84 @@
+// 由 convert.py 生成，请勿手动修改
+const VERSION = "6c6c9b90c3";
+const SCOPE = self.registration.scope;
+const SHELL = ["./", "index.html", "assets/app.2969da468f.css", "assets/app.40c1865b49.js", "manifest.json"].map(p => new URL(p, SCOPE).href);
+const DATA = new Set(["data/q1-1.74ce060a20.json", "data/q1-2.9755f06a3b.json", "data/q1-3.7bde24363a.json", "data/q1-4.c1d08c9b59.json", "data/q1-search.30cea6e7f9.json", "data/q2-1.e3492c1951.json", "data/q2-10.c6cb402a70.json", "data/q2-11.96fd2981be.json", "data/q2-12.40417f04c4.json", "data/q2-13.ea684dc447.json", "data/q2-14.a081521aa1.json", "data/q2-15.a1460c88cb.json", "data/q2-16.f9bc3aa9a9.json", "data/q2-17.5f2bac318b.json", "data/q2-18.087d7e17a9.json", "data/q2-2.d7ae4e59b3.json", "data/q2-3.212dbf9d5d.json", "data/q2-4.b1b532f1d9.json", "data/q2-5.c83466d37b.json", "data/q2-6.a8c288c8bf.json", "data/q2-7.fd7c37531a.json", "data/q2-8.eaff6eb2b2.json", "data/q2-9.33dd1e2ebd.json", "data/q2-search.9638d5e126.json"].map(p => new URL(p, SCOPE).href));
+const CDN = ["https://cdn.jsdelivr.net"];
+const SHELL_CACHE = `qbank-shell-${VERSION}`;
+const DATA_CACHE = 'qbank-data';
+const CDN_CACHE = 'qbank-cdn';
+
+self.addEventListener('install', e => {
+    e.waitUntil(caches.open(SHELL_CACHE).then(c => c.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', e => {
+    e.waitUntil((async () => {
+        for (const key of await caches.keys()) {
+            if (key.startsWith('qbank-shell-') && key !== SHELL_CACHE) await caches.delete(key);
+        }
+        // 数据文件名含内容哈希: 只删除本次构建不再引用的
+        const data = await caches.open(DATA_CACHE);
+        for (const req of await data.keys()) {
+            if (!DATA.has(req.url)) await data.delete(req);
+        }
+        await self.clients.claim();
+    })());
+});
+
+async function cacheFirst(cacheName, req) {
+    const cache = await caches.open(cacheName);
+    const hit = await cache.match(req);
+    if (hit) return hit;
+    const res = await fetch(req);
+    if (res.ok) cache.put(req, res.clone());
+    return res;
+}
+
+async function staleWhileRevalidate(cacheName, req, e) {
+    const cache = await caches.open(cacheName);
+    const hit = await cache.match(req);
+    const update = fetch(req).then(res => {
+        if (res.ok || res.type === 'opaque') cache.put(req, res.clone());
+        return res;
+    });
+    if (hit) {
+        e.waitUntil(update.catch(() => {}));
+        return hit;
+    }
+    return update;
+}
+
+self.addEventListener('fetch', e => {
+    const req = e.request;
+    if (req.method !== 'GET') return;
+    const url = req.url.split('#')[0];
+    if (req.mode === 'navigate' && url.startsWith(SCOPE)) {
+        // 入口页先走网络，保证与服务器上的数据文件同一版本；离线时用缓存的外壳
+        e.respondWith(fetch(req).catch(() => caches.match(SHELL[0]).then(hit => hit || Response.error())));
+    } else if (SHELL.includes(url)) {
+        e.respondWith(cacheFirst(SHELL_CACHE, req));
+    } else if (DATA.has(url)) {
+        e.respondWith(cacheFirst(DATA_CACHE, req));
+    } else if (CDN.some(origin => url.startsWith(origin))) {
+        e.respondWith(staleWhileRevalidate(CDN_CACHE, req, e));
+    }
+    // 其他请求 (API 等) 直接走网络
+});
+
+// 页面切换书目时请求预缓存该书的全部章节
+self.addEventListener('message', e => {
+    if (!e.data || e.data.type !== 'precache') return;
+    e.waitUntil((async () => {
+        const cache = await caches.open(DATA_CACHE);
+        for (const path of e.data.urls) {
+            const href = new URL(path, SCOPE).href;
+            if (!DATA.has(href) || await cache.match(href)) continue;
+            try {
+                await cache.add(href);
+            } catch (err) {
+                // 离线或请求失败: 下次再试
+            }
+        }
+    })());
+});
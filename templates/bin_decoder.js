@@ -0,0 +1,45 @@
+// 列式二进制分片 (BANK_FORMAT = 'binary')，布局见 convert.py encode_chapter_bin
+const QTYPES = ['single', 'multi', 'essay', 'mix', 'case'];
+function decodeChapter(buf) {
+    const head = new Uint32Array(buf, 0, 5);
+    if (head[0] !== 0x314b4251) throw new Error('not a QBK1 shard'); // 'QBK1'
+    const [, n, s, m, metaLen] = head;
+    const bytes = new Uint8Array(buf);
+    const utf8 = new TextDecoder();
+    let off = 20;
+    const chap = JSON.parse(utf8.decode(bytes.subarray(off, off + metaLen)));
+    off += (metaLen + 3) & ~3;
+    const u32 = len => { const a = new Uint32Array(buf, off, len); off += len * 4; return a; };
+    const strOff = u32(s + 1);
+    const idCol = u32(n), seqCol = u32(n), titleCol = u32(n), answerCol = u32(n), analysisCol = u32(n), groupCol = u32(n);
+    const optStart = u32(n), optLabel = u32(m), optText = u32(m);
+    const typeCol = bytes.subarray(off, off + n), optCount = bytes.subarray(off + n, off + 2 * n);
+    let text = null; // the string blob, decoded in one go on first use
+    const str = i => {
+        if (i === 0xffffffff) return null;
+        if (text === null) text = utf8.decode(bytes.subarray(off + 2 * n));
+        return text.slice(strOff[i], strOff[i + 1]);
+    };
+    class Question {
+        constructor(i) { this.i = i; }
+        get id() { return str(idCol[this.i]); }
+        get seq() { return str(seqCol[this.i]); }
+        get title() { return str(titleCol[this.i]); }
+        get answer() { return str(answerCol[this.i]); }
+        get analysis() { return str(analysisCol[this.i]); }
+        get group_id() { return str(groupCol[this.i]); }
+        get type() { return QTYPES[typeCol[this.i]]; }
+        get options() {
+            if (!this._options) {
+                const first = optStart[this.i];
+                this._options = [];
+                for (let r = first; r < first + optCount[this.i]; r++) {
+                    this._options.push({ label: str(optLabel[r]), text: str(optText[r]) });
+                }
+            }
+            return this._options;
+        }
+    }
+    chap.questions = Array.from({ length: n }, (_, i) => new Question(i));
+    return chap;
+}
@@ -0,0 +1,73 @@
+"""DeltaPublisher across two sharded builds of a small bank."""
+import os
+import io
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import convert
+
+QUESTION = """{n}. {title}
+
+A. 新生儿期
+B. 婴儿期
+C. 幼儿期
+D. 学龄前期
+E. 学龄期
+
+答案：B
+"""
+
+def bank(*titles):
+    return "# 第一章 测试\n\n## 选择题\n\n" + "\n".join(QUESTION.format(n=i + 1, title=t) for i, t in enumerate(titles))
+
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='qbank-test-')
+        self.out = os.path.join(self.root, 'dist')
+        self.md = os.path.join(self.root, 'bank.md')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def build(self, text):
+        """One sharded build of text as book "t"; returns the chapter's manifest entry."""
+        with open(self.md, 'w', encoding='utf-8') as f:
+            f.write(text)
+        books = [{"id": "t", "title": "T", "chapters": convert.iter_chapters([self.md])}]
+        with contextlib.redirect_stdout(io.StringIO()):
+            manifest = convert.write_shards(books, self.out, delta=convert.DeltaPublisher(self.out))
+        with open(os.path.join(self.out, convert.MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"books": manifest}, f, ensure_ascii=False)
+        return manifest[0]['chapters'][0]
+
+    def read(self, path):
+        with open(os.path.join(self.out, path), encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_duplicate_in_chapter(self):
+        first = self.build(bank("小儿生长发育最快的时期是", "正常足月儿出生体重约为", "小儿生长发育最快的时期是"))
+        old = self.read(first['shard'])
+        self.assertIsInstance(old['questions'][2], list) # 重复题目以 [key, seq] 引用
+
+        second = self.build(bank("小儿生长发育最快的时期是", "正常足月新生儿出生体重约为", "小儿生长发育最快的时期是"))
+        self.assertEqual(second['delta']['from'], first['shard'])
+
+        # 补丁作用在旧分片上得到新分片
+        new, patch = self.read(second['shard']), self.read(second['delta']['patch'])
+        patched = [old['questions'][e] if isinstance(e, int) else e for e in patch['questions']]
+        self.assertEqual(patched, new['questions'])
+
+        change, = self.read(convert.CHANGELOG_FILE)['builds'][0]['chapters']
+        self.assertEqual(len(change['added']), 1)
+        self.assertEqual(len(change['removed']), 1)
+        self.assertEqual(change['modified'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""QuestionStore keys and ID collision reporting."""
+import os
+import io
+import sys
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import convert
+
+QID = 'a3f09c41be20'
+
+
+class StoreTest(unittest.TestCase):
+    def test_repeat_and_variant(self):
+        store = convert.QuestionStore()
+        self.assertEqual(store.add(QID, 'd1', '{"a": 1}', '第一章'), (QID, True))
+        self.assertEqual(store.add(QID, 'd1', '{"a": 1}', '第二章'), (QID, False))
+        self.assertEqual(store.add(QID, 'd1', '{"a": 2}', '第二章'), (QID + '~1', True))
+        self.assertEqual(store.add(QID, 'd1', '{"a": 2}', '第三章'), (QID + '~1', False))
+        self.assertEqual(store.bodies, 2)
+        self.assertEqual(store.collisions, {})
+
+    def test_collision_names_first_chapter(self):
+        store = convert.QuestionStore()
+        store.add('000000000001', 'x', '{"b": 0}', '第一章')
+        store.add(QID, 'd1', '{"a": 1}', '第二章')
+        store.add(QID, 'd2', '{"a": 2}', '第五章')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            store.report()
+        self.assertIn(f'Warning: ID collision {QID}: different questions in "第二章" and "第五章"', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()